@@ -121,10 +121,13 @@ def play_demo(midiFile, guidanceMode):
     Demonstrates a taks by playing back its MIDI file (notes and metronome)
     and giving the according haptic feedback with Dexmo (depending on guidance mode).
 
-    @param midiFile: MIDI file of the task.
+    @param midiFile: MIDI file of the task (path or mido.MidiFile).
     @param guidanceMode: Current guidance Mode (Dexmo).
     @return: None
     """
+    if not isinstance(midiFile, MidiFile):
+        midiFile = MidiFile(midiFile)
+
     if guidanceMode != "None":
         timestr = time.strftime("%Y%m%d-%H%M%S")
         log = "/tmp/DexmoPiano/" + timestr + ".log"
@@ -137,7 +140,7 @@ def play_demo(midiFile, guidanceMode):
     if midi_interface != "None":
         dexmoPort = mido.open_output(midi_interface)
     with mido.open_output(midi_interface_sound) as soundPort:
-        for msg in MidiFile(midiFile).play():
+        for msg in midiFile.play():
             # sound from piano and metronome track,channel 9 is metronome, piano is 0
             if metronome:
                 if msg.channel == 0 or msg.channel == 9:
@@ -164,12 +167,15 @@ def practice_task(midiFile, noteInfoTemp, noteInfoList, guidanceMode, showVertic
     Starts the practice task by playing only the metronome (if chosen)
     and giving the according haptic feedback with Dexmo (depending on guidance mode).
 
-    @param midiFile: MIDI file of the task.
+    @param midiFile: MIDI file of the task (path or mido.MidiFile).
     @param noteInfoTemp: Temporary list containing each possible note's current state.
     @param noteInfoList: List of all notes played by the user.
     @param guidanceMode: Current guidance Mode (Dexmo).
     @return: None
     """
+    if not isinstance(midiFile, MidiFile):
+        midiFile = MidiFile(midiFile)
+
     if guidanceMode != "None":
         timestr = time.strftime("%Y%m%d-%H%M%S")
         log = "/tmp/DexmoPiano/" + timestr + ".log"
@@ -188,7 +194,7 @@ def practice_task(midiFile, noteInfoTemp, noteInfoList, guidanceMode, showVertic
         # set start time
         nh.initTime()
 
-        for msg in MidiFile(midiFile):
+        for msg in midiFile:
             if not msg.is_meta:
                 # do not play all notes at once
                 time.sleep(msg.time)
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Compares the memory needed by the DP alignments (mappingDP) for growing piece
+lengths. Every run happens in its own process, as the peak RSS of a process
+never decreases.
+
+usage: python3 -m error_calc.benchmarkMemory [n_notes ...]
+"""
+
+import multiprocessing
+import random
+import resource
+import sys
+import time
+import tracemalloc
+from collections import namedtuple
+
+from error_calc import mappingDP
+
+# from midiInput import NoteInfo
+NoteInfo = namedtuple("NoteInfo", ["pitch", "velocity", "note_on_time", "note_off_time"])
+
+LENGTHS = [500, 1000, 2000, 4000]
+ALIGN_FUNCTIONS = dict(full=mappingDP.align,
+                       linear_space=mappingDP.align_linear_space)
+
+
+def random_performance(n_notes, seed=0):
+    """
+    Creates a target of n_notes notes and a played version of it with some
+    timing noise, missing and extra notes.
+    """
+    rng = random.Random(seed)
+    target = list()
+    for i in range(n_notes):
+        on = i * 0.3
+        target.append(NoteInfo(rng.randint(60, 67), 64, on, on + 0.25))
+
+    actual = list()
+    for note in target:
+        if rng.random() < 0.05:
+            continue
+        on = note.note_on_time + rng.gauss(0, 0.05)
+        actual.append(NoteInfo(note.pitch, 64, on, on + 0.25))
+        if rng.random() < 0.05:
+            actual.append(NoteInfo(rng.randint(60, 67), 64, on + 0.1, on + 0.3))
+
+    return target, actual
+
+
+def _run(mode, n_notes, queue):
+    target, actual = random_performance(n_notes)
+
+    tracemalloc.start()
+    start = time.time()
+    mapping, cost = ALIGN_FUNCTIONS[mode](target, actual)
+    duration = time.time() - start
+    _, traced_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    # ru_maxrss is in kilobytes on linux
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    queue.put((duration, traced_peak, max_rss, cost))
+
+
+def measure(mode, n_notes):
+    """
+    @return: duration (s), peak traced allocations (bytes), peak RSS (kB), cost
+    """
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_run, args=(mode, n_notes, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+if __name__ == "__main__":
+    lengths = [int(arg) for arg in sys.argv[1:]] or LENGTHS
+
+    print("{:>7} {:>13} {:>9} {:>14} {:>13} {:>10}".format(
+        "notes", "mode", "time (s)", "allocated (MB)", "peak RSS (MB)", "cost"))
+    for n_notes in lengths:
+        for mode in ALIGN_FUNCTIONS:
+            duration, traced_peak, max_rss, cost = measure(mode, n_notes)
+            print("{:>7} {:>13} {:>9.2f} {:>14.1f} {:>13.1f} {:>10.2f}".format(
+                n_notes, mode, duration, traced_peak / 2**20, max_rss / 2**10, cost))
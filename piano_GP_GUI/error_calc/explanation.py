@@ -1,5 +1,7 @@
 from collections import namedtuple
-from collections import defaultdict
+
+import numpy as np
+
 from error_calc.explanation_helpers import NoteExpected, NoteExtra, NoteMissing
 
 Error = namedtuple("Error", ["pitch", "note_hold_time", "timing",
@@ -8,86 +10,115 @@ Error = namedtuple("Error", ["pitch", "note_hold_time", "timing",
                              "number_of_notes"
                              ])
 
-def get_anchor_map(target_notes):
-    anchor_map = defaultdict(lambda: (-1, 0))
-
-    for i in range(len(target_notes)):
-        note_i = target_notes[i]
-
-        for j in reversed(range(0, i)):
-            # print("j", j)
-            note_j = target_notes[j]
-            ANCH_THR = 0.1  # seconds ## not sure if needed / has to be greater 0
-            time_after_anchor = note_i.note_on_time - note_j.note_on_time
-            # print("j", j, time_after_anchor)
-            if time_after_anchor > ANCH_THR:
-                anchor_map[i] = (j, time_after_anchor)
-                break
-
-    # print("ANCHOR MAP", anchor_map)
-    return anchor_map
-
-
-def note_info_list_add_debug(note_info_list, mapping, anchor_map):
-    NoteInfoDebug = namedtuple("NoteInfoDebug", ["pitch", "velocity",
-                                                 "note_on_time", "note_off_time",
-                                                 "time_after_anchor",
-                                                 "note_hold_time"])
-
-    debug_list = list()
-    # for t_i, a_i in enumerate(mapping):
-    for i in range(len(note_info_list)):
-        note_i = note_info_list[i]
-        n = note_i
-        note_hold_time = n.note_off_time - n.note_on_time
-
-        if i not in mapping:
-            ## can't calculate anchor for extra notes!
-            debug_list.append(
-                NoteInfoDebug(n.pitch, n.velocity, n.note_on_time, n.note_off_time,
-                              -999, note_hold_time))
-            continue
-
-        t_i = mapping.index(i)
+# a note's anchor has to start more than this many seconds before it
+ANCH_THR = 0.1  # seconds ## not sure if needed / has to be greater 0
+# time_after_anchor of extra notes (can't calculate anchor for extra notes!)
+NO_ANCHOR = -999
 
-        anchor, anchor_td = anchor_map[t_i]
-        if anchor == -1:
-            time_after_anchor = 0
-        elif mapping[anchor] == -1:
-            time_after_anchor = anchor_td
-        else:
-            anchor_note = note_info_list[mapping[anchor]]
-            time_after_anchor = n.note_on_time - anchor_note.note_on_time
+NoteInfoDebug = namedtuple("NoteInfoDebug", ["pitch", "velocity",
+                                             "note_on_time", "note_off_time",
+                                             "time_after_anchor",
+                                             "note_hold_time"])
 
-        # print("TAA", i, anchor, mapping[anchor], time_after_anchor)
 
-        debug_list.append(
-            NoteInfoDebug(n.pitch, n.velocity, n.note_on_time, n.note_off_time,
-                          time_after_anchor, note_hold_time))
-    print("debug_list", debug_list)
+def get_anchor_map(target_notes):
+    """
+    Finds the anchor of every target note, i.e. the last note that starts more
+    than ANCH_THR seconds before it.
+
+    @param target_notes: list of NoteInfo, sorted by onset (as task_data.all_notes()).
+    @return: anchor index (-1 if none) and time after the anchor (0 if none),
+             both as arrays
+    """
+    on = np.array([n.note_on_time for n in target_notes], dtype=float)
+    if np.any(np.diff(on) < 0):
+        raise ValueError("target notes have to be sorted by onset")
+    if len(on) == 0:
+        return np.zeros(0, dtype=int), np.zeros(0)
+
+    anchor = np.searchsorted(on, on - ANCH_THR, side="left") - 1
+
+    # the shifted onsets can round differently than the time differences,
+    # so check the neighbours with the original condition
+    following = anchor + 1
+    too_early = on - on[following] > ANCH_THR
+    anchor[too_early] = np.searchsorted(on, on[following[too_early]], side="right") - 1
+
+    has_anchor = anchor >= 0
+    too_late = has_anchor & ~(on - on[np.maximum(anchor, 0)] > ANCH_THR)
+    anchor[too_late] = np.searchsorted(on, on[anchor[too_late]], side="left") - 1
+
+    has_anchor = anchor >= 0
+    time_after_anchor = np.where(has_anchor, on - on[np.maximum(anchor, 0)], 0.0)
+    return anchor, time_after_anchor
+
+
+def get_debug_columns(note_info_list, mapping, anchor_map):
+    """
+    Adds the time after the anchor and the hold time to the notes.
+
+    @param note_info_list: target or actual notes.
+    @param mapping: target -> index in note_info_list (-1 if missing).
+    @param anchor_map: see get_anchor_map.
+    @return: NoteInfoDebug with a numpy array per field
+    """
+    pitch = np.array([n.pitch for n in note_info_list])
+    velocity = np.array([n.velocity for n in note_info_list])
+    on = np.array([n.note_on_time for n in note_info_list], dtype=float)
+    off = np.array([n.note_off_time for n in note_info_list], dtype=float)
+    return debug_columns_from_arrays(pitch, velocity, on, off, mapping, anchor_map)
+
+
+def debug_columns_from_arrays(pitch, velocity, on, off, mapping, anchor_map):
+    """
+    Same as get_debug_columns, for notes given as arrays (e.g. collected while
+    they are played, see OnlineScorer).
+    """
+    anchor, anchor_td = anchor_map
+    mapping = np.asarray(mapping, dtype=int).reshape(-1)
+
+    # inverse mapping (note -> first target mapped to it, -1 for extra notes)
+    inverse = np.full(len(pitch), -1)
+    mapped_targets = np.flatnonzero(mapping >= 0)
+    notes, first = np.unique(mapping[mapped_targets], return_index=True)
+    inverse[notes] = mapped_targets[first]
+
+    time_after_anchor = np.full(len(pitch), float(NO_ANCHOR))
+    played = np.flatnonzero(inverse >= 0)
+    note_anchor = anchor[inverse[played]]
+    anchor_note = np.where(note_anchor >= 0, mapping[np.maximum(note_anchor, 0)], -1)
+    time_after_anchor[played] = np.where(
+        note_anchor == -1, 0.0,
+        np.where(anchor_note == -1,
+                 anchor_td[inverse[played]],
+                 on[played] - on[np.maximum(anchor_note, 0)]))
+
+    return NoteInfoDebug(pitch, velocity, on, off, time_after_anchor, off - on)
+
+
+def debug_row(debug_columns, i):
+    """
+    @return: NoteInfoDebug of a single note (for display)
+    """
+    return NoteInfoDebug(*[column[i].item() for column in debug_columns])
+
+
+def note_info_list_add_debug(note_info_list, mapping, anchor_map, verbose=True):
+    debug_columns = get_debug_columns(note_info_list, mapping, anchor_map)
+    debug_list = [debug_row(debug_columns, i) for i in range(len(note_info_list))]
+    if verbose:
+        print("debug_list", debug_list)
     return debug_list
 
 
-def get_explanation(task_data, actual, mapping,
-                    inject_explanation=True,
-                    openface_data=None,
-                    plot=False,
-                    ):
-    target = task_data.all_notes()
-    print("task_data", task_data.__dict__)
-    print("target:", target[0].note_off_time - target[0].note_on_time)
-    total_time_note_on = 0
-    for t in target:
-        total_time_note_on += t.note_off_time - t.note_on_time
-
-    anchor_map = get_anchor_map(target)
-    target_debug = note_info_list_add_debug(target, list(range(len(target))), anchor_map)
-    actual_debug = note_info_list_add_debug(actual, mapping, anchor_map)
-
-    #### EXTRA NOTES ####
+def assign_extra_notes(task_data, extra_notes):
+    """
+    Assigns every extra note to the hand of the closest target note (by pitch,
+    then by onset).
 
+    @return: dict with the extra notes of the left and the right hand
+    """
     extra_notes_dict = dict(left=list(), right=list())
-    extra_notes = [a for idx, a in enumerate(actual_debug) if idx not in mapping]
     for extra_note in extra_notes:
         if len(task_data.notes_left) == 0:
             extra_notes_dict["right"].append(extra_note)
@@ -96,92 +127,135 @@ def get_explanation(task_data, actual, mapping,
             extra_notes_dict["left"].append(extra_note)
             continue
 
-        pitch_time_dist = [
-            (abs(extra_note.pitch - n.pitch), abs(extra_note.note_on_time - n.note_on_time), "left")
-            for n in task_data.midi.left]
-        pitch_time_dist.extend([(abs(extra_note.pitch - n.pitch),
-                                 abs(extra_note.note_on_time - n.note_on_time), "right")
-                                for n in task_data.midi.right]
-                               )
-        hand = sorted(pitch_time_dist)[0][2]
+        distances = [(task_data.midi.nearest_note_distance(hand, extra_note.pitch,
+                                                           extra_note.note_on_time), hand)
+                     for hand in ("left", "right")]
+        hand = min(d for d in distances if d[0] is not None)[1]
         extra_notes_dict[hand].append(extra_note)
 
-    errors = []
-    output_note_list = list()
-
-    for hand in ("left", "right"):
-        num_notes = len(getattr(task_data, f"notes_{hand}"))
-        error_timing = 0
-        error_note_hold_time = 0
-        error_pitch = 0
-
-        notes_missing = 0
-        notes_missing_t = 0
-
-        for t_i, a_i in enumerate(mapping):
-            ## check whether the target notes belogs to the hand we want to calculate
-            ## the error for.
-            if task_data.note2hand(target[t_i]) != hand:
-                continue
-
-            t = target_debug[t_i]
+    return extra_notes_dict
+
+
+def get_hand_error(task_data, target_debug, actual_debug, mapping, hand,
+                   extra_notes, total_time_note_on,
+                   target_indices=None, output_note_list=None, verbose=False):
+    """
+    Computes the Error of one hand.
+
+    @param target_debug: debug columns of the target notes (see get_debug_columns).
+    @param actual_debug: debug columns of the actual notes.
+    @param extra_notes: extra notes (NoteInfoDebug) assigned to this hand.
+    @param target_indices: only take these target notes into account (e.g. the
+                           ones that were already due during playback), all if None.
+    @param output_note_list: if given, NoteExpected / NoteMissing are appended to it.
+    @return: Error
+    """
+    mapping = np.asarray(mapping, dtype=int).reshape(-1)
+    num_notes = len(getattr(task_data, f"notes_{hand}"))
+
+    if target_indices is None:
+        target_indices = range(len(mapping))
+    target_indices = np.asarray(target_indices, dtype=int).reshape(-1)
+
+    ## only the target notes that belong to the hand we want to calculate
+    ## the error for.
+    target_hands = np.asarray(task_data.midi.hands, dtype=str)
+    selected = target_indices[target_hands[target_indices] == hand]
+    selected_actual = mapping[selected]
+
+    missing = selected_actual == -1
+    t_missing = selected[missing]
+    t_played, a_played = selected[~missing], selected_actual[~missing]
+
+    notes_missing = len(t_missing)
+    notes_missing_t = float(target_debug.note_hold_time[t_missing].sum())
+
+    # fixme: superwierd! at least the name is extremely non-suitable
+    # in the current implementation the pitch error is calculated as a sum or durations of the wrongly played notes
+    wrong_pitch = target_debug.pitch[t_played] != actual_debug.pitch[a_played]
+    error_pitch = float((target_debug.note_off_time[t_played][wrong_pitch]
+                         - target_debug.note_on_time[t_played][wrong_pitch]).sum())
+
+    hold_diff = target_debug.note_hold_time[t_played] - actual_debug.note_hold_time[a_played]
+    error_note_hold_time = float(np.abs(hold_diff).sum())
+
+    timing_diff = target_debug.time_after_anchor[t_played] - \
+                  actual_debug.time_after_anchor[a_played]
+    error_timing = float(np.minimum(np.abs(timing_diff), 1.0).sum())
+
+    if output_note_list is not None:
+        for t_i, a_i in zip(selected, selected_actual):
+            t = debug_row(target_debug, t_i)
             if a_i == -1:
-                notes_missing += 1
-                notes_missing_t += t.note_hold_time
                 output_note_list.append(NoteMissing(t.pitch, t.velocity,
                                                     t.note_on_time, t.time_after_anchor,
                                                     t.note_hold_time))
-
                 continue
 
-            a = actual_debug[a_i]
-
-            pitch_diff = t.pitch - a.pitch
-            if abs(pitch_diff) > 0:
-                # print("WRONG PITCH", t_i, t, a_i, a)
-                # fixme: superwierd! at least the name is extremely non-suitable
-                # in the current implementation the pitch error is calculated as a sum or durations of the wrongly played notes
-                error_pitch += (t.note_off_time - t.note_on_time)
-
-            hold_diff = t.note_hold_time - a.note_hold_time
-            if abs(hold_diff) > 0:
-                # print("WRONG HOLD TIME", t_i, a_i, t.note_hold_time, a.note_hold_time)
-                error_note_hold_time += abs(hold_diff)
-
-            timing_diff = t.time_after_anchor - a.time_after_anchor
-            if abs(timing_diff) > 0:
-                # print("WRONG TIMING", t_i, a_i, t.time_after_anchor, a.time_after_anchor)
-                error_timing += min(abs(timing_diff), 1.0)
-
+            a = debug_row(actual_debug, a_i)
             output_note_list.append(
                 NoteExpected(a.pitch, a.velocity, a.note_on_time, a.time_after_anchor,
                              a.note_hold_time,
                              t.pitch, t.velocity, t.note_on_time, t.time_after_anchor,
                              t.note_hold_time))
 
-        # if only played with one hand, so to avoid division by zero
-        if num_notes == 0:
-            number = 1
-        else:
-            number = num_notes
-        # fixme: what is this?
-        #b = (task_data.time_signature[0] / task_data.time_signature[1]) / task_data.bpm * 60 * 1000
+    # if only played with one hand, so to avoid division by zero
+    if num_notes == 0:
+        number = 1
+    else:
+        number = num_notes
+    # fixme: what is this?
+    #b = (task_data.time_signature[0] / task_data.time_signature[1]) / task_data.bpm * 60 * 1000
+    if verbose:
         print("number of notes missing", notes_missing)
         print("error_timing ", error_timing)
         print ("task data bpm ", task_data.bpm)
 
-        errors.append(Error(pitch=error_pitch / total_time_note_on,
-                            note_hold_time=error_note_hold_time / (
-                                        task_data.number_of_bars * task_data.time_signature[0]),
-                            # how to get on number of bars and signature(?)
-                            timing=error_timing / (number - notes_missing), #   number),
-                            n_missing_notes=notes_missing / number,
-                            t_missing_notes=notes_missing_t / number,
-                            n_extra_notes=len(extra_notes_dict[hand]) / number,
-                            t_extra_notes=sum(
-                                extra.note_hold_time for extra in extra_notes_dict[hand]),
-                            number_of_notes=num_notes
-                            ))
+    return Error(pitch=error_pitch / total_time_note_on,
+                 note_hold_time=error_note_hold_time / (
+                             task_data.number_of_bars * task_data.time_signature[0]),
+                 # how to get on number of bars and signature(?)
+                 timing=error_timing / (number - notes_missing), #   number),
+                 n_missing_notes=notes_missing / number,
+                 t_missing_notes=notes_missing_t / number,
+                 n_extra_notes=len(extra_notes) / number,
+                 t_extra_notes=sum(
+                     extra.note_hold_time for extra in extra_notes),
+                 number_of_notes=num_notes
+                 )
+
+
+def get_explanation(task_data, actual, mapping,
+                    inject_explanation=True,
+                    openface_data=None,
+                    plot=False,
+                    ):
+    target = task_data.all_notes()
+    print("task_data", task_data.__dict__)
+    print("target:", target[0].note_off_time - target[0].note_on_time)
+    total_time_note_on = 0
+    for t in target:
+        total_time_note_on += t.note_off_time - t.note_on_time
+
+    anchor_map = get_anchor_map(target)
+    target_debug = get_debug_columns(target, list(range(len(target))), anchor_map)
+    actual_debug = get_debug_columns(actual, mapping, anchor_map)
+    print("debug_list", [debug_row(actual_debug, i) for i in range(len(actual))])
+
+    #### EXTRA NOTES ####
+
+    mapped = set(mapping)
+    extra_notes = [debug_row(actual_debug, idx) for idx in range(len(actual))
+                   if idx not in mapped]
+    extra_notes_dict = assign_extra_notes(task_data, extra_notes)
+
+    errors = []
+    output_note_list = list()
+
+    for hand in ("left", "right"):
+        errors.append(get_hand_error(task_data, target_debug, actual_debug, mapping, hand,
+                                     extra_notes_dict[hand], total_time_note_on,
+                                     output_note_list=output_note_list, verbose=True))
 
         for a in extra_notes:
             output_note_list.append(NoteExtra(a.pitch, a.velocity,
@@ -1,5 +1,15 @@
 from error_calc.explanation import get_explanation
 from error_calc.mappingEvo import get_mapping
+from error_calc import mappingDP, mappingLevenshtein
+
+# alternative aligners that computeErrorLV / computeErrorEvo can use instead of
+# the evolutionary get_mapping
+MAPPING_FUNCTIONS = dict(
+    levenshtein=mappingLevenshtein.get_mapping,
+    dp=mappingDP.get_mapping,
+    dp_banded=mappingDP.get_mapping_banded,
+    dp_linear_space=mappingDP.get_mapping_linear_space,
+)
 
 
 def computeErrorOld(targetNoteInfoList, actualNoteInfoList):
@@ -33,8 +43,15 @@ def computeErrorOld(targetNoteInfoList, actualNoteInfoList):
 
 def computeErrorLV(task_data, actualNoteInfoList,
                    inject_explanation=True,
-                   plot=False):
-    mapping = get_mapping(task_data, actualNoteInfoList)
+                   plot=False,
+                   aligner=None):
+    """
+    @param aligner: key of MAPPING_FUNCTIONS to use instead of the evolutionary mapping.
+    """
+    if aligner is not None:
+        mapping = MAPPING_FUNCTIONS[aligner](task_data, actualNoteInfoList)
+    else:
+        mapping = get_mapping(task_data, actualNoteInfoList)
 
     error = get_explanation(task_data, actualNoteInfoList,
                             mapping,
@@ -48,9 +65,16 @@ def computeErrorLV(task_data, actualNoteInfoList,
 def computeErrorEvo(task_data, actualNoteInfoList,
                     inject_explanation=True,
                     plot=False,
-                    interactive=False):
-    mapping = get_mapping(task_data, actualNoteInfoList,
-                          interactive=interactive)
+                    interactive=False,
+                    aligner=None):
+    """
+    @param aligner: key of MAPPING_FUNCTIONS to use instead of the evolutionary mapping.
+    """
+    if aligner is not None:
+        mapping = MAPPING_FUNCTIONS[aligner](task_data, actualNoteInfoList)
+    else:
+        mapping = get_mapping(task_data, actualNoteInfoList,
+                              interactive=interactive)
 
     error = get_explanation(task_data, actualNoteInfoList,
                             mapping,
@@ -58,3 +82,20 @@ def computeErrorEvo(task_data, actualNoteInfoList,
                             plot=plot)
 
     return error
+
+
+def computeErrorOnline(online_scorer,
+                       inject_explanation=True,
+                       plot=False):
+    """
+    Same as computeErrorEvo(aligner="dp"), but with the alignment that an
+    OnlineScorer already computed while the notes were played.
+
+    @param online_scorer: error_calc.onlineScorer.OnlineScorer that got all played notes.
+    """
+    error = get_explanation(online_scorer.task_data, online_scorer.actual_notes,
+                            online_scorer.mapping(),
+                            inject_explanation=inject_explanation,
+                            plot=plot)
+
+    return error
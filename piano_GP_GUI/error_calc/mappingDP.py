@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Calculates the target -> actual mapping as the optimal monotone alignment of
+both note sequences (sorted by onset), using dynamic programming over a cost
+that combines pitch and onset time.
+
+Unlike mappingEvo it is deterministic, and unlike mappingLevenshtein it also
+takes the timing into account. For long pieces the table can be restricted to a
+band of a few beats around the target onsets (see get_mapping_banded), and
+for very long recordings the back-pointer table can be avoided altogether
+(see get_mapping_linear_space).
+"""
+
+import numpy as np
+
+# cost of a matched pair with different pitches
+PITCH_COST = 1.0
+# cost per second of onset difference of a matched pair
+TIME_COST = 1.0
+# onset differences above this many seconds are not penalised any further
+MAX_TIME_DIFF = 2.0
+# cost of a missing (target only) or extra (actual only) note
+GAP_COST = 1.0
+
+# width of the band for the banded alignment (in bars, see window_from_task)
+WINDOW_BARS = 1.0
+
+# the linear space alignment stores back-pointers for at most this many rows
+BLOCK_ROWS = 32
+
+# back-pointer values
+DIAG, UP, LEFT = 0, 1, 2
+
+# cost differences below this are ties, which are broken by the fixed order
+# DIAG, UP, LEFT (the costs are float sums that depend on the filling order)
+TIE_TOLERANCE = 1e-9
+
+
+def _note_arrays(notes):
+    on = np.array([n.note_on_time for n in notes], dtype=float)
+    pitch = np.array([n.pitch for n in notes], dtype=float)
+    # order by onset, chords by pitch
+    order = np.lexsort((pitch, on))
+    return on[order], pitch[order], order
+
+
+def is_less(a, b):
+    """
+    Element-wise a < b for costs, False if they are equal up to TIE_TOLERANCE.
+    """
+    return (a < b) & ~np.isclose(a, b, rtol=0, atol=TIE_TOLERANCE)
+
+
+def match_cost(target_on, target_pitch, actual_on, actual_pitch):
+    """
+    Cost of matching every target note with every actual note, broadcast over
+    the given arrays.
+    """
+    time_diff = np.minimum(np.abs(target_on - actual_on), MAX_TIME_DIFF)
+    return PITCH_COST * (target_pitch != actual_pitch) + TIME_COST * time_diff
+
+
+def band_limits(target_on, actual_on, window=None):
+    """
+    Computes for every row i of the DP table (i target notes consumed) the range
+    of columns j (actual notes consumed) that is considered. With a window, an
+    actual note can only be consumed within window seconds of the targets around it.
+
+    @param window: width of the band in seconds, None for the full table.
+    @return: lo, hi (inclusive), both arrays of length n + 1
+    """
+    n, m = len(target_on), len(actual_on)
+    if window is None:
+        return np.zeros(n + 1, dtype=int), np.full(n + 1, m, dtype=int)
+
+    # actual notes earlier than the last consumed target - window must be consumed
+    lo = np.concatenate(([0], np.searchsorted(actual_on, target_on - window, side="left")))
+    # actual notes later than the next target + window can't be consumed yet
+    hi = np.concatenate((np.searchsorted(actual_on, target_on + window, side="right"), [m]))
+    return lo, hi
+
+
+def _fill_row(prev_row, prev_lo, prev_hi, lo, hi, match_costs, gap_cost):
+    """
+    Computes the banded row [lo, hi] of the DP table from the previous row.
+    The chain of insertions (LEFT) along the row is resolved with a cumulative
+    minimum, so the row is fully vectorized.
+
+    @param match_costs: cost of matching the row's target note with actual note j - 1,
+                        for all columns j in [lo, hi].
+    @return: row, back-pointers of the row
+    """
+    cols = np.arange(lo, hi + 1)
+
+    from_up = np.full(len(cols), np.inf)
+    has_up = (cols >= prev_lo) & (cols <= prev_hi)
+    from_up[has_up] = prev_row[cols[has_up] - prev_lo] + gap_cost
+
+    from_diag = np.full(len(cols), np.inf)
+    has_diag = (cols - 1 >= prev_lo) & (cols - 1 <= prev_hi)
+    from_diag[has_diag] = prev_row[cols[has_diag] - 1 - prev_lo] + match_costs[has_diag]
+
+    best = np.minimum(from_diag, from_up)
+    ptr = np.where(is_less(from_up, from_diag), UP, DIAG).astype(np.int8)
+
+    # row[j] = min_k<=j (best[k] + (j - k) * gap_cost)
+    steps = (cols - lo) * gap_cost
+    candidates = best - steps
+    running_min = np.minimum.accumulate(candidates)
+    row = running_min + steps
+    ptr[is_less(running_min, candidates)] = LEFT
+
+    return row, ptr
+
+
+def _get_next_row_function(target_on, target_pitch, actual_on, actual_pitch, lo, hi, gap_cost):
+    m = len(actual_on)
+
+    def next_row(i, row):
+        """
+        Computes row i + 1 (and its back-pointers) from row i.
+        """
+        cols = np.arange(lo[i + 1], hi[i + 1] + 1)
+        if m > 0:
+            # column 0 has no actual note, its match cost is never used
+            prev_actual = np.maximum(cols - 1, 0)
+            match_costs = match_cost(target_on[i], target_pitch[i],
+                                     actual_on[prev_actual], actual_pitch[prev_actual])
+        else:
+            match_costs = np.zeros(len(cols))
+        return _fill_row(row, lo[i], hi[i], lo[i + 1], hi[i + 1], match_costs, gap_cost)
+
+    return next_row
+
+
+def align(target_notes, actual_notes, gap_cost=GAP_COST, window=None):
+    """
+    Optimal monotone alignment of target and actual notes. Time and memory are
+    O(n*m) for the full table, or proportional to the band if a window is given.
+
+    @param target_notes: list of NoteInfo the user was supposed to play.
+    @param actual_notes: list of NoteInfo the user played (in any order).
+    @param window: only consider matches/gaps within this many seconds (see band_limits).
+    @return: mapping (list with the index of the actual note for every target
+             note, -1 if missing), total cost
+    """
+    target_on, target_pitch, target_order = _note_arrays(target_notes)
+    actual_on, actual_pitch, actual_order = _note_arrays(actual_notes)
+    n, m = len(target_on), len(actual_on)
+
+    lo, hi = band_limits(target_on, actual_on, window)
+    next_row = _get_next_row_function(target_on, target_pitch, actual_on, actual_pitch,
+                                      lo, hi, gap_cost)
+    # back-pointers of all rows, row i stored from row_start[i] on
+    row_start = np.concatenate(([0], np.cumsum(hi - lo + 1)))
+    pointers = np.empty(row_start[-1], dtype=np.int8)
+
+    row = np.arange(lo[0], hi[0] + 1) * gap_cost
+    pointers[:row_start[1]] = LEFT
+
+    for i in range(n):
+        row, pointers[row_start[i + 1]:row_start[i + 2]] = next_row(i, row)
+
+    mapping = backtrace(pointers, row_start, lo, n, m, target_order, actual_order)
+    return mapping, float(row[-1])
+
+
+def align_linear_space(target_notes, actual_notes, gap_cost=GAP_COST, window=None,
+                       block_rows=BLOCK_ROWS):
+    """
+    Same result as align (the same mapping, not just the same cost), without
+    keeping the back-pointer table.
+
+    Divide and conquer over the target notes: the cost row in the middle of the
+    rows is computed and kept, the lower half is backtraced first, then the
+    upper half. Only blocks of block_rows rows get their back-pointers
+    recomputed, which is needed to follow exactly the path of align.
+    Memory is O(m log n) instead of O(n*m), time O(n*m log n).
+
+    @param block_rows: number of rows whose back-pointers are kept at once.
+    @return: mapping, total cost (see align)
+    """
+    target_on, target_pitch, target_order = _note_arrays(target_notes)
+    actual_on, actual_pitch, actual_order = _note_arrays(actual_notes)
+    n, m = len(target_on), len(actual_on)
+
+    lo, hi = band_limits(target_on, actual_on, window)
+    next_row = _get_next_row_function(target_on, target_pitch, actual_on, actual_pitch,
+                                      lo, hi, gap_cost)
+
+    mapping = [-1] * n
+    # current position of the backtrace
+    position = dict(j=m, cost=0.0)
+
+    def solve(first, first_row, last):
+        """
+        Backtraces from row last (column position["j"]) up to row first,
+        given the cost row of row first.
+        """
+        if last - first > block_rows:
+            mid = (first + last) // 2
+            row = first_row
+            for i in range(first, mid):
+                row, _ = next_row(i, row)
+            solve(mid, row, last)
+            solve(first, first_row, mid)
+            return
+
+        row = first_row
+        block_pointers = list()
+        for i in range(first, last):
+            row, ptr = next_row(i, row)
+            block_pointers.append(ptr)
+        if last == n:
+            position["cost"] = float(row[-1])
+
+        i, j = last, position["j"]
+        while i > first:
+            step = block_pointers[i - first - 1][j - lo[i]]
+            if step == DIAG:
+                mapping[target_order[i - 1]] = int(actual_order[j - 1])
+                i, j = i - 1, j - 1
+            elif step == UP:
+                i -= 1
+            else:
+                j -= 1
+        position["j"] = j
+
+    solve(0, np.arange(lo[0], hi[0] + 1) * gap_cost, n)
+    if n == 0:
+        position["cost"] = m * gap_cost
+
+    return mapping, position["cost"]
+
+
+def backtrace(pointers, row_start, lo, n, m, target_order, actual_order):
+    """
+    Follows the back-pointers from (n, m) to (0, 0).
+
+    @return: mapping in the indices of the unsorted input lists
+    """
+    mapping = [-1] * n
+    i, j = n, m
+    while i > 0 or j > 0:
+        step = pointers[row_start[i] + j - lo[i]]
+
+        if step == DIAG:
+            mapping[target_order[i - 1]] = int(actual_order[j - 1])
+            i, j = i - 1, j - 1
+        elif step == UP:
+            i -= 1
+        else:
+            j -= 1
+
+    return mapping
+
+
+def window_from_task(task_data, bars=WINDOW_BARS):
+    """
+    Converts a number of bars into seconds using the tempo and time signature
+    of the task (the bpm counts quarter notes, as in the generated MIDI files).
+
+    @return: window in seconds, None if the task has no valid tempo
+    """
+    if not task_data.bpm or task_data.bpm <= 0:
+        return None
+
+    numerator, denominator = task_data.time_signature
+    quarters_per_bar = numerator * 4 / denominator
+    return bars * quarters_per_bar * 60 / task_data.bpm
+
+
+def get_mapping(task_data, actualNoteInfoList, banded=False, linear_space=False):
+    """
+    @param banded: only align within WINDOW_BARS bars of the target onsets (see
+                   band_limits). If the performance is offset by more than that,
+                   the played notes are out of reach of their targets: they
+                   become missing plus extra notes, or are matched with wrong
+                   notes within the band. (The full table behaves alike for
+                   offsets above MAX_TIME_DIFF, which cost as much as two gaps.)
+    @param linear_space: use align_linear_space (same mapping, less memory).
+    @return: mapping (see align)
+    """
+    window = window_from_task(task_data) if banded else None
+    align_function = align_linear_space if linear_space else align
+    mapping, cost = align_function(task_data.all_notes(), actualNoteInfoList, window=window)
+    print("DP alignment cost", cost, "| window", window)
+    return mapping
+
+
+def get_mapping_banded(task_data, actualNoteInfoList):
+    return get_mapping(task_data, actualNoteInfoList, banded=True)
+
+
+def get_mapping_linear_space(task_data, actualNoteInfoList):
+    return get_mapping(task_data, actualNoteInfoList, linear_space=True)
@@ -5,6 +5,7 @@
 import numpy
 import random
 import functools
+from collections import OrderedDict, namedtuple
 from deap import base, creator, tools, algorithms
 
 
@@ -98,6 +99,215 @@ def get_eval_function(target_notes, actual_notes):
     return eval_function
 
 
+def get_anchor_windows(target_on, time_error_window=2.5):
+    """
+    Precomputes, for every target note, the target notes its timing error is
+    measured against (the same window eval_function builds per call).
+
+    @param target_on: array of target note_on times.
+    @param time_error_window: see eval_function.
+    @return: (pair_i, pair_j, pair_dt) arrays, one entry per (note, reference note)
+             pair with pair_dt = target_on[i] - target_on[j].
+    """
+    onset_diff = target_on[:, None] - target_on[None, :]
+
+    pair_i, pair_j = list(), list()
+    for target_i in range(len(target_on)):
+        relevant = numpy.flatnonzero(onset_diff[target_i] >= 0)
+        diffs = onset_diff[target_i, relevant]
+        ## number of non-zero distances in relevant[start:]
+        positive_left = numpy.cumsum((diffs > 0)[::-1])[::-1]
+
+        ## same trimming as the while loop in eval_function: drop references
+        ## outside the window, but keep at least one non-zero distance
+        start = 0
+        while (start < len(relevant) and positive_left[start] > 1
+               and diffs[start] > time_error_window):
+            start += 1
+
+        relevant = relevant[start:]
+        pair_i.extend([target_i] * len(relevant))
+        pair_j.extend(relevant)
+
+    pair_i = numpy.array(pair_i, dtype=int)
+    pair_j = numpy.array(pair_j, dtype=int)
+    return pair_i, pair_j, onset_diff[pair_i, pair_j]
+
+
+def get_batch_eval_function(target_notes, actual_notes, time_error_window=2.5):
+    """
+    Vectorized counterpart of get_eval_function, scoring a whole population at
+    once. Returns the same 5-tuple of objectives for every individual.
+    """
+    target_on = numpy.array([n.note_on_time for n in target_notes], dtype=float)
+    target_off = numpy.array([n.note_off_time for n in target_notes], dtype=float)
+    target_pitch = numpy.array([n.pitch for n in target_notes], dtype=float)
+
+    ## a dummy note is appended, so that -1 (missing) indexes something harmless
+    actual_on = numpy.array([n.note_on_time for n in actual_notes] + [0], dtype=float)
+    actual_off = numpy.array([n.note_off_time for n in actual_notes] + [0], dtype=float)
+    actual_pitch = numpy.array([n.pitch for n in actual_notes] + [-1], dtype=float)
+    n_actual = len(actual_notes)
+
+    target_duration = target_off - target_on
+    pair_i, pair_j, pair_dt = get_anchor_windows(target_on, time_error_window)
+
+    def batch_eval_function(population):
+        if len(population) == 0:
+            return list()
+
+        mappings = numpy.array(population, dtype=int).reshape(len(population),
+                                                              len(target_notes))
+        used = mappings != -1
+
+        wrong_pitch = used & (target_pitch != actual_pitch[mappings])
+        error_pitch = (wrong_pitch * target_duration).sum(axis=1)
+
+        mapped_on = actual_on[mappings]
+        both_used = used[:, pair_i] & used[:, pair_j]
+        actual_dt = mapped_on[:, pair_i] - mapped_on[:, pair_j]
+        error_timing = (numpy.abs(pair_dt - actual_dt) * both_used).sum(axis=1)
+
+        hold_diff = numpy.abs(target_duration - (actual_off[mappings] - mapped_on))
+        error_note_hold_time = (hold_diff * used).sum(axis=1)
+
+        ## distinct actual notes per individual
+        sorted_mappings = numpy.sort(mappings, axis=1)
+        distinct = sorted_mappings[:, :1] != -1
+        if sorted_mappings.shape[1] > 1:
+            new_value = sorted_mappings[:, 1:] != sorted_mappings[:, :-1]
+            distinct = numpy.hstack((distinct, new_value & (sorted_mappings[:, 1:] != -1)))
+        n_unused = n_actual - distinct.sum(axis=1)
+        n_missing = (~used).sum(axis=1)
+
+        return list(zip(error_timing.tolist(), error_note_hold_time.tolist(),
+                        error_pitch.tolist(), n_unused.tolist(), n_missing.tolist()))
+
+    return batch_eval_function
+
+
+CacheInfo = namedtuple("CacheInfo", ["hits", "misses", "maxsize", "currsize"])
+
+
+class FitnessCache:
+    """
+    Bounded LRU cache for fitness values, keyed by the tuple form of a mapping.
+    Meant to live for one run of find_best_mapping, across all generations.
+    """
+
+    def __init__(self, maxsize=10000):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._fitness = OrderedDict()
+
+    def _get(self, key):
+        fitness = self._fitness.get(key)
+        if fitness is not None:
+            self._fitness.move_to_end(key)
+        return fitness
+
+    def _put(self, key, fitness):
+        self._fitness[key] = fitness
+        self._fitness.move_to_end(key)
+        while len(self._fitness) > self.maxsize:
+            self._fitness.popitem(last=False)
+
+    def wrap(self, eval_function):
+        """
+        Cached version of a single-mapping eval_function (verbose calls bypass the cache).
+        """
+        def cached_eval_function(mapping, *args, verbose=False, **kwargs):
+            if verbose or args or kwargs:
+                return eval_function(mapping, *args, verbose=verbose, **kwargs)
+
+            key = tuple(mapping)
+            fitness = self._get(key)
+            if fitness is not None:
+                self.hits += 1
+                return fitness
+
+            self.misses += 1
+            fitness = eval_function(mapping)
+            self._put(key, fitness)
+            return fitness
+
+        return cached_eval_function
+
+    def wrap_batch(self, batch_eval_function):
+        """
+        Cached version of a batch_eval_function: only mappings not in the cache
+        (each distinct one once) are passed on.
+        """
+        def cached_batch_eval_function(population):
+            keys = [tuple(ind) for ind in population]
+            fitnesses = [self._get(key) for key in keys]
+
+            to_evaluate = OrderedDict()
+            for pos, (key, fitness) in enumerate(zip(keys, fitnesses)):
+                if fitness is None:
+                    to_evaluate.setdefault(key, []).append(pos)
+
+            self.misses += len(to_evaluate)
+            self.hits += len(keys) - len(to_evaluate)
+
+            new_fitnesses = batch_eval_function(list(to_evaluate.keys()))
+            for (key, positions), fitness in zip(to_evaluate.items(), new_fitnesses):
+                self._put(key, fitness)
+                for pos in positions:
+                    fitnesses[pos] = fitness
+
+            return fitnesses
+
+        return cached_batch_eval_function
+
+    def info(self):
+        return CacheInfo(self.hits, self.misses, self.maxsize, len(self._fitness))
+
+
+def ea_simple_batched(population, toolbox, cxpb, mutpb, ngen, stats=None,
+                      halloffame=None, verbose=True):
+    """
+    Same as deap's algorithms.eaSimple, but all individuals of a generation
+    with an invalid fitness are handed to toolbox.evaluate_population in one call.
+    """
+    logbook = tools.Logbook()
+    logbook.header = ['gen', 'nevals'] + (stats.fields if stats else [])
+
+    def evaluate_invalid(individuals):
+        invalid_ind = [ind for ind in individuals if not ind.fitness.valid]
+        fitnesses = toolbox.evaluate_population(invalid_ind)
+        for ind, fit in zip(invalid_ind, fitnesses):
+            ind.fitness.values = fit
+        return len(invalid_ind)
+
+    nevals = evaluate_invalid(population)
+    if halloffame is not None:
+        halloffame.update(population)
+
+    record = stats.compile(population) if stats else {}
+    logbook.record(gen=0, nevals=nevals, **record)
+    if verbose:
+        print(logbook.stream)
+
+    for gen in range(1, ngen + 1):
+        offspring = toolbox.select(population, len(population))
+        offspring = algorithms.varAnd(offspring, toolbox, cxpb, mutpb)
+
+        nevals = evaluate_invalid(offspring)
+        if halloffame is not None:
+            halloffame.update(offspring)
+
+        population[:] = offspring
+
+        record = stats.compile(population) if stats else {}
+        logbook.record(gen=gen, nevals=nevals, **record)
+        if verbose:
+            print(logbook.stream)
+
+    return population, logbook
+
+
 def mateSwapEntries(ind1, ind2, indpb):
     ## derived from deap's cxUniformPartialyMatched
     size = min(len(ind1), len(ind2))
@@ -218,13 +428,19 @@ def my_max(weights, list_of_x):
     return times_weights(best), best
 
 
-def find_best_mapping(target_notes, actual_notes, interactive=False):
-    weights = (-0.5, -1.0, -1.0, -2.0, -2.5)
+WEIGHTS = (-0.5, -1.0, -1.0, -2.0, -2.5)
+POP_SIZE = 100
+N_GENERATIONS = 10
+
+
+def _create_deap_types():
     if not hasattr(creator, "FitnessMin"):
-        creator.create("FitnessMin", base.Fitness, weights=weights)
+        creator.create("FitnessMin", base.Fitness, weights=WEIGHTS)
         creator.create("Individual", list, fitness=creator.FitnessMin)
 
-    POP_SIZE = 100
+
+def _get_toolbox(target_notes, actual_notes, eval_function, batch_eval_function):
+    _create_deap_types()
 
     # IND_SIZE = len(target_notes)
     toolbox = base.Toolbox()
@@ -242,38 +458,125 @@ def find_best_mapping(target_notes, actual_notes, interactive=False):
     # def evalOneMax(individual):
     #     return sum(individual[:3]),
 
-    eval_function = get_eval_function(target_notes, actual_notes)
-
-    toolbox.register("evaluate", eval_function)
+    if eval_function is not None:
+        toolbox.register("evaluate", eval_function)
+    toolbox.register("evaluate_population", batch_eval_function)
     toolbox.register("mate", mateSwapEntries, indpb=0.05)
     toolbox.register("mutate", mutGeneral, len(actual_notes), indpb=0.175)
     # toolbox.register("select", tools.selBest)
     toolbox.register("select", tools.selTournament, tournsize=3)
 
-    pop = toolbox.population(n=POP_SIZE)
-    hof = tools.ParetoFront()
+    return toolbox
+
+
+def _get_stats():
     stats = tools.Statistics(lambda ind: ind.fitness.values)
     # stats.register("avg", numpy.mean, axis=0)
     # stats.register("std", numpy.std, axis=0)
     # stats.register("min", numpy.min, axis=0)
-    stats.register("min", my_min, weights)
-    stats.register("max", my_max, weights)
+    stats.register("min", my_min, WEIGHTS)
+    stats.register("max", my_max, WEIGHTS)
     # stats.register("max", numpy.max, axis=0)
+    return stats
 
-    pop, log = algorithms.eaSimple(pop, toolbox, cxpb=0.5, mutpb=0.5, ngen=10,
-                                   stats=stats, halloffame=hof, verbose=True)
 
-    times_weights = lambda array: sum(a * b for a, b in zip(array, weights))
+#### PARALLEL EXECUTION ####
+
+_process_pool = None
+_process_pool_size = None
+
+
+def get_process_pool(processes=None):
+    """
+    Returns the module wide process pool, creating it on first use. The pool is
+    kept alive between calls, so the start-up cost is only paid once per session.
+
+    @param processes: number of worker processes (default: os.cpu_count()).
+    """
+    global _process_pool, _process_pool_size
+    import multiprocessing
+    import os
+
+    if _process_pool is not None and processes not in (None, _process_pool_size):
+        close_process_pool()
+
+    if _process_pool is None:
+        import atexit
+        # same default as multiprocessing.Pool
+        _process_pool_size = processes or os.cpu_count() or 1
+        _process_pool = multiprocessing.Pool(processes=_process_pool_size)
+        atexit.register(close_process_pool)
+
+    return _process_pool
+
+
+def close_process_pool():
+    global _process_pool, _process_pool_size
+    if _process_pool is not None:
+        _process_pool.terminate()
+        _process_pool.join()
+    _process_pool = None
+    _process_pool_size = None
+
+
+## evaluators built inside a worker process, keyed by the notes they were built for
+_worker_batch_eval = dict()
+
+
+def _get_worker_batch_eval(target_notes, actual_notes):
+    key = (tuple(target_notes), tuple(actual_notes))
+    if key not in _worker_batch_eval:
+        _worker_batch_eval.clear()
+        _worker_batch_eval[key] = get_batch_eval_function(target_notes, actual_notes)
+    return _worker_batch_eval[key]
 
-    best_ones = sorted([m for m in hof], key=lambda m: times_weights(eval_function(m)),
+
+def _evaluate_chunk(target_notes, actual_notes, chunk):
+    return _get_worker_batch_eval(target_notes, actual_notes)(chunk)
+
+
+def get_parallel_batch_eval_function(target_notes, actual_notes, pool, n_chunks):
+    """
+    Like get_batch_eval_function, but splits the population into one chunk per
+    worker of the process pool.
+
+    @param n_chunks: number of chunks, i.e. the number of worker processes of the pool.
+    """
+
+    def parallel_batch_eval_function(population):
+        population = [list(ind) for ind in population]
+        if len(population) == 0:
+            return list()
+
+        chunk_size = -(-len(population) // n_chunks)
+        chunks = [population[i:i + chunk_size]
+                  for i in range(0, len(population), chunk_size)]
+        results = pool.starmap(_evaluate_chunk,
+                               [(target_notes, actual_notes, c) for c in chunks])
+        return [fitness for chunk_result in results for fitness in chunk_result]
+
+    return parallel_batch_eval_function
+
+
+#### FINDING THE MAPPING ####
+
+def _pick_best(hof, eval_function, batch_eval_function, interactive=False):
+    times_weights = lambda array: sum(a * b for a, b in zip(array, WEIGHTS))
+
+    if batch_eval_function is not None:
+        hof_fitness = batch_eval_function(list(hof))
+    else:
+        hof_fitness = [eval_function(m) for m in hof]
+
+    best_ones = sorted(zip(hof_fitness, hof), key=lambda fm: times_weights(fm[0]),
                        reverse=True)
 
     import pprint
-    pprint.pprint([(times_weights(eval_function(b)), b) for b in best_ones])
+    pprint.pprint([(times_weights(f), b) for f, b in best_ones])
     # f = 
 
     # print(best_ones)
-    best = best_ones[0]
+    best = best_ones[0][1]
     print("best", best)
     eval_function(best, verbose=True)
 
@@ -296,9 +599,142 @@ def find_best_mapping(target_notes, actual_notes, interactive=False):
     return best
 
 
-def get_mapping(task_data, actualNoteInfoList, interactive=False):
-    mapping = find_best_mapping(task_data.all_notes(), actualNoteInfoList,
-                                interactive=interactive)
+def find_best_mapping(target_notes, actual_notes, interactive=False, vectorized=True,
+                      cache_size=10000, return_cache_info=False,
+                      parallel=False, processes=None):
+    """
+    Searches the target->actual mapping with a genetic algorithm.
+
+    @param vectorized: evaluate whole generations with get_batch_eval_function.
+    @param cache_size: number of fitness values kept in the FitnessCache of this run.
+    @param return_cache_info: if True, return (best, CacheInfo) instead of best.
+    @param parallel: evaluate the generations in the shared process pool
+                     (see get_process_pool), implies vectorized.
+    @param processes: size of the process pool if parallel.
+    """
+    fitness_cache = FitnessCache(maxsize=cache_size)
+    eval_function = fitness_cache.wrap(get_eval_function(target_notes, actual_notes))
+    if parallel:
+        pool = get_process_pool(processes)
+        batch_eval_function = get_parallel_batch_eval_function(
+            target_notes, actual_notes, pool, _process_pool_size)
+    else:
+        batch_eval_function = get_batch_eval_function(target_notes, actual_notes)
+    batch_eval_function = fitness_cache.wrap_batch(batch_eval_function)
+
+    toolbox = _get_toolbox(target_notes, actual_notes, eval_function, batch_eval_function)
+
+    pop = toolbox.population(n=POP_SIZE)
+    hof = tools.ParetoFront()
+    stats = _get_stats()
+
+    if vectorized or parallel:
+        pop, log = ea_simple_batched(pop, toolbox, cxpb=0.5, mutpb=0.5, ngen=N_GENERATIONS,
+                                     stats=stats, halloffame=hof, verbose=True)
+    else:
+        pop, log = algorithms.eaSimple(pop, toolbox, cxpb=0.5, mutpb=0.5, ngen=N_GENERATIONS,
+                                       stats=stats, halloffame=hof, verbose=True)
+        batch_eval_function = None
+
+    best = _pick_best(hof, eval_function, batch_eval_function, interactive=interactive)
+
+    cache_info = fitness_cache.info()
+    print("fitness cache", cache_info)
+
+    if return_cache_info:
+        return best, cache_info
+    return best
+
+
+def _evolve_island(target_notes, actual_notes, population, ngen, seed):
+    """
+    Runs ngen generations on one island. Works on plain lists, so that it can be
+    executed in a worker process; returns the population and the island's
+    Pareto front as (mapping, fitness) pairs.
+    The DEAP operators use the global random generator, it is seeded for the
+    island and restored afterwards (the serial fallback runs in the caller's process).
+    """
+    random_state = random.getstate()
+    random.seed(seed)
+    try:
+        batch_eval_function = _get_worker_batch_eval(target_notes, actual_notes)
+        toolbox = _get_toolbox(target_notes, actual_notes, None, batch_eval_function)
+
+        population = [creator.Individual(m) for m in population]
+        hof = tools.ParetoFront()
+        population, _ = ea_simple_batched(population, toolbox, cxpb=0.5, mutpb=0.5, ngen=ngen,
+                                          halloffame=hof, verbose=False)
+    finally:
+        random.setstate(random_state)
+
+    as_pairs = lambda individuals: [(list(ind), ind.fitness.values) for ind in individuals]
+    return as_pairs(population), as_pairs(hof)
+
+
+def find_best_mapping_islands(target_notes, actual_notes, interactive=False,
+                              n_islands=4, island_size=POP_SIZE // 2,
+                              ngen=N_GENERATIONS, migration_interval=5, migration_size=5,
+                              parallel=False, processes=None):
+    """
+    Island model variant of find_best_mapping: n_islands independent populations
+    evolve for migration_interval generations, then the migration_size best
+    individuals of each island move to the next one (ring topology).
+    The Pareto fronts of all islands are merged at the end.
+
+    @param parallel: evolve the islands in the shared process pool (see get_process_pool).
+    """
+    _create_deap_types()
+
+    eval_function = get_eval_function(target_notes, actual_notes)
+    batch_eval_function = get_batch_eval_function(target_notes, actual_notes)
+
+    def to_individuals(pairs):
+        individuals = list()
+        for mapping, fitness in pairs:
+            ind = creator.Individual(mapping)
+            ind.fitness.values = fitness
+            individuals.append(ind)
+        return individuals
+
+    islands = [[initial_guess(len(target_notes), len(actual_notes))
+                for _ in range(island_size)]
+               for _ in range(n_islands)]
+    hof = tools.ParetoFront()
+
+    pool = get_process_pool(processes) if parallel else None
+
+    gen = 0
+    while gen < ngen:
+        epoch_gens = min(migration_interval, ngen - gen)
+        args = [(target_notes, actual_notes, [list(ind) for ind in island], epoch_gens,
+                 random.random()) for island in islands]
+        if pool is not None:
+            results = pool.starmap(_evolve_island, args)
+        else:
+            results = [_evolve_island(*a) for a in args]
+
+        islands = [to_individuals(population) for population, _ in results]
+        for _, island_front in results:
+            hof.update(to_individuals(island_front))
+
+        gen += epoch_gens
+        if gen < ngen and n_islands > 1:
+            tools.migRing(islands, migration_size, tools.selBest,
+                          replacement=random.sample)
+        print("islands: generation", gen, "| merged pareto front size", len(hof))
+
+    return _pick_best(hof, eval_function, batch_eval_function, interactive=interactive)
+
+
+def get_mapping(task_data, actualNoteInfoList, interactive=False,
+                parallel=False, n_islands=0):
+    if n_islands > 0:
+        mapping = find_best_mapping_islands(task_data.all_notes(), actualNoteInfoList,
+                                            interactive=interactive, n_islands=n_islands,
+                                            parallel=parallel)
+    else:
+        mapping = find_best_mapping(task_data.all_notes(), actualNoteInfoList,
+                                    interactive=interactive, parallel=parallel)
     print ("played notes", task_data.all_notes())
     print ("actual notes", actualNoteInfoList)
     return mapping
@@ -3,88 +3,156 @@ Calculates the error in regards to pitch and timing using an approach inspired
 by the levenshtein distance.
 """
 
-from collections import defaultdict, namedtuple
+from collections import namedtuple
 from pprint import pprint
 
+import numpy as np
+
 
 
 def viz_d(d):
-    import numpy as np
-    xs, ys = zip(*d.keys())
-    v = np.zeros((max(xs)+2, max(ys)+2))
-    
-    for (x, y), val in d.items():
-        v[x+1, y+1] = val
-    
-    print(v)
+    print(d)
+
+
+# tokens of the edit path, numbered in the order in which the old string
+# based implementation compared them (lexicographically)
+WAY_TOKENS = ["-", "del", "ins", "sub", "trans1", "trans2"]
+MATCH, DEL, INS, SUB, TRANS1, TRANS2 = range(len(WAY_TOKENS))
+
+
+class _WayTrie:
+    """
+    Stores the edit paths ("ways") of all cells as nodes of a trie, so that a
+    path costs a single node instead of a copied list. Identical paths share
+    one node, which allows comparing paths by walking up to their common ancestor.
+    """
+
+    def __init__(self):
+        self.parent = [0]
+        self.token = [-1]
+        self.depth = [0]
+        self.children = dict()
+
+    def child(self, node, token):
+        key = (node, token)
+        if key not in self.children:
+            self.children[key] = len(self.parent)
+            self.parent.append(node)
+            self.token.append(token)
+            self.depth.append(self.depth[node] + 1)
+        return self.children[key]
+
+    def less(self, u, u_token, v, v_token):
+        """
+        Lexicographic comparison of the paths u + [u_token] and v + [v_token].
+        """
+        if u == v:
+            return u_token < v_token
+
+        depth, parent, token = self.depth, self.parent, self.token
+        a, a_token, b, b_token = u, u_token, v, v_token
+        # a_token / b_token are the elements at position depth(a) + 1
+        while depth[a] > depth[b]:
+            a, a_token = parent[a], token[a]
+        while depth[b] > depth[a]:
+            b, b_token = parent[b], token[b]
+        while a != b:
+            a, a_token = parent[a], token[a]
+            b, b_token = parent[b], token[b]
+
+        if a_token != b_token:
+            return a_token < b_token
+        # one path is a prefix of the other
+        return depth[u] < depth[v]
+
+    def tokens(self, node):
+        way = list()
+        while node != 0:
+            way.append(WAY_TOKENS[self.token[node]])
+            node = self.parent[node]
+        return way[::-1]
 
 
 def damerau_levenshtein_distance(s1, s2, with_transposition=True, verbose=True):
-    d = {}
-    way = defaultdict(list)
-    mapping = defaultdict(list)
+    """
+    Computes the (Damerau-)Levenshtein distance between s1 and s2 and maps the
+    elements of s2 to elements of s1.
+    The distance table is an integer array with a back-pointer array next to it;
+    the mapping is recovered in a single backtrace at the end. Ties between
+    equally expensive options are broken by comparing their edit paths.
+
+    @return: dict mapping the index of each inserted/matched element of s2 to
+             the index of the element of s1 it belongs to
+    """
     lenstr1 = len(s1)
     lenstr2 = len(s2)
-    for i in range(-1,lenstr1):
-        d[(i,-1)] = i+1
-    for j in range(-1,lenstr2):
-        d[(-1,j)] = j+1
-
-    for i in range(lenstr1):
-        for j in range(lenstr2):
-            if s1[i] == s2[j]:
+
+    ## index 0 of the arrays stands for position -1 of the strings
+    d = np.zeros((lenstr1 + 1, lenstr2 + 1), dtype=int)
+    d[:, 0] = np.arange(lenstr1 + 1)
+    d[0, :] = np.arange(lenstr2 + 1)
+
+    ## step that was chosen for the mapping (transpositions don't change it)
+    back = np.full((lenstr1 + 1, lenstr2 + 1), -1, dtype=np.int8)
+    ## node of the edit path in the trie, 0 is the empty path
+    way = np.zeros((lenstr1 + 1, lenstr2 + 1), dtype=int)
+    trie = _WayTrie()
+
+    for i in range(1, lenstr1 + 1):
+        for j in range(1, lenstr2 + 1):
+            if s1[i - 1] == s2[j - 1]:
                 cost = 0
-                cost_way = ["-"]
+                cost_way = MATCH
             else:
                 cost = 1
-                cost_way = ["sub"]
-                
-                
-            options = zip ([   
-                           d[(i-1,j)] + 1, # deletion
-                           d[(i,j-1)] + 1, # insertion
-                           d[(i-1,j-1)] + cost, # substitution
-                    ],#, ["del", "ins", "sub"], 
-                [
-                    way[(i-1,j)] + ["del"], # deletion
-                    way[(i,j-1)] + ["ins"], # insertion
-                    way[(i-1,j-1)] + cost_way ,
-                    ],
-                [
-                    mapping[(i-1,j)] + [()], # deletion
-                    mapping[(i,j-1)] + [(i,j)], # insertion
-                    mapping[(i-1,j-1)] + [(i,j)] ,
-                    ])
-            best_option = sorted(options)[0]
-            d[(i,j)] = best_option[0]
-            way[(i,j)] = best_option[1]
-            mapping[(i,j)] = best_option[2]
+                cost_way = SUB
+
+            options = [
+                (d[i - 1, j] + 1, way[i - 1, j], DEL),  # deletion
+                (d[i, j - 1] + 1, way[i, j - 1], INS),  # insertion
+                (d[i - 1, j - 1] + cost, way[i - 1, j - 1], cost_way),  # substitution
+            ]
+            best_cost, best_way, best_step = options[0]
+            for option_cost, option_way, option_step in options[1:]:
+                if option_cost < best_cost or (
+                        option_cost == best_cost and
+                        trie.less(option_way, option_step, best_way, best_step)):
+                    best_cost, best_way, best_step = option_cost, option_way, option_step
+
+            d[i, j] = best_cost
+            way[i, j] = trie.child(best_way, best_step)
+            back[i, j] = best_step
             if not with_transposition:
                 continue
-            
-            if i and j and s1[i]==s2[j-1] and s1[i-1] == s2[j]:
-                if d[i-2,j-2] + cost <= d[(i,j)]:
-                    d[(i,j)] = d[i-2,j-2] + cost # transposition
-                    way[(i,j)] = way[(i-2,j-2)] + ["trans1", "trans2"]
 
-    
-    
-    distance = d[lenstr1-1,lenstr2-1]
-    way_description = way[lenstr1-1,lenstr2-1]
-    
-    mapping = mapping[lenstr1-1,lenstr2-1]
-    mapping = [t for t in mapping if len(t) > 0]
-    mapping = {a:t for t, a in mapping}
-    
-    
+            if i > 1 and j > 1 and s1[i - 1] == s2[j - 2] and s1[i - 2] == s2[j - 1]:
+                if d[i - 2, j - 2] + cost <= d[i, j]:
+                    d[i, j] = d[i - 2, j - 2] + cost  # transposition
+                    way[i, j] = trie.child(trie.child(way[i - 2, j - 2], TRANS1), TRANS2)
+
+    ## backtrace: deletions don't map anything, insertions and (mis)matches map
+    ## the current element of s2 to the current element of s1
+    mapping = list()
+    i, j = lenstr1, lenstr2
+    while i > 0 and j > 0:
+        step = back[i, j]
+        if step == DEL:
+            i -= 1
+            continue
+        mapping.append((j - 1, i - 1))
+        if step == INS:
+            j -= 1
+        else:
+            i, j = i - 1, j - 1
+    mapping = dict(reversed(mapping))
+
     if verbose:
         # viz_d(d)
-        print(distance)
-        print(way_description)
+        print(d[lenstr1, lenstr2])
+        print(trie.tokens(way[lenstr1, lenstr2]))
         # print(mapping)
-        
-    return mapping
 
+    return mapping
 
 
 def get_mapping(task_data, actualNoteInfoList):
@@ -106,10 +174,10 @@ def get_mapping(task_data, actualNoteInfoList):
     mapping = {k-1:v-1 for k, v in mapping.items()}
     print("MAP", mapping)
     
-    rmap = dict() #defaultdict(list)
-    for target_i in range(len(targetNoteInfoList)):
-        rmap[target_i] = [actual_i for actual_i, ti in mapping.items() if 
-                               ti == target_i]
+    rmap = {target_i: list() for target_i in range(len(targetNoteInfoList))}
+    for actual_i, target_i in mapping.items():
+        if target_i in rmap:
+            rmap[target_i].append(actual_i)
 
     print("RMAP", rmap)   
         
@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Online version of the DP alignment (mappingDP) that is updated with every note
+the user finishes during playback, so the error is ready right after the last
+note_off instead of being computed over the whole recording afterwards.
+
+The DP table is filled column by column (one column per actual note, sorted by
+onset). The actual notes arrive ordered by their note_off, so a note that was
+started before already aligned ones (e.g. a held note in a chord) rewinds the
+table to its position, which only costs the few columns after it.
+
+Every note also updates the state the errors are computed from (mapping, debug
+columns of the played notes, hand of each possible extra note). A new note can
+change the alignment of earlier ones, so the errors are sums over this state
+(per hand and time range) instead of running totals.
+"""
+
+import bisect
+import threading
+
+import numpy as np
+
+from error_calc import mappingDP
+from error_calc.explanation import Error, get_anchor_map, get_debug_columns, \
+    debug_columns_from_arrays, debug_row, assign_extra_notes, get_hand_error
+
+# back-pointer values, as in mappingDP
+DIAG, UP, LEFT = mappingDP.DIAG, mappingDP.UP, mappingDP.LEFT
+
+
+class OnlineScorer:
+    """
+    Aligns the played notes against task_data.all_notes() while they come in and
+    keeps the running error per hand.
+
+    Usage: create one per trial, call add_note with every NoteInfo returned by
+    noteHandler.handleNote, and get the final result with mapping() / errors().
+    add_note is thread safe (it is called from the MIDI input callback).
+    """
+
+    def __init__(self, task_data, gap_cost=mappingDP.GAP_COST):
+        self.task_data = task_data
+        self.gap_cost = gap_cost
+        self.target = task_data.all_notes()
+        self.target_on, self.target_pitch, self.target_order = \
+            mappingDP._note_arrays(self.target)
+
+        self.total_time_note_on = sum(t.note_off_time - t.note_on_time for t in self.target)
+        self.anchor_map = get_anchor_map(self.target)
+        self.target_debug = get_debug_columns(self.target, list(range(len(self.target))),
+                                              self.anchor_map)
+
+        # actual notes in the order they were played (finished)
+        self.actual_notes = list()
+        # pitch, velocity, note_on_time and note_off_time of the actual notes
+        self._actual_columns = (np.zeros(0, dtype=int), np.zeros(0, dtype=int),
+                                np.zeros(0), np.zeros(0))
+        # hand every actual note is assigned to if it is an extra note
+        self._extra_note_hands = list()
+        # (note_on_time, pitch, index in actual_notes), sorted
+        self._sorted_keys = list()
+
+        n = len(self.target)
+        # columns[j] holds the DP costs / back-pointers after j actual notes
+        self._costs = [np.arange(n + 1) * gap_cost]
+        self._pointers = [np.full(n + 1, UP, dtype=np.int8)]
+
+        # alignment of the notes played so far and their debug columns, both
+        # replaced (not changed) by add_note
+        self._mapping = [-1] * n
+        self._actual_debug = debug_columns_from_arrays(*self._actual_columns, self._mapping,
+                                                       self.anchor_map)
+
+        self._lock = threading.Lock()
+        # time of the last note_off, target notes after it aren't due yet
+        self.current_time = 0.0
+
+    def add_note(self, note_info):
+        """
+        Adds a finished note and updates the alignment and the error state.
+
+        @param note_info: NoteInfo with note_on_time and note_off_time set.
+        @return: None
+        """
+        with self._lock:
+            key = (note_info.note_on_time, note_info.pitch, len(self.actual_notes))
+            self.actual_notes.append(note_info)
+            self.current_time = max(self.current_time, note_info.note_off_time)
+
+            position = bisect.bisect(self._sorted_keys, key)
+            self._sorted_keys.insert(position, key)
+
+            # drop the columns from the new note on and recompute them
+            del self._costs[position + 1:]
+            del self._pointers[position + 1:]
+            for on, pitch, _ in self._sorted_keys[position:]:
+                costs, pointers = self._next_column(self._costs[-1], on, pitch)
+                self._costs.append(costs)
+                self._pointers.append(pointers)
+
+            extra_notes_dict = assign_extra_notes(self.task_data, [note_info])
+            self._extra_note_hands.append("left" if extra_notes_dict["left"] else "right")
+            new_values = (note_info.pitch, note_info.velocity,
+                          note_info.note_on_time, note_info.note_off_time)
+            self._actual_columns = tuple(np.append(column, value) for column, value
+                                         in zip(self._actual_columns, new_values))
+
+            self._mapping = self._backtrace()
+            self._actual_debug = debug_columns_from_arrays(*self._actual_columns, self._mapping,
+                                                           self.anchor_map)
+
+    def _next_column(self, prev_column, actual_on, actual_pitch):
+        """
+        Computes the DP column of the next actual note, with the same preference
+        as mappingDP on ties (match, then missing note, then extra note). The
+        costs are summed in another order than in mappingDP, so they are
+        compared with mappingDP.is_less.
+        The chain of missing notes (UP) along the column is resolved with a
+        cumulative minimum.
+        """
+        gap_cost = self.gap_cost
+
+        from_left = prev_column + gap_cost
+        from_diag = np.full(len(prev_column), np.inf)
+        from_diag[1:] = prev_column[:-1] + mappingDP.match_cost(
+            self.target_on, self.target_pitch, actual_on, actual_pitch)
+
+        best = np.minimum(from_diag, from_left)
+        pointers = np.where(mappingDP.is_less(from_left, from_diag), LEFT, DIAG).astype(np.int8)
+
+        # column[i] = min_k<=i (best[k] + (i - k) * gap_cost)
+        steps = np.arange(len(prev_column)) * gap_cost
+        candidates = best - steps
+        running_min = np.minimum.accumulate(candidates)
+        column = running_min + steps
+
+        # coming from above is better than a match, or as good as an extra note
+        from_up_better = mappingDP.is_less(running_min[:-1], candidates[1:])
+        from_up_tie = ~mappingDP.is_less(candidates[1:], running_min[:-1]) & (pointers[1:] == LEFT)
+        pointers[1:][from_up_better | from_up_tie] = UP
+
+        return column, pointers
+
+    def _backtrace(self):
+        mapping = [-1] * len(self.target)
+        i, j = len(self.target), len(self._sorted_keys)
+        while i > 0 or j > 0:
+            step = self._pointers[j][i]
+            if step == DIAG:
+                mapping[self.target_order[i - 1]] = self._sorted_keys[j - 1][2]
+                i, j = i - 1, j - 1
+            elif step == UP:
+                i -= 1
+            else:
+                j -= 1
+
+        return mapping
+
+    def mapping(self):
+        """
+        @return: current mapping (list with the index of the actual note for every
+                 target note, -1 if missing), see mappingDP.align
+        """
+        with self._lock:
+            return list(self._mapping)
+
+    def cost(self):
+        with self._lock:
+            return float(self._costs[-1][-1])
+
+    def errors(self, up_to=None, since=None):
+        """
+        Error per hand of the notes played so far, computed as in
+        explanation.get_explanation. Target notes that aren't due yet (after the
+        last note_off) don't count as missing.
+
+        @param up_to: only take notes with onsets before this time into account,
+                      defaults to the time of the last note_off, use np.inf after
+                      playback to get the same errors as get_explanation.
+        @param since: only take notes with onsets from this time on into account.
+        @return: error_total, error_left, error_right
+        """
+        with self._lock:
+            mapping, actual_debug = self._mapping, self._actual_debug
+            extra_note_hands = np.array(self._extra_note_hands, dtype=str)
+            current_time = self.current_time
+        up_to = current_time if up_to is None else up_to
+        since = -np.inf if since is None else since
+
+        target_indices = np.flatnonzero((self.target_debug.note_on_time >= since)
+                                        & (self.target_debug.note_on_time < up_to))
+
+        is_extra = (actual_debug.note_on_time >= since) & (actual_debug.note_on_time < up_to)
+        is_extra[[idx for idx in mapping if idx != -1]] = False
+        extra_notes_dict = {hand: [debug_row(actual_debug, idx) for idx
+                                   in np.flatnonzero(is_extra & (extra_note_hands == hand))]
+                            for hand in ("left", "right")}
+
+        error_left, error_right = [
+            get_hand_error(self.task_data, self.target_debug, actual_debug, mapping, hand,
+                           extra_notes_dict[hand], self.total_time_note_on,
+                           target_indices=target_indices)
+            for hand in ("left", "right")]
+        error_total = Error(*[l + r for l, r in zip(error_left, error_right)])
+
+        return error_total, error_left, error_right
+
+    def errors_per_bar(self):
+        """
+        Summed error of every bar played so far (e.g. to show it during playback).
+
+        @return: list of Error, one per bar
+        """
+        bar_duration = mappingDP.window_from_task(self.task_data, bars=1)
+        if bar_duration is None:
+            return [self.errors()[0]]
+
+        n_bars = int(self.current_time // bar_duration) + 1
+        n_bars = min(n_bars, self.task_data.number_of_bars)
+        return [self.errors(since=bar * bar_duration, up_to=(bar + 1) * bar_duration)[0]
+                for bar in range(n_bars)]
@@ -9,15 +9,16 @@ NoteInfo = namedtuple("NoteInfo", ["pitch", "velocity", "note_on_time", "note_of
 from task_generation.task_data import TaskData
 from task_generation.generator import TaskNote
 from task_generation.note_range_per_hand import NoteRangePerHand
-
+from task_generation.task_parameters import TaskParameters
 
 
 def TaskDataFromNotes(left=None, right=None):
     left = left or list()
     right = right or list()
-    td = TaskData(time_signature=(4,4), 
+    td = TaskData(parameters=TaskParameters(note_range_right=NoteRangePerHand.C_TO_G,
+                                            note_range_left=NoteRangePerHand.C_TO_G),
+                    time_signature=(4,4), 
                     number_of_bars=99, 
-                    note_range=NoteRangePerHand.C_TO_G, 
                     notes_right=left, #not used but checked with len i think
                     notes_left=right, #not used but checked with len i think
                     bpm=120)
@@ -156,6 +157,415 @@ def test_evo_scale_drop():
     print(sum(results)/len(results))
         
 
+def dict_based_levenshtein(s1, s2, with_transposition=True, verbose=True):
+    """
+    damerau_levenshtein_distance as it was before the array version (to test
+    that the mapping and output stay the same).
+    """
+    from collections import defaultdict
+    
+    d = {}
+    way = defaultdict(list)
+    mapping = defaultdict(list)
+    lenstr1 = len(s1)
+    lenstr2 = len(s2)
+    for i in range(-1,lenstr1):
+        d[(i,-1)] = i+1
+    for j in range(-1,lenstr2):
+        d[(-1,j)] = j+1
+
+    for i in range(lenstr1):
+        for j in range(lenstr2):
+            if s1[i] == s2[j]:
+                cost = 0
+                cost_way = ["-"]
+            else:
+                cost = 1
+                cost_way = ["sub"]
+            
+            options = zip ([   
+                           d[(i-1,j)] + 1, # deletion
+                           d[(i,j-1)] + 1, # insertion
+                           d[(i-1,j-1)] + cost, # substitution
+                    ],
+                [
+                    way[(i-1,j)] + ["del"], # deletion
+                    way[(i,j-1)] + ["ins"], # insertion
+                    way[(i-1,j-1)] + cost_way ,
+                    ],
+                [
+                    mapping[(i-1,j)] + [()], # deletion
+                    mapping[(i,j-1)] + [(i,j)], # insertion
+                    mapping[(i-1,j-1)] + [(i,j)] ,
+                    ])
+            best_option = sorted(options)[0]
+            d[(i,j)] = best_option[0]
+            way[(i,j)] = best_option[1]
+            mapping[(i,j)] = best_option[2]
+            if not with_transposition:
+                continue
+            
+            if i and j and s1[i]==s2[j-1] and s1[i-1] == s2[j]:
+                if d[i-2,j-2] + cost <= d[(i,j)]:
+                    d[(i,j)] = d[i-2,j-2] + cost # transposition
+                    way[(i,j)] = way[(i-2,j-2)] + ["trans1", "trans2"]
+    
+    distance = d[lenstr1-1,lenstr2-1]
+    way_description = way[lenstr1-1,lenstr2-1]
+    
+    mapping = mapping[lenstr1-1,lenstr2-1]
+    mapping = [t for t in mapping if len(t) > 0]
+    mapping = {a:t for t, a in mapping}
+    
+    if verbose:
+        print(distance)
+        print(way_description)
+        
+    return mapping
+
+
+def test_levenshtein_same_as_dict_based():
+    import contextlib
+    import io
+    import random
+    from error_calc.mappingLevenshtein import damerau_levenshtein_distance
+    
+    def mapping_and_output(function, *args):
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            mapping = function(*args)
+        return mapping, output.getvalue()
+    
+    random.seed(0)
+    for i in range(500):
+        # few different pitches, so there are many ties and transpositions
+        s1 = [-999] + [random.randint(0, 2) for _ in range(random.randint(0, 8))]
+        s2 = [-999] + [random.randint(0, 2) for _ in range(random.randint(0, 8))]
+        for with_transposition in [True, False]:
+            assert mapping_and_output(damerau_levenshtein_distance, s1, s2, with_transposition) == \
+                   mapping_and_output(dict_based_levenshtein, s1, s2, with_transposition)
+
+
+
+def test_dp_scale_drop():
+    from error_calc.functions import computeErrorEvo as ce_evo
+    
+    for i in range(50):
+        target_notes = simple_rhythmic() 
+        actual_notes = target_notes.copy()
+        drop_notes(actual_notes, verbose=False)
+        
+        missing_time_ons = set(t.note_on_time for t in target_notes).difference(
+                a.note_on_time for a in actual_notes)
+        
+        explanation, error, _, _ = ce_evo(
+            TaskDataFromNotes(right=target_notes),
+                                    actual_notes, False, False, aligner="dp")
+        
+        selected_time_ons = set(note.note_on_time_target for note in explanation
+                                if type(note) == NoteMissing)
+        
+        assert selected_time_ons == missing_time_ons
+
+
+def test_dp_linear_space_same_mapping():
+    from error_calc.mappingDP import align, align_linear_space
+    
+    for i in range(20):
+        target_notes = simple_rhythmic() * 3
+        actual_notes = target_notes.copy()
+        drop_notes(actual_notes, verbose=False)
+        repeat_notes(actual_notes, verbose=False)
+        wrong_pitch(actual_notes, verbose=False)
+        
+        assert align(target_notes, actual_notes) == \
+               align_linear_space(target_notes, actual_notes, block_rows=4)
+
+
+def test_explanation_fixed_errors():
+    from error_calc.explanation import Error, get_explanation
+    from error_calc.explanation_helpers import NoteExpected
+    import numpy as np
+    
+    notes_left = [n._replace(pitch=n.pitch + 48) for n in simple_rhythmic()]
+    notes_right = [n._replace(pitch=n.pitch + 60) for n in simple_scale()]
+    task_data = TaskDataFromNotes(left=notes_left, right=notes_right)
+    
+    # wrong pitch, late, too short, early with wrong pitch, two missing and three extra notes
+    actual_notes = list(task_data.all_notes())
+    actual_notes[2] = actual_notes[2]._replace(pitch=actual_notes[2].pitch + 1)
+    actual_notes[4] = actual_notes[4]._replace(note_on_time=4.2)
+    actual_notes[5] = actual_notes[5]._replace(note_off_time=actual_notes[5].note_off_time - 0.3)
+    actual_notes[9] = actual_notes[9]._replace(note_on_time=7.95, pitch=actual_notes[9].pitch + 2)
+    mapping = list(range(len(actual_notes)))
+    mapping[7] = mapping[12] = -1
+    actual_notes += [NoteInfo(61, 64, 3.1, 3.5), NoteInfo(49, 64, 9.5, 9.7), NoteInfo(70, 64, 12.2, 13.0)]
+    
+    output_note_list, error, error_left, error_right = get_explanation(
+        task_data, actual_notes, mapping, inject_explanation=False)
+    
+    # computed with the implementation before the numpy one
+    expected_left = Error(pitch=0.11320754716981132, note_hold_time=0.0006313131313131314,
+                          timing=0.03571428571428571, n_missing_notes=0.125, t_missing_notes=0.03125,
+                          n_extra_notes=0.25, t_extra_notes=0.45, number_of_notes=8)
+    expected_right = Error(pitch=0.0, note_hold_time=0.0007575757575757571, timing=0.0,
+                           n_missing_notes=0.1111111111111111, t_missing_notes=0.1111111111111111,
+                           n_extra_notes=0.3333333333333333, t_extra_notes=2.2, number_of_notes=9)
+    expected = Error(*[l + r for l, r in zip(expected_left, expected_right)])
+    for actual, expected in [(error, expected), (error_left, expected_left), (error_right, expected_right)]:
+        assert np.allclose(actual, expected, rtol=0, atol=1e-12)
+    
+    assert [note.note_on_time_target for note in output_note_list if type(note) == NoteMissing] == [6.0, 9.5]
+    assert sorted(set(note.note_on_time for note in output_note_list if type(note) == NoteExtra)) == \
+           [3.1, 6.0, 9.5, 12.2]
+    relative_onsets = [(note.note_on_time, note.note_on_time_relative) for note in output_note_list
+                       if type(note) == NoteExpected]
+    assert np.allclose(relative_onsets,
+                       [(0, 0), (0, 0), (2, 2), (2, 2), (4, 2), (4.2, 2.2), (6, 2), (7, 1), (7.95, 0.95),
+                        (8, 1), (9, 1), (10, 0.5), (10, 0.5), (12, 2), (14, 2)], rtol=0, atol=1e-12)
+
+
+def test_online_scorer_same_error():
+    from error_calc.functions import computeErrorEvo as ce_evo
+    from error_calc.onlineScorer import OnlineScorer
+    import numpy as np
+    
+    for i in range(20):
+        target_notes = simple_rhythmic()
+        actual_notes = target_notes.copy()
+        drop_notes(actual_notes, verbose=False)
+        wrong_pitch(actual_notes, verbose=False)
+        actual_notes = sorted(actual_notes, key=lambda n: n.note_off_time)
+        
+        task_data = TaskDataFromNotes(right=target_notes)
+        scorer = OnlineScorer(task_data)
+        for note in actual_notes:
+            scorer.add_note(note)
+        
+        _, error, error_left, error_right = ce_evo(task_data, actual_notes,
+                                                   False, False, aligner="dp")
+        
+        assert scorer.errors(up_to=np.inf) == (error, error_left, error_right)
+
+
+def test_online_scorer_same_error_two_hands():
+    import random
+    from error_calc.functions import computeErrorEvo as ce_evo
+    from error_calc.onlineScorer import OnlineScorer
+    import numpy as np
+    
+    random.seed(0)
+    for i in range(20):
+        notes_left = [n._replace(pitch=n.pitch + 48) for n in simple_rhythmic()]
+        notes_right = [n._replace(pitch=n.pitch + 60) for n in simple_scale()]
+        actual_notes = notes_left + notes_right
+        drop_notes(actual_notes, verbose=False)
+        repeat_notes(actual_notes, verbose=False)
+        wrong_pitch(actual_notes, verbose=False)
+        actual_notes = sorted(actual_notes, key=lambda n: n.note_off_time)
+        
+        task_data = TaskDataFromNotes(left=notes_left, right=notes_right)
+        scorer = OnlineScorer(task_data)
+        for note in actual_notes:
+            scorer.add_note(note)
+        
+        _, error, error_left, error_right = ce_evo(task_data, actual_notes,
+                                                   False, False, aligner="dp")
+        
+        assert scorer.errors(up_to=np.inf) == (error, error_left, error_right)
+        assert len(scorer.errors_per_bar()) == int(scorer.current_time // 2) + 1
+
+
+def test_online_scorer_same_mapping_decimal_onsets():
+    import random
+    from error_calc.mappingDP import align
+    from error_calc.onlineScorer import OnlineScorer
+    
+    # onsets like 0.1 or 0.3 aren't exact floats, so the costs of both tables
+    # differ by rounding errors
+    random.seed(0)
+    for i in range(200):
+        target_notes = list()
+        time = 0
+        for _ in range(12):
+            time += random.choice([0.1, 0.2, 0.3, 0.7])
+            target_notes.append(NoteInfo(random.randint(0, 4), 64, round(time, 1), round(time + 0.3, 1)))
+        actual_notes = target_notes.copy()
+        drop_notes(actual_notes, verbose=False)
+        repeat_notes(actual_notes, verbose=False)
+        wrong_pitch(actual_notes, verbose=False)
+        actual_notes = [n._replace(note_on_time=round(n.note_on_time + random.choice([0, 0.1, -0.1, 0.3]), 1))
+                        for n in actual_notes]
+        actual_notes = sorted(actual_notes, key=lambda n: n.note_off_time)
+        
+        scorer = OnlineScorer(TaskDataFromNotes(right=target_notes))
+        for note in actual_notes:
+            scorer.add_note(note)
+        
+        assert scorer.mapping() == align(target_notes, actual_notes)[0]
+
+
+def is_valid_mapping(mapping, target_notes, actual_notes):
+    return len(mapping) == len(target_notes) and \
+        all(-1 <= m < len(actual_notes) for m in mapping)
+
+
+def test_evo_parallel_same_as_serial():
+    import random
+    from error_calc.mappingEvo import find_best_mapping, find_best_mapping_islands, close_process_pool
+    
+    try:
+        for i in range(2):
+            random.seed(i)
+            target_notes = simple_rhythmic()
+            actual_notes = target_notes.copy()
+            drop_notes(actual_notes, verbose=False)
+            wrong_pitch(actual_notes, verbose=False)
+            
+            results = dict()
+            for parallel in [False, True]:
+                random.seed(100 + i)
+                results["evo", parallel] = find_best_mapping(target_notes, actual_notes,
+                                                             parallel=parallel, processes=2)
+                random.seed(100 + i)
+                results["islands", parallel] = find_best_mapping_islands(
+                    target_notes, actual_notes, n_islands=3, island_size=20, ngen=6,
+                    migration_interval=3, parallel=parallel, processes=2)
+            
+            for mapping in results.values():
+                assert is_valid_mapping(mapping, target_notes, actual_notes)
+            assert results["evo", False] == results["evo", True]
+            assert results["islands", False] == results["islands", True]
+    finally:
+        close_process_pool()
+
+
+def test_evo_island_keeps_random_state():
+    import random
+    from error_calc.mappingEvo import _create_deap_types, _evolve_island, initial_guess
+    
+    random.seed(0)
+    target_notes = simple_rhythmic()
+    actual_notes = target_notes.copy()
+    drop_notes(actual_notes, verbose=False)
+    _create_deap_types()
+    population = [initial_guess(len(target_notes), len(actual_notes)) for _ in range(10)]
+    
+    # the serial island fallback runs in this process
+    state = random.getstate()
+    _evolve_island(target_notes, actual_notes, population, 2, seed=123)
+    assert random.getstate() == state
+
+
+def test_evo_batch_eval_same_as_eval():
+    import random
+    import numpy as np
+    from error_calc.mappingEvo import get_eval_function, get_batch_eval_function, initial_guess, mutGeneral
+    
+    random.seed(0)
+    for target_notes in [simple_scale(), simple_rhythmic()]:
+        actual_notes = target_notes.copy()
+        drop_notes(actual_notes, verbose=False)
+        repeat_notes(actual_notes, verbose=False)
+        wrong_pitch(actual_notes, verbose=False)
+        add_pause(actual_notes, verbose=False)
+        n_target, n_actual = len(target_notes), len(actual_notes)
+        
+        # initial guesses, their mutations and arbitrary mappings (each actual note at most once)
+        population = [initial_guess(n_target, n_actual) for _ in range(50)]
+        population += [mutGeneral(n_actual, list(m), 0.3)[0] for m in population]
+        for _ in range(50):
+            mapping = random.sample(range(n_actual), min(n_target, n_actual)) + [-1] * n_target
+            population.append(random.sample(mapping, n_target))
+        population += [[-1] * n_target, list(range(n_target))]
+        
+        eval_function = get_eval_function(target_notes, actual_notes)
+        batch_eval_function = get_batch_eval_function(target_notes, actual_notes)
+        expected = [eval_function(m) for m in population]
+        assert np.allclose(batch_eval_function(population), expected)
+        assert batch_eval_function([]) == []
+
+
+def test_fitness_cache_lru():
+    from error_calc.mappingEvo import FitnessCache
+    
+    evaluated = []
+    def eval_function(mapping):
+        evaluated.append(tuple(mapping))
+        return (sum(mapping),)
+    def batch_eval_function(population):
+        return [eval_function(m) for m in population]
+    
+    cache = FitnessCache(maxsize=2)
+    cached_eval = cache.wrap(eval_function)
+    cached_batch_eval = cache.wrap_batch(batch_eval_function)
+    
+    assert cached_eval([0, 1]) == (1,)
+    assert cached_eval([1, 2]) == (3,)
+    assert cached_eval([0, 1]) == (1,)
+    assert tuple(cache.info()) == (1, 2, 2, 2)
+    
+    # [1, 2] is the least recently used one, evaluated once per batch even if repeated
+    assert cached_batch_eval([[2, 3], [0, 1], [2, 3]]) == [(5,), (1,), (5,)]
+    assert tuple(cache.info()) == (3, 3, 2, 2)
+    assert cached_eval([1, 2]) == (3,)
+    assert evaluated == [(0, 1), (1, 2), (2, 3), (1, 2)]
+    
+    # then [0, 1] was the least recently used one
+    assert cached_batch_eval([[0, 1], [1, 2], [2, 3]]) == [(1,), (3,), (5,)]
+    assert tuple(cache.info()) == (5, 5, 2, 2)
+    assert evaluated[-1] == (0, 1) and len(evaluated) == 5
+    
+    # verbose calls aren't cached
+    cache = FitnessCache(maxsize=2)
+    cache.wrap(lambda mapping, verbose=False: (0,))([0], verbose=True)
+    assert tuple(cache.info()) == (0, 0, 2, 0)
+
+
+def shifted(notes, offset):
+    return [n._replace(note_on_time=n.note_on_time + offset,
+                       note_off_time=n.note_off_time + offset) for n in notes]
+
+
+def test_dp_banded_same_mapping():
+    import random
+    from error_calc.mappingDP import get_mapping
+    
+    random.seed(0)
+    for i in range(20):
+        # in tempo (with a bit of jitter), distinct onsets
+        target_notes = simple_scale() + [n._replace(pitch=n.pitch + 3) for n in shifted(simple_rhythmic(), 16)]
+        actual_notes = target_notes.copy()
+        drop_notes(actual_notes, verbose=False)
+        repeat_notes(actual_notes, verbose=False)
+        wrong_pitch(actual_notes, verbose=False)
+        actual_notes = [n._replace(note_on_time=n.note_on_time + random.uniform(-0.1, 0.1))
+                        for n in actual_notes]
+        
+        task_data = TaskDataFromNotes(right=target_notes)
+        assert get_mapping(task_data, actual_notes, banded=True) == \
+               get_mapping(task_data, actual_notes)
+
+
+def test_dp_banded_offset():
+    from error_calc.functions import computeErrorEvo as ce_evo
+    from error_calc.mappingDP import get_mapping
+    
+    # the window is one bar (2 seconds at 120 bpm)
+    target_notes = simple_scale()
+    task_data = TaskDataFromNotes(right=target_notes)
+    identity = list(range(len(target_notes)))
+    assert get_mapping(task_data, shifted(target_notes, 1.5), banded=True) == identity
+    
+    # the performance starts after the window of the last target
+    actual_notes = shifted(target_notes, 20)
+    explanation, _, _, _ = ce_evo(task_data, actual_notes, False, False, aligner="dp_banded")
+    assert [note.note_on_time_target for note in explanation if type(note) == NoteMissing] == \
+           [note.note_on_time for note in target_notes]
+    assert set(note.note_on_time for note in explanation if type(note) == NoteExtra) == \
+           set(note.note_on_time for note in actual_notes)
+
+
 if __name__ == "__main__":
     target_notes = simple_scale() #simple_rhythmic
     # target_notes = simple_rhythmic() 
@@ -184,6 +594,9 @@ if __name__ == "__main__":
                         # old=ce_old, ## too old
                         levenshtein=ce_lv,
                         evo=ce_evo,    
+                        dp=partial(ce_evo, aligner="dp"),
+                        dp_banded=partial(ce_evo, aligner="dp_banded"),
+                        dp_linear_space=partial(ce_evo, aligner="dp_linear_space"),
                        )
     
     for key, func in error_funcs.items():
@@ -0,0 +1,126 @@
+import hashlib
+import json
+import os
+
+from music21.articulations import Fingering
+
+CACHE_DIR = './output/fingering_cache/'
+# maximum number of cached fingerings, the least recently used ones are removed
+MAX_ENTRIES = 1000
+
+
+def fingering_key(noteseq, side, hand_size, depth, start_measure, n_measures):
+    """
+    Hash of everything PianoPlayer's Hand.generate uses to compute the fingering
+    of one hand. The onsets are relative to the first note and in quarter notes,
+    so the key doesn't depend on the tempo.
+
+    @param noteseq: Notes of the hand (INotes from pianoplayer.scorereader.reader).
+    @param side: "right" or "left".
+    @param hand_size: Hand size.
+    @param depth: Depth of combinatorial search (0: autodepth).
+    @param start_measure: First measure to scan.
+    @param n_measures: Number of measures to scan.
+    @return: Key (hex string).
+    """
+    first_onset = noteseq[0].time if noteseq else 0
+    notes = [(an.name, an.octave, an.x, an.isBlack, float(an.time - first_onset), float(an.duration),
+              an.measure, an.isChord, an.chordnr, an.NinChord if an.isChord else 0)
+             for an in noteseq]
+    description = json.dumps([side, hand_size, depth, start_measure, n_measures, notes])
+    return hashlib.sha256(description.encode()).hexdigest()
+
+
+def apply_fingers(noteseq, fingers):
+    """
+    Adds cached finger numbers to the score, like Hand.generate does (without
+    lyrics): all but the last 3 notes get a Fingering articulation, chords only
+    if they have less than 3 notes.
+
+    @param noteseq: Notes of the hand (INotes from pianoplayer.scorereader.reader).
+    @param fingers: Finger number of every note (0: none).
+    @return: None
+    """
+    n_notes = len(noteseq)
+    for i, (an, finger) in enumerate(zip(noteseq, fingers)):
+        an.fingering = finger
+        if finger > 0 and i < n_notes - 3:
+            if an.isChord:
+                if len(an.chord21.pitches) < 3:
+                    an.chord21.articulations.append(Fingering(finger))
+            else:
+                an.note21.articulations.append(Fingering(finger))
+
+
+class FingeringCache:
+    """
+    Finger numbers computed by PianoPlayer, stored on disk with one JSON file
+    per note sequence (named after its fingering_key). A piece that is loaded
+    again (e.g. with a different bpm) gets its fingering without the
+    combinatorial search. The files are touched when they are read, so the
+    least recently used ones are removed when there are too many.
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR, max_entries=MAX_ENTRIES):
+        """
+        @param cache_dir: Directory of the cache files (created when needed).
+        @param max_entries: Maximum number of cached fingerings.
+        """
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + '.json')
+
+    def get(self, key):
+        """
+        @param key: See fingering_key.
+        @return: Finger number of every note (list), None if the key isn't cached.
+        """
+        path = self._path(key)
+        try:
+            with open(path) as f:
+                fingers = json.load(f)
+            os.utime(path)
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return fingers
+
+    def put(self, key, fingers):
+        """
+        Stores the finger numbers and removes the least recently used entries
+        if there are more than max_entries.
+
+        @param key: See fingering_key.
+        @param fingers: Finger number of every note (0: none).
+        @return: None
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self._path(key)
+        # write to a temporary file first, so a cache file is never incomplete
+        with open(path + '.tmp', 'w') as f:
+            json.dump([finger if isinstance(finger, int) else 0 for finger in fingers], f)
+        os.replace(path + '.tmp', path)
+        self._evict()
+
+    def _evict(self):
+        entries = [entry for entry in os.scandir(self.cache_dir) if entry.name.endswith('.json')]
+        if len(entries) <= self.max_entries:
+            return
+
+        entries.sort(key=lambda entry: entry.stat().st_mtime)
+        for entry in entries[:len(entries) - self.max_entries]:
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+
+    def __len__(self):
+        if not os.path.isdir(self.cache_dir):
+            return 0
+        return sum(name.endswith('.json') for name in os.listdir(self.cache_dir))
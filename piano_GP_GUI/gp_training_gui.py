@@ -1,6 +1,5 @@
 import os
 import time
-import shutil
 import ntpath
 import pathlib
 import subprocess
@@ -28,21 +27,31 @@ import thread_handler
 
 from task_generation.scheduler import Scheduler
 from task_generation.task_parameters import TaskParameters
-from task_generation.gaussian_process import GaussianProcess
 from task_generation.gaussian_process import PracticeMode
+from task_generation.gaussian_process import error_diff_to_utility
+from task_generation.gp_trainer import GPTrainer
+from task_generation.gp_pool import GPPool
 import data_acquisition
 
 #IF 0 THAN EXPERT MODE, IF 1 GP MODE
 GUI_STATE =0
+# score the notes while they are played (DP alignment, see error_calc.onlineScorer)
+# instead of the evolutionary mapping after the take. Off as long as the errors
+# in data.h5 (the GP's training data) were computed with the evolutionary mapping.
+ONLINE_SCORING = False
 # directory constants
 DATA_DIR = './output/data/'
 
 OUTPUT_DIR = './output/'
+# fitted gaussian process of all users, restored at startup if the data hasn't changed
+GP_STATE_FILE = 'gp_state.npz'
 TEMP_DIR = './output/temp/'
 
 EXPERT_DIR = "pics_run_not_data.h5"
 OUTPUT_FILES_STRS = [TEMP_DIR + 'output.mid', TEMP_DIR + 'output-m.mid', TEMP_DIR + 'output-md.mid',
                      TEMP_DIR + 'output.xml']
+# MIDI files of the current task, in memory (see midiProcessing.generateMidi)
+midi_artifacts = None
 OUTPUT_LY_STR = TEMP_DIR + 'output.ly'
 OUTPUT_PNG_STR = TEMP_DIR + 'output.png'
 
@@ -223,11 +232,11 @@ class BaseState:
             self.add_no_fingernumbers_warning()
             if os.name == 'nt':
                 subprocess.run([LILYPOND_PYTHON_EXE_WIN, MIDI_TO_LY_WIN,
-                                OUTPUT_FILES_STRS[0], '--output=' + OUTPUT_LY_STR],
+                                midi_artifacts.notes.spill(), '--output=' + OUTPUT_LY_STR],
                                stderr=subprocess.DEVNULL)
             else:
                 subprocess.run(['midi2ly',
-                                OUTPUT_FILES_STRS[0], '--output=' + OUTPUT_LY_STR],
+                                midi_artifacts.notes.spill(), '--output=' + OUTPUT_LY_STR],
                                stderr=subprocess.DEVNULL)
 
     @staticmethod
@@ -257,9 +266,10 @@ class BaseState:
         @return: calculated errors
         """
         targetNotes, actualNotes, errorVal, error_vec_left, error_vec_right, task_data, note_error_str = \
-            thread_handler.start_midi_playback(OUTPUT_FILES_STRS[2], guidance_mode,
+            thread_handler.start_midi_playback(midi_artifacts.dexmo.mido_file(), guidance_mode,
                                                self.scheduler.current_task_data(),
-                                               use_visual_attention=use_visual_attention.get())
+                                               use_visual_attention=use_visual_attention.get(),
+                                               online_scoring=ONLINE_SCORING)
         df_error = data_acquisition.save_data(error_vec_left, error_vec_right, task_data,
                                                       task_parameters, note_error_str,
                                                       config.participant_id, config.free_text)
@@ -286,9 +296,9 @@ class BaseState:
         time_str = get_current_timestamp()
 
         # MIDI
-        shutil.copy(OUTPUT_FILES_STRS[0], OUTPUT_DIR + time_str + '.mid')
-        shutil.copy(OUTPUT_FILES_STRS[1], OUTPUT_DIR + time_str + '-m.mid')
-        shutil.copy(OUTPUT_FILES_STRS[2], OUTPUT_DIR + time_str + '-md.mid')
+        midi_artifacts.notes.save_as(OUTPUT_DIR + time_str + '.mid')
+        midi_artifacts.metronome.save_as(OUTPUT_DIR + time_str + '-m.mid')
+        midi_artifacts.dexmo.save_as(OUTPUT_DIR + time_str + '-md.mid')
 
         # save task_data and task Parameters to pickle file
         data_to_save = [task_data, task_parameters]
@@ -409,6 +419,8 @@ class SelectNameState(BaseState):
 
     def save_name(self, username):
         statemachine.username = username
+        # fit the user's model while the song is selected
+        statemachine.gp_trainer.load_user(username)
         self.statemachine.to_next_state(statemachine.select_song_state)
         return
 
@@ -495,8 +507,8 @@ class PlayCompleteSong(BaseState):
         self.scheduler.current_task_data().bpm = bpm
         print("changed task bpm ", task_data.bpm,  "debug task parameters ", task_data.parameters.bpm)
 
-
-        midiProcessing.generateMidi(task_data, outFiles=OUTPUT_FILES_STRS)
+        global midi_artifacts
+        midi_artifacts = midiProcessing.generateMidi(task_data, outFiles=OUTPUT_FILES_STRS)
 
         self.gen_ly_for_current_task()
         subprocess.run(['lilypond', '--png', '-o', TEMP_DIR, OUTPUT_LY_STR],
@@ -508,7 +520,7 @@ class PlayCompleteSong(BaseState):
         self.show_function_btn('Play Piece', self.start_playback)
 
         tk.Button(
-            root, text="Play Demo", command=lambda: dexmoOutput.play_demo(OUTPUT_FILES_STRS[2], guidance_mode)
+            root, text="Play Demo", command=lambda: dexmoOutput.play_demo(midi_artifacts.dexmo.mido_file(), guidance_mode)
         ).place(x=10, y=140, height=50, width=150)
 
         self.show_secondary_next_state_btn('Select new Song', statemachine.select_song_state)
@@ -537,7 +549,8 @@ class PlayCompleteSong(BaseState):
         @return: PracticeMode: the chosen practice mode
         """
         task = self.scheduler.current_task_data()
-        return self.statemachine.gaussian_process.get_best_practice_mode(error=error, bpm=task.parameters.bpm)
+        return self.statemachine.gp_trainer.get_best_practice_mode(self.statemachine.username,
+                                                                   error=error, bpm=task.parameters.bpm)
 
     def start_timing(self,var):
 
@@ -586,12 +599,7 @@ class PlayCompleteSong(BaseState):
         @param error_post: error after practice
         @return: utility value
         """
-        diff_timing = (error_pre["timing_left"] + error_pre["timing_right"]) - (
-                error_post["timing_left"] + error_post["timing_right"])
-        diff_pitch = (error_pre["pitch_left"] + error_pre["pitch_right"]) - (
-                error_post["pitch_left"] + error_post["pitch_right"])
-
-        return (diff_timing + diff_pitch) / 2
+        return error_diff_to_utility(error_pre, error_post)
 
     def start_playback(self):
         error = self.start_playback_and_calc_error(TaskParameters())
@@ -682,7 +690,8 @@ class PracticeModeState(BaseState):
             task.notes_left = []
             tk.Label(root, text=f"Practice Mode only Right Hand").place(x=1050, y=50, height=60, width=300)
 
-        midiProcessing.generateMidi(task, outFiles=OUTPUT_FILES_STRS)
+        global midi_artifacts
+        midi_artifacts = midiProcessing.generateMidi(task, outFiles=OUTPUT_FILES_STRS)
 
         self.gen_ly_for_current_task()
         subprocess.run(['lilypond', '--png', '-o', TEMP_DIR, OUTPUT_LY_STR],
@@ -747,8 +756,12 @@ class Statemachine:
 
     def __init__(self):
         self.scheduler = Scheduler()
-        self.gaussian_process = GaussianProcess()
         self.data_logger = DataLogger()
+        # one GP per user, with a GP of all users as prior
+        gp_pool = GPPool(self.data_logger.dataframe, population_path=DATA_DIR + GP_STATE_FILE,
+                         incremental=True)
+        # the GPs are fitted in the background, so the GUI doesn't freeze
+        self.gp_trainer = GPTrainer(gp_pool, save_path=DATA_DIR + GP_STATE_FILE)
         self.username = ""
         self.complexity_level = 0
         self.main_menu_state = MenuState(self.scheduler, self)
@@ -819,9 +832,8 @@ class Statemachine:
         else:
             self.data_logger.save_database()
 
-        # Save data point to gaussian process
-        self.gaussian_process.add_data_point(error[0], task_parameters.bpm, practice_mode, utility)
-        self.gaussian_process.update_model()
+        # Save data point to gaussian process (fitted in the background)
+        self.gp_trainer.add_data_point(self.username, error[0], task_parameters.bpm, practice_mode, utility)
 
 
 class DataLogger:
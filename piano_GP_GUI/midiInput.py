@@ -46,6 +46,8 @@ class MidiInputThread():
         self.noteInfoList = []
         self.noteInfoTemp = defaultdict(empty_noteinfo)
         self.midi_log_func = logger.debug
+        # error_calc.onlineScorer.OnlineScorer that gets every finished note (optional)
+        self.online_scorer = None
 
         # only handle input if true
         self.handleInput = False
@@ -148,6 +150,9 @@ class MidiInputThread():
                         logger.debug(f"ACTUAL: {self.noteCounter}\t {noteInfo}")
                         self.noteCounter += 1
 
+                        if self.online_scorer is not None:
+                            self.online_scorer.add_note(noteInfo)
+
 
     ###TODO: needed?
     def resetArrays(self):
@@ -1,12 +1,13 @@
 from midiutil.MidiFile import MIDIFile
-from music21 import converter
 
 import copy
+import io
 import os
-import mido
 import settings
 
 import pianoplayer_interface
+from fingering_cache import FingeringCache
+from midi_artifacts import MidiArtifact, MidiArtifacts
 from task_generation.note_range_per_hand import NoteRangePerHand  # ,get_pitchlist
 
 # some code taken from https://github.com/Michael-F-Ellis/tbon
@@ -14,21 +15,39 @@ from task_generation.note_range_per_hand import NoteRangePerHand  # ,get_pitchli
 # constants for MIDI moved to settings.py (to allow customization by machine)
 
 
+# finger numbers computed by PianoPlayer, shared by all tasks
+fingering_cache = FingeringCache()
+
 # time signature (ex. 4/4 = (4, 4))
 # TODO: USE AS INPUT?
 timeSig = (4, 4)
 
+def render_midi(mf):
+    """
+    Renders the MIDIUtil object to the bytes of a MIDI file.
+    The object is copied before to prevent modification due to its mutability.
+
+    @param mf: MIDIUtil object.
+    @return: MIDI file (bytes).
+    """
+    outf = io.BytesIO()
+    copy.deepcopy(mf).writeFile(outf)
+    return outf.getvalue()
+
+
 def write_midi(out_file, mf):
     """
     Writes the MIDIUtil object to a MIDI file.
-    The object is copied before to prevent modification due to its mutability.
 
-    @param out_file: Output MIDI file path.
+    @param out_file: Output MIDI file path, or a MidiArtifact to keep the file in memory.
     @param mf: MIDIUtil object.
     @return: None
     """
-    with open(out_file, 'wb') as outf:
-        copy.deepcopy(mf).writeFile(outf)
+    if isinstance(out_file, MidiArtifact):
+        out_file.put(render_midi(mf))
+    else:
+        with open(out_file, 'wb') as outf:
+            outf.write(render_midi(mf))
 
 
 def set_time_signature(numerator, denominator, m_track, mf):
@@ -126,10 +145,11 @@ def generateMidi(task, outFiles):
     @param bpm: Tempo (beats per minute).
     @param left: True for generating notes for the left hand.
     @param right: True for generating notes for the right hand.
-    @param outFiles: Output MIDI files.
-    @return: None
+    @param outFiles: Output MIDI files (paths they are spilled to, see MidiArtifacts).
+    @return: MidiArtifacts with the MIDI files in memory and the path of the written MusicXML file
     """
     ## from init here: tracknumber, tempo etc
+    artifacts = MidiArtifacts(outFiles)
 
     right = len(task.notes_right) > 0
     left  = len(task.notes_left)  > 0
@@ -150,6 +170,8 @@ def generateMidi(task, outFiles):
     count_notes_left = 0
     count_notes_right = 0
     lastPitch = [None, None]
+    # (start, pitch, duration) of the notes added per track, in the order they are added
+    track_notes = {settings.L_TRACK: list(), settings.R_TRACK: list()}
 
     for handTrack, notes in [(settings.L_TRACK, task.notes_left),
                              (settings.R_TRACK, task.notes_right)]:
@@ -171,9 +193,11 @@ def generateMidi(task, outFiles):
                        time=start,
                        duration=duration,
                        volume=settings.VOLUME)
+            track_notes[handTrack].append((start, pitch, duration))
             # notes are added to mf
 
     mf_without_trailing_notes = copy.deepcopy(mf)
+    trailing_notes = {settings.L_TRACK: list(), settings.R_TRACK: list()}
 
     # add 3 extra notes per hand for proper fingering numbers
     for t in range(3):
@@ -187,12 +211,13 @@ def generateMidi(task, outFiles):
                            time=tempTime,
                            duration=1,
                            volume=settings.VOLUME)
+                trailing_notes[lastPitch[hSide][0]].append((tempTime, lastPitch[hSide][1], 1))
 
     # write 1st MIDI file (piano only)
-    write_midi(outFiles[0], mf)
+    write_midi(artifacts.notes, mf)
 
     ### METRONOME ###
-    add_metronome(task.number_of_bars - 1, numerator, outFiles[1], True, mf_without_trailing_notes)
+    add_metronome(task.number_of_bars - 1, numerator, artifacts.metronome, True, mf_without_trailing_notes)
 
     ### FINGERNUMBERS ###
     print("generated notes right: " + str(count_notes_right) + " generated notes left: " + str(count_notes_left))
@@ -202,9 +227,11 @@ def generateMidi(task, outFiles):
         ## i didn't write this code but I assume it wants to make sure that 
         ## if a hand is playing it has at least 8 notes.
         
-        sf, measures, bpm = generate_fingers_and_write_xml(outFiles[0], outFiles[3], right, left)
-        write_midi(outFiles[0], mf_without_trailing_notes)
-        add_fingernumbers(outFiles[2], sf, False, right, left, mf_without_trailing_notes, False)
+        sf, measures, bpm = generate_fingers_and_write_xml(artifacts.notes.data, artifacts.xml_path, right, left)
+        write_midi(artifacts.notes, mf_without_trailing_notes)
+        add_fingernumbers(artifacts.dexmo, sf, False, right, left, mf_without_trailing_notes, False)
+        # artifacts.notes holds the notes without the trailing ones now
+        trailing_notes = {settings.L_TRACK: list(), settings.R_TRACK: list()}
     
     else:
         def c_to_g_map(note_range):
@@ -233,18 +260,64 @@ def generateMidi(task, outFiles):
         c_to_g_l = c_to_g_map(task.parameters.note_range_left)
         c_to_g_r = c_to_g_map(task.parameters.note_range_right)
         c_to_g = (c_to_g_l and c_to_g_r)
-        sf = converter.parse(outFiles[0])
-        add_fingernumbers(outFiles[2], sf, False, right, left, mf, c_to_g=c_to_g)
-        only_write_xml(outFiles[0], outFiles[3], right, left)
-
-    ### parse the exact times back from the midi file
-    ## extremly unintuitive, but the most straight forward way i fear.
-    temp_mido_file = mido.MidiFile(outFiles[0])
-    mid_left = _midi_messages_to_note_events(temp_mido_file.tracks[2], temp_mido_file)
-    mid_right = _midi_messages_to_note_events(temp_mido_file.tracks[1], temp_mido_file)
+        # parsed once for the Dexmo notes and the MusicXML file
+        session = pianoplayer_interface.ScoreSession(artifacts.notes.data)
+        add_fingernumbers(artifacts.dexmo, session.score, False, right, left, mf, c_to_g=c_to_g)
+        only_write_xml(session, artifacts.xml_path, right, left)
+
+    ### exact times of the notes in artifacts.notes, as they are quantised by MIDIUtil
+    mid_left = _note_events(track_notes[settings.L_TRACK] + trailing_notes[settings.L_TRACK],
+                            task.bpm, mf.ticks_per_quarternote)
+    mid_right = _note_events(track_notes[settings.R_TRACK] + trailing_notes[settings.R_TRACK],
+                             task.bpm, mf.ticks_per_quarternote)
+    if mid_left is None or mid_right is None:
+        ## MIDIUtil changed the notes, parse the exact times back from the midi file
+        temp_mido_file = artifacts.notes.mido_file()
+        mid_left = _midi_messages_to_note_events(temp_mido_file.tracks[2], temp_mido_file)
+        mid_right = _midi_messages_to_note_events(temp_mido_file.tracks[1], temp_mido_file)
 
     task.midi.register_midi_events(mid_left, mid_right)
 
+    return artifacts
+
+
+def _note_events(notes, bpm, ticks_per_quarternote):
+    """
+    Computes the note events of one track of a MIDIUtil object without writing
+    and parsing the MIDI file: the times are rounded to ticks like MIDIUtil does
+    and converted to seconds like mido does.
+
+    @param notes: (start, pitch, duration) of the notes in beats, in the order
+                  they were added to the MIDIUtil object.
+    @param bpm: Tempo (beats per minute).
+    @param ticks_per_quarternote: Resolution of the MIDIUtil object.
+    @return: List of NoteInfo like _midi_messages_to_note_events returns for
+             the written track (ordered by note_off), None if notes of the same
+             pitch overlap or are empty (MIDIUtil removes or shortens them).
+    """
+    from midiInput import NoteInfo
+
+    # MIDIUtil: int(quarters * ticks), the note off is start + duration in ticks
+    events = list()
+    for order, (start, pitch, duration) in enumerate(notes):
+        on_tick = int(start * ticks_per_quarternote)
+        off_tick = on_tick + int(duration * ticks_per_quarternote)
+        if off_tick <= on_tick:
+            return None
+        events.append((on_tick, off_tick, order, pitch))
+
+    last_off_tick = dict()
+    for on_tick, off_tick, _, pitch in sorted(events):
+        if on_tick < last_off_tick.get(pitch, -1):
+            return None
+        last_off_tick[pitch] = off_tick
+
+    # the tempo is stored in microseconds per beat
+    seconds_per_tick = int(60000000 / bpm) * 1e-6 / ticks_per_quarternote
+    # note offs are sorted by time, then by the order the notes were added
+    return [NoteInfo(pitch, settings.VOLUME, on_tick * seconds_per_tick, off_tick * seconds_per_tick)
+            for on_tick, off_tick, _, pitch in sorted(events, key=lambda event: (event[1], event[2]))]
+
  
 
                
@@ -281,7 +354,7 @@ def add_metronome(bars, numerator, outFile, writeFile, mf):
 
     @param bars: Total number of bars.
     @param numerator: Numerator of the time signature.
-    @param outFile: Output MIDI files.
+    @param outFile: Output MIDI file (path or MidiArtifact).
     @param writeFile: True for writing the MIDIUtil object to a MIDI file.
     @param mf: MIDIUtil object.
     @return: None
@@ -316,7 +389,7 @@ def generate_fingers_and_write_xml(midiFile, mxmlFile, right, left):
     Computes the optimal fingering numbers using PianoPlayer and stores them
     to a MusicXML file.
 
-    @param midiFile: Input MIDI file.
+    @param midiFile: Input MIDI file (path or MIDI bytes), or a ScoreSession.
     @param mxmlFile: Output MusicXML file.
     @param right: True for generating notes for the right hand.
     @param left: True for generating notes for the left hand.
@@ -329,7 +402,7 @@ def generate_fingers_and_write_xml(midiFile, mxmlFile, right, left):
     if len(pianoplayer.get_score().parts) <= 1 and right and left:
         raise Exception("both hands selected but only one beam in score!")
     pianoplayer.generate_fingernumbers(left and not right, right and not left, 0, lbeam,
-                                       pianoplayer.get_measure_number())
+                                       pianoplayer.get_measure_number(), cache=fingering_cache)
     pianoplayer.write_output(mxmlFile)
     return pianoplayer.get_score(), pianoplayer.get_measure_number(), pianoplayer.get_bpm()
 
@@ -337,11 +410,11 @@ def only_write_xml(midiFile, mxmlFile, right, left):
     """
     Creates an xml file without finger numbers for the case that there are less than 7 notes.
 
-    @param midiFile: Input MIDI file.
+    @param midiFile: Input MIDI file (path or MIDI bytes), or a ScoreSession.
     @param mxmlFile: Output MusicXML file.
     @param right: True for generating notes for the right hand.
     @param left: True for generating notes for the left hand.
-    @return: From PianoPlayer: score file, measure number, bpm
+    @return: None
     """
     pianoplayer = pianoplayer_interface.PianoplayerInterface(midiFile)
     lbeam = 1
@@ -350,7 +423,6 @@ def only_write_xml(midiFile, mxmlFile, right, left):
     if len(pianoplayer.get_score().parts) <= 1 and right and left:
         raise Exception("both hands selected but only one beam in score!")
     pianoplayer.write_output(mxmlFile)
-    return pianoplayer.get_score(), pianoplayer.get_measure_number(), pianoplayer.get_bpm()
 
 def extract_number_of_notes(sf):
     """
@@ -371,7 +443,7 @@ def add_fingernumbers(outFile, sf, with_note, right, left, mf, c_to_g):
     Adds fingering numbers to the respective tracks in a MIDIUtil object
     and writes that to a MIDI file.
 
-    @param outFile: Output MIDI file.
+    @param outFile: Output MIDI file (path or MidiArtifact).
     @param sf: PianoPlayer score file.
     @param with_note: True for writing the notes to the MIDI file.
     @param right: True if the right hand is active.
@@ -519,4 +591,4 @@ if __name__ == "__main__":
     if not os.path.exists(outDir):
         os.makedirs(outDir)
 
-     generate_metronome_and_fingers_for_midi(True, True, outFiles, 'test_input/TripletsAndQuarters.mid')
+    generate_metronome_and_fingers_for_midi(True, True, outFiles, 'test_input/TripletsAndQuarters.mid')
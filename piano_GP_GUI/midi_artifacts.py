@@ -0,0 +1,89 @@
+import io
+import os
+
+import mido
+
+
+class MidiArtifact:
+    """
+    One MIDI file generated for a task, kept in memory: the rendered bytes and,
+    when requested, the parsed mido.MidiFile. The file is only written to its
+    path when a tool needs it on disk (see spill).
+    """
+
+    def __init__(self, path):
+        """
+        @param path: Path the MIDI file is written to when it is spilled.
+        """
+        self.path = path
+        self.data = None
+        self._mido_file = None
+        self._spilled = False
+
+    def put(self, data):
+        """
+        Replaces the MIDI file.
+
+        @param data: Rendered MIDI file (bytes).
+        @return: None
+        """
+        self.data = data
+        self._mido_file = None
+        self._spilled = False
+
+    def mido_file(self):
+        """
+        @return: The MIDI file parsed by mido (parsed once, at the first call).
+        """
+        if self._mido_file is None:
+            self._mido_file = mido.MidiFile(file=io.BytesIO(self.data))
+        return self._mido_file
+
+    def spill(self):
+        """
+        Writes the MIDI file to its path, if it wasn't written since the last put.
+
+        @return: Path of the MIDI file.
+        """
+        if not self._spilled:
+            self.save_as(self.path)
+            self._spilled = True
+        return self.path
+
+    def save_as(self, path):
+        """
+        Writes the MIDI file to the given path (e.g. for archiving).
+
+        @param path: Output MIDI file path.
+        @return: None
+        """
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, 'wb') as outf:
+            outf.write(self.data)
+
+
+class MidiArtifacts:
+    """
+    Outputs of midiProcessing.generateMidi: the MIDI files (notes only, with
+    metronome, with metronome and Dexmo guidance) in memory and the MusicXML
+    file, which is written to disk directly.
+    """
+
+    def __init__(self, outFiles):
+        """
+        @param outFiles: Paths of the output files, in the order notes, metronome,
+                         Dexmo guidance (MIDI) and MusicXML.
+        """
+        self.notes = MidiArtifact(outFiles[0])
+        self.metronome = MidiArtifact(outFiles[1])
+        self.dexmo = MidiArtifact(outFiles[2])
+        self.xml_path = outFiles[3]
+
+    def spill(self):
+        """
+        Writes all MIDI files to their paths.
+
+        @return: None
+        """
+        for artifact in [self.notes, self.metronome, self.dexmo]:
+            artifact.spill()
@@ -2,6 +2,42 @@ from music21 import converter, stream
 from pianoplayer.hand import Hand
 from pianoplayer.scorereader import reader, PIG2Stream
 
+from fingering_cache import fingering_key, apply_fingers
+
+
+class ScoreSession:
+    """
+    A MIDI file parsed once by music21. The score is shared by all steps that
+    need it (fingering, measure number, bpm, MusicXML output), the measure number
+    and the bpm are only computed when they are asked for.
+    Generating the fingering adds it to the shared score, copy the score before
+    if the original one is still needed.
+    """
+
+    def __init__(self, midi_file):
+        """
+        @param midi_file: MIDI file to be parsed (path or MIDI bytes).
+        """
+        if isinstance(midi_file, bytes):
+            self.score = converter.parseData(midi_file, format='midi')
+        else:
+            self.score = converter.parse(midi_file)
+        self._bpm = None
+        self._measures = None
+
+    @property
+    def bpm(self):
+        if self._bpm is None:
+            self._bpm = self.score.parts[0].metronomeMarkBoundaries()[0][2].getQuarterBPM()
+        return self._bpm
+
+    @property
+    def measures(self):
+        # makeMeasures copies the part, so it is done once
+        if self._measures is None:
+            self._measures = len(self.score.parts[0].makeMeasures().elements)
+        return self._measures
+
 
 class PianoplayerInterface:
     """
@@ -13,14 +49,17 @@ class PianoplayerInterface:
         """
         Initializes necessary variables.
 
-        @param filename: MIDI file to be opened.
+        @param filename: MIDI file to be opened (path or MIDI bytes), or a ScoreSession
+                         whose score is used.
         """
-        self.sf = converter.parse(filename)
-        self.bpm = self.sf.parts[0].metronomeMarkBoundaries()[0][2].getQuarterBPM()
-        tmp = self.sf.parts[0].makeMeasures()
-        self.measures = len(tmp.elements)
-
-    def generate_fingernumbers(self, left_only, right_only, rbeam, lbeam, n_measures, depth=0, hand_size='M'):
+        if isinstance(filename, ScoreSession):
+            self.session = filename
+        else:
+            self.session = ScoreSession(filename)
+        self.sf = self.session.score
+
+    def generate_fingernumbers(self, left_only, right_only, rbeam, lbeam, n_measures, depth=0, hand_size='M',
+                               cache=None):
         """
         Automatically generates fingering numbers using the PianoPlayer library.
 
@@ -31,36 +70,46 @@ class PianoplayerInterface:
         @param n_measures: Number of score measures (bars) to scan.
         @param depth: Depth of combinatorial search, [4-9] (default: autodepth) - optional.
         @param hand_size: Hand size (default: M) - optional.
+        @param cache: FingeringCache for the finger numbers of each hand - optional.
         @return: None
         """
 
         if not left_only:
-            rh = Hand("right", hand_size)
-            rh.verbose = False
-            if depth == 0:
-                rh.autodepth = True
-            else:
-                rh.autodepth = False
-                rh.depth = depth
-            rh.lyrics = False
-            rh.handstretch = False
-
-            rh.noteseq = reader(self.sf, beam=rbeam)
-            rh.generate(1, n_measures)
+            self._generate_hand_fingernumbers("right", rbeam, n_measures, depth, hand_size, cache)
 
         if not right_only:
-            lh = Hand("left", hand_size)
-            lh.verbose = False
-            if depth == 0:
-                lh.autodepth = True
-            else:
-                lh.autodepth = False
-                lh.depth = depth
-            lh.lyrics = False
-            lh.handstretch = False
-
-            lh.noteseq = reader(self.sf, beam=lbeam)
-            lh.generate(1, n_measures)
+            self._generate_hand_fingernumbers("left", lbeam, n_measures, depth, hand_size, cache)
+
+    def _generate_hand_fingernumbers(self, side, beam, n_measures, depth, hand_size, cache):
+        """
+        Generates the fingering numbers of one hand (see generate_fingernumbers),
+        or takes them from the cache.
+        """
+        noteseq = reader(self.sf, beam=beam)
+
+        if cache is not None:
+            key = fingering_key(noteseq, side, hand_size, depth, 1, n_measures)
+            fingers = cache.get(key)
+            if fingers is not None:
+                print("fingering cache: hit for the " + side + " hand")
+                apply_fingers(noteseq, fingers)
+                return
+
+        hand = Hand(side, hand_size)
+        hand.verbose = False
+        if depth == 0:
+            hand.autodepth = True
+        else:
+            hand.autodepth = False
+            hand.depth = depth
+        hand.lyrics = False
+        hand.handstretch = False
+
+        hand.noteseq = noteseq
+        hand.generate(1, n_measures)
+
+        if cache is not None:
+            cache.put(key, [an.fingering for an in noteseq])
 
     def get_score(self):
         """
@@ -76,7 +125,7 @@ class PianoplayerInterface:
 
         @return: Tempo (beats per minute).
         """
-        return self.bpm
+        return self.session.bpm
 
     def get_measure_number(self):
         """
@@ -84,7 +133,7 @@ class PianoplayerInterface:
 
         @return: PianoPlayer's measure (bar) number.
         """
-        return self.measures
+        return self.session.measures
 
     def write_output(self, outputfile):
         """
@@ -0,0 +1,81 @@
+"""
+Compares the exact GP with the sparse GP (see GaussianProcess) for growing
+data sizes: time of update_model and the accuracy of the predicted utility on
+held-out inputs.
+
+There isn't enough recorded data for large sizes (the subject*.h5 files hold
+about 120 data points), so the data points are simulated: uniformly drawn
+inputs and a smooth utility per practice mode plus gaussian noise. The accuracy
+is measured against the noiseless utility.
+
+usage: python3 -m task_generation.benchmark_gp [n_data ...]
+"""
+
+import sys
+import time
+
+import numpy as np
+
+from task_generation.gaussian_process import GaussianProcess, PracticeMode, ERROR_KEYS, BPM_BOUNDS
+
+SIZES = [125, 500, 1000, 2000]
+N_TEST = 500
+NOISE = 0.02
+PRACTICE_MODES = [PracticeMode.IMP_PITCH, PracticeMode.IMP_TIMING]
+
+
+def true_utility(errors, bpms, practice_modes):
+    """
+    Utility used for the simulation: practicing pitch (timing) improves the
+    pitch (timing) error by a fraction that decreases with the bpm.
+    """
+    pitch = errors["pitch_left"] + errors["pitch_right"]
+    timing = errors["timing_left"] + errors["timing_right"]
+    speed = 1 - (bpms - BPM_BOUNDS[0]) / (BPM_BOUNDS[1] - BPM_BOUNDS[0])
+    is_pitch = np.array([pm == PracticeMode.IMP_PITCH for pm in practice_modes])
+
+    return np.where(is_pitch, 0.4 * pitch, 0.3 * timing) * (0.5 + 0.5 * speed)
+
+
+def random_inputs(n, rng):
+    errors = {key: rng.uniform(0, 0.5, n) for key in ERROR_KEYS}
+    bpms = rng.uniform(*BPM_BOUNDS, n)
+    practice_modes = [PRACTICE_MODES[i] for i in rng.integers(len(PRACTICE_MODES), size=n)]
+    return errors, bpms, practice_modes
+
+
+def measure(gp, n_data, seed=0):
+    """
+    @return: fit time (s), RMSE of the mean, mean negative log predictive density
+    """
+    rng = np.random.default_rng(seed)
+    errors, bpms, practice_modes = random_inputs(n_data, rng)
+    utilities = true_utility(errors, bpms, practice_modes) + rng.normal(0, NOISE, n_data)
+    gp.observations.extend(gp._params2domain_batch(errors, bpms, practice_modes), utilities)
+
+    start = time.time()
+    gp.update_model()
+    fit_time = time.time() - start
+
+    errors, bpms, practice_modes = random_inputs(N_TEST, rng)
+    utilities = true_utility(errors, bpms, practice_modes)
+    means, variances = gp.predict_batch(errors, bpms, practice_modes)
+    rmse = np.sqrt(np.mean((means - utilities) ** 2))
+    nlpd = np.mean(0.5 * np.log(2 * np.pi * variances) + (means - utilities) ** 2 / (2 * variances))
+
+    return fit_time, rmse, nlpd
+
+
+if __name__ == "__main__":
+    sizes = [int(arg) for arg in sys.argv[1:]] or SIZES
+    backends = dict(exact=lambda: GaussianProcess(),
+                    sparse=lambda: GaussianProcess(sparse=True))
+
+    results = list()
+    for n_data in sizes:
+        for name, backend in backends.items():
+            results.append((n_data, name) + measure(backend(), n_data))
+
+    print("{:>7} {:>7} {:>12} {:>8} {:>8}".format("n_data", "backend", "fit time (s)", "RMSE", "NLPD"))
+    for n_data, name, fit_time, rmse, nlpd in results:
+        print("{:>7} {:>7} {:>12.2f} {:>8.4f} {:>8.2f}".format(n_data, name, fit_time, rmse, nlpd))
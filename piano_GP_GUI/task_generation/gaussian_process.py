@@ -1,11 +1,21 @@
+import copy
 import enum
+import hashlib
+import os
 import random
+import time
+from collections import namedtuple
+
 import numpy as np
 
 import GPy
 import GPyOpt
 from GPyOpt.methods import BayesianOptimization
 
+from task_generation.gp_posterior import IncrementalPosterior
+from task_generation.observation_buffer import ObservationBuffer
+from task_generation.policy_table import PolicyGrid, PolicyTable
+
 
 class PracticeMode(enum.Enum):
     """
@@ -20,16 +30,128 @@ class PracticeMode(enum.Enum):
 # interval of possible bpm_values
 BPM_BOUNDS = [50, 200]
 
+# keys of the error values (in the order of the domain)
+ERROR_KEYS = ["pitch_left", "pitch_right", "timing_left", "timing_right"]
+
+# in incremental mode, the hyperparameters are optimised again after this many new data points
+REOPTIMIZE_EVERY = 10
+
+# initial kernel hyperparameters of a cold (not warm-started) fit
+INITIAL_HYPERPARAMETERS = dict(variance=0.01, lengthscale=1)
+# iteration budget and gradient tolerance of a warm-started fit
+WARM_START_MAX_ITERS = 200
+WARM_START_TOLERANCE = 1e-5
+# every n-th fit is a cold fit anyway, so warm starts can't get stuck in a poor local optimum
+COLD_START_EVERY = 5
+# number of inducing points of the sparse GP
+NUM_INDUCING = 50
+
+# grid of the policy table (see GaussianProcess, policy_grid)
+DEFAULT_POLICY_GRID = PolicyGrid(bpms=np.linspace(BPM_BOUNDS[0], BPM_BOUNDS[1], 7),
+                                 errors={key: np.linspace(0, 1, 6) for key in ERROR_KEYS})
+
+# function_evaluations: evaluations of the likelihood by L-BFGS-B (paramz does not keep the
+# number of iterations)
+FitReport = namedtuple("FitReport", ["n_data", "warm_start", "function_evaluations", "wall_time",
+                                     "status", "log_likelihood"])
+
+
+def error_diff_to_utility(error_pre, error_post):
+    """
+    Calculates the utility given two error measurements.
+    Works elementwise if the error values are arrays (e.g. DataFrame columns).
+    @param error_pre: error before practice
+    @param error_post: error after practice
+    @return: utility value
+    """
+    diff_timing = (error_pre["timing_left"] + error_pre["timing_right"]) - (
+            error_post["timing_left"] + error_post["timing_right"])
+    diff_pitch = (error_pre["pitch_left"] + error_pre["pitch_right"]) - (
+            error_post["pitch_left"] + error_post["pitch_right"])
+
+    return (diff_timing + diff_pitch) / 2
+
+
+def _data_frame_errors(df, when):
+    """
+    @param df: DataFrame with the columns of the DataLogger
+    @param when: "before" / "after"
+    @return: dict with the error values (arrays) of the DataFrame, keys as in ERROR_KEYS
+    """
+    errors = dict()
+    for key in ERROR_KEYS:
+        kind, hand = key.split("_")
+        errors[key] = df[f"error_{when}_{hand}_{kind}"].to_numpy(dtype=float)
+    return errors
+
 
 class GaussianProcess:
-    def __init__(self, bpm_norm_fac=100):
-        self.data_X = None
+    def __init__(self, bpm_norm_fac=100, incremental=False, reoptimize_every=REOPTIMIZE_EVERY,
+                 warm_start=True, warm_start_max_iters=WARM_START_MAX_ITERS,
+                 warm_start_tolerance=WARM_START_TOLERANCE, cold_start_every=COLD_START_EVERY,
+                 sparse=False, num_inducing=NUM_INDUCING, policy_grid=None, prior=None):
+        """
+        @param incremental: if True, update_model only adds the new data points to
+                            the posterior (rank-one updates of its Cholesky factor)
+                            and keeps the hyperparameters fixed, except for every
+                            reoptimize_every-th data point, where the model is fitted
+                            completely again.
+        @param reoptimize_every: number of new data points between two
+                                 hyperparameter optimisations (incremental mode).
+        @param warm_start: start the hyperparameter optimisation from the last fitted
+                           hyperparameters (one L-BFGS-B run) instead of from
+                           INITIAL_HYPERPARAMETERS (with random restarts).
+        @param warm_start_max_iters: iteration budget of a warm-started optimisation.
+        @param warm_start_tolerance: gradient tolerance at which a warm-started
+                                     optimisation stops early.
+        @param cold_start_every: every n-th fit is cold even if warm_start is set
+                                 (None: only the first one).
+        @param sparse: use a sparse GP (GPy's SparseGPRegression) with num_inducing
+                       inducing points instead of the exact GP. Fitting and predicting
+                       then scale linearly with the number of data points, which is
+                       needed for large pooled datasets (see benchmark_gp).
+                       Can't be combined with incremental.
+        @param num_inducing: number of inducing points of the sparse GP.
+        @param policy_grid: if given (a PolicyGrid, e.g. DEFAULT_POLICY_GRID), every
+                            new model precomputes a PolicyTable over this grid, which
+                            get_best_practice_mode uses for the points on the grid.
+        @param prior: fitted GaussianProcess (with the same domain, e.g. a model of
+                      the other users, see GPPool) whose estimate is used as prior mean.
+                      This GP only models the difference to it, and predicts
+                      the prior's estimate as long as it has no data.
+                      Models with a prior can't be saved.
+        """
+        if sparse and incremental:
+            raise ValueError("incremental updates are only supported by the exact GP")
         self.data_X_old_shape = None
 
-        self.data_Y = None
-
         self.bpm_norm_fac = bpm_norm_fac
 
+        self.incremental = incremental
+        self.reoptimize_every = reoptimize_every
+        # posterior with fixed hyperparameters (incremental mode only)
+        self.posterior = None
+        # number of data points at the last hyperparameter optimisation
+        self.n_data_optimized = 0
+
+        self.warm_start = warm_start
+        self.warm_start_max_iters = warm_start_max_iters
+        self.warm_start_tolerance = warm_start_tolerance
+        self.cold_start_every = cold_start_every
+
+        self.sparse = sparse
+        self.num_inducing = num_inducing
+
+        self.policy_grid = policy_grid
+        # PolicyTable of the current model (if policy_grid is given)
+        self.policy_table = None
+
+        self.prior = prior
+        # kernel and noise variance of the last fit, None before the first fit
+        self.hyperparameters = None
+        # FitReport of every hyperparameter optimisation
+        self.fit_reports = list()
+
         self.domain = [
             {'name': 'practice_mode', 'type': 'categorical', 'domain': (0, 1, 2, 3)},
             {'name': 'bpm', 'type': 'continuous', 'domain':
@@ -42,6 +164,23 @@ class GaussianProcess:
 
         self.space = GPyOpt.core.task.space.Design_space(self.domain)
 
+        # training data, in the domain (not one-hot encoded)
+        self.observations = ObservationBuffer(n_columns=len(self.domain))
+
+    @property
+    def data_X(self):
+        """
+        training inputs (view, no copy), None if there is no data yet
+        """
+        return self.observations.X if len(self.observations) else None
+
+    @property
+    def data_Y(self):
+        """
+        training outputs (view, no copy), None if there is no data yet
+        """
+        return self.observations.Y if len(self.observations) else None
+
     def _norm_bpm(self, v: float) -> float:
         return v / self.bpm_norm_fac
 
@@ -57,12 +196,69 @@ class GaussianProcess:
 
         return np.array([domain_x])
 
+    def _params2domain_batch(self, errors, bpms, practice_modes):
+        """
+        Same as _params2domain for many rows at once. The arguments are
+        broadcast against each other.
+
+        @param errors: error values, either one dict(-like, e.g. a DataFrame) with
+                       scalars or arrays as values, or a list of dicts.
+        @param bpms: bpm or array of bpms
+        @param practice_modes: PracticeMode or list of PracticeModes
+        """
+        if not hasattr(errors, "keys"):
+            errors = {key: [error[key] for error in errors] for key in ERROR_KEYS}
+        if isinstance(practice_modes, PracticeMode):
+            practice_modes = [practice_modes]
+        mode_values = np.array([practice_mode.value for practice_mode in practice_modes])
+
+        columns = np.broadcast_arrays(mode_values,
+                                      self._norm_bpm(np.asarray(bpms, dtype=float)),
+                                      *[np.asarray(errors[key], dtype=float) for key in ERROR_KEYS])
+        return np.column_stack([column.reshape(-1) for column in columns])
+
     def _domain2space(self, domain_x):
         # Converts the domain variables into the GPs input space
         # does one-hot encoding
         space_rep = self.space.unzip_inputs(domain_x)
         return space_rep
 
+    def snapshot(self):
+        """
+        Copy of the current model for predictions, which isn't affected by later
+        add_data_point / update_model calls on this GP (e.g. by a training thread).
+        Shallow copies are enough: update_model creates a new bayes_opt, the
+        posterior replaces its arrays on add instead of changing them, and the
+        observation buffer never changes rows that were added already.
+        @return: GaussianProcess
+        """
+        snapshot = copy.copy(self)
+        snapshot.observations = copy.copy(self.observations)
+        snapshot.posterior = copy.copy(self.posterior)
+        snapshot.fit_reports = list(self.fit_reports)
+        return snapshot
+
+    def _has_model(self):
+        return hasattr(self, "bayes_opt") or self.posterior is not None or \
+            (self.prior is not None and self.prior._has_model())
+
+    def _prior_mean(self, x):
+        """
+        @param x: inputs in the GP's input space (see _domain2space)
+        @return: estimate of the prior (0 without prior)
+        """
+        if self.prior is None or not self.prior._has_model():
+            return np.zeros((len(x), 1))
+        return self.prior._predict(x)[0]
+
+    def _targets(self, start=0):
+        """
+        @return: training outputs from the start-th data point on, minus the prior mean
+        """
+        if self.prior is None:
+            return self.data_Y[start:]
+        return self.data_Y[start:] - self._prior_mean(self._domain2space(self.data_X[start:]))
+
     def _get_bayes_opt(self) -> BayesianOptimization:
         return self.bayes_opt
 
@@ -75,21 +271,114 @@ class GaussianProcess:
 
         self.data_X_old_shape = self.data_X.shape
 
+        if self.incremental and self.posterior is not None and \
+                len(self.data_X) - self.n_data_optimized < self.reoptimize_every:
+            self._extend_posterior()
+            self._on_new_model()
+            return
+
+        warm_start = self.warm_start and self.hyperparameters is not None
+        if self.cold_start_every and len(self.fit_reports) % self.cold_start_every == 0:
+            warm_start = False
+        initial = self.hyperparameters if warm_start else INITIAL_HYPERPARAMETERS
+
         kernel = GPy.kern.RBF(input_dim=self.space.model_dimensionality,
-                              variance=0.01,
-                              lengthscale=1)
+                              variance=initial["variance"],
+                              lengthscale=initial["lengthscale"])
 
         self.bayes_opt = GPyOpt.methods.BayesianOptimization(
-            f=None, domain=self.domain, X=self.data_X, Y=self.data_Y,
+            f=None, domain=self.domain, X=self.data_X, Y=self._targets(),
             maximize=True, normalize_Y=False,
             kernel=kernel,
+            model_type="sparseGP" if self.sparse else "GP",
+            num_inducing=self.num_inducing,
         )
 
         self.bayes_opt.model.max_iters = 0
         self.bayes_opt._update_model()
 
-        self.bayes_opt.model.max_iters = 1000
-        self.bayes_opt._update_model()
+        self._optimize_hyperparameters(warm_start)
+
+        self.n_data_optimized = len(self.data_X)
+        if self.incremental:
+            model = self.bayes_opt.model.model
+            self.posterior = IncrementalPosterior(model.kern, model.likelihood.variance,
+                                                  self._domain2space(self.data_X), self._targets())
+        else:
+            # a posterior restored by load is outdated now
+            self.posterior = None
+
+        self._on_new_model()
+
+    def _on_new_model(self):
+        """
+        Replaces the policy table (if there is one) by one of the new model.
+        """
+        if self.policy_grid is None:
+            return
+
+        old_table, self.policy_table = self.policy_table, None
+        self.policy_table = PolicyTable(self, self._compared_practice_modes(), self.policy_grid)
+        print(f"Policy table: rebuilt {len(self.policy_table)} entries "
+              f"in {self.policy_table.build_time:.3f}s"
+              + (f", hit rate of the last table: {old_table.hit_rate():.2f} "
+                 f"({old_table.hits} of {old_table.hits + old_table.misses})"
+                 if old_table is not None else ""))
+
+    def _optimize_hyperparameters(self, warm_start):
+        """
+        Fits the hyperparameters of the model (created by update_model) and
+        adds a FitReport to self.fit_reports.
+        """
+        model = self.bayes_opt.model.model
+        start = time.time()
+
+        if warm_start:
+            model.likelihood.variance[:] = self.hyperparameters["noise_variance"]
+            runs = [model.optimize(optimizer="lbfgsb", max_iters=self.warm_start_max_iters,
+                                   gtol=self.warm_start_tolerance,
+                                   messages=False, ipython_notebook=False)]
+        else:
+            self.bayes_opt.model.max_iters = 1000
+            self.bayes_opt._update_model()
+            runs = model.optimization_runs
+
+        report = FitReport(n_data=len(self.data_X),
+                           warm_start=warm_start,
+                           function_evaluations=sum(run.funct_eval for run in runs),
+                           wall_time=time.time() - start,
+                           status=", ".join(sorted(set(str(run.status) for run in runs))),
+                           log_likelihood=np.asarray(model.log_likelihood()).item())
+        self.fit_reports.append(report)
+        print("GP fit:", report)
+
+        self.hyperparameters = dict(variance=float(model.kern.variance[0]),
+                                    lengthscale=float(model.kern.lengthscale[0]),
+                                    noise_variance=float(model.likelihood.variance[0]))
+
+    def _extend_posterior(self):
+        """
+        Adds the data points that are not in the posterior yet (incremental mode).
+        """
+        new_X = self._domain2space(self.data_X[len(self.posterior):])
+        for x, y in zip(new_X, self._targets(len(self.posterior))[:, 0]):
+            self.posterior.add(x, y)
+
+    def _predict(self, x):
+        """
+        @param x: inputs in the GP's input space (see _domain2space)
+        @return: mean, variance
+        """
+        if self.posterior is not None:
+            mean, var = self.posterior.predict(x)
+        elif hasattr(self, "bayes_opt"):
+            mean, std = self._get_bayes_opt().model.predict(x)
+            var = std ** 2
+        else:
+            # no data yet, but a prior
+            return self.prior._predict(x)
+
+        return mean + self._prior_mean(x), var
 
     def get_estimate(self, error, bpm, practice_mode: PracticeMode) -> float:
         """
@@ -99,19 +388,51 @@ class GaussianProcess:
         @param practice_mode: the practice mode for which the utility value should be estimated
         @return: gaussian process' estimate of the utility value
         """
-        if not hasattr(self, "bayes_opt"):
+        if not self._has_model():
             # if there is no model yet, e.g. in the first iteration return random utility
             return random.random()
 
-        bayes_opt = self._get_bayes_opt()
-
         x = self._params2domain(error, bpm, practice_mode)
         x = self._domain2space(x)
 
-        mean, var = bayes_opt.model.predict(x)
+        mean, var = self._predict(x)
 
         return mean[0]
 
+    def predict_batch(self, errors, bpms, practice_modes):
+        """
+        Estimates the utility values for many inputs with one prediction of the
+        model. The arguments are broadcast against each other, e.g. one error
+        and bpm with a list of practice modes, or arrays of errors and one practice mode.
+
+        @param errors: error values, one dict(-like) with scalars or arrays as
+                       values, or a list of dicts
+        @param bpms: bpm or array of bpms
+        @param practice_modes: PracticeMode or list of PracticeModes
+        @return: means, variances (1d arrays), random means and nan variances
+                 if there is no model yet
+        """
+        x = self._params2domain_batch(errors, bpms, practice_modes)
+
+        if not self._has_model():
+            # if there is no model yet, e.g. in the first iteration return random utility
+            return np.random.random(len(x)), np.full(len(x), np.nan)
+
+        mean, var = self._predict(self._domain2space(x))
+        return mean[:, 0], var[:, 0]
+
+    @staticmethod
+    def _compared_practice_modes():
+        """
+        @return: the practice modes get_best_practice_mode chooses from
+        """
+        left = False
+        right = True
+        if left and right:
+            return list(PracticeMode)
+        else:
+            return [PracticeMode.IMP_PITCH, PracticeMode.IMP_TIMING]
+
     def get_best_practice_mode(self, error, bpm, epsilon=0):
         """
         computes the gaussian process' estimate of the best practice mode
@@ -121,16 +442,16 @@ class GaussianProcess:
         @param (optional) epsilon: the probability of making a random decision. set to 0 for no exploration.
         @return: chosen for given input parameters PracticeMode
         """
-        left = False
-        right = True
-        if left and right:
-            all_practice_modes = list(PracticeMode)
-        else:
-            all_practice_modes = [PracticeMode.IMP_PITCH, PracticeMode.IMP_TIMING]
+        all_practice_modes = self._compared_practice_modes()
         # epsilon-greedy
         if random.random() > epsilon:
-            max_i = np.argmax([self.get_estimate(error, bpm, pm)
-                               for pm in all_practice_modes])
+            if self.policy_table is not None:
+                practice_mode = self.policy_table.lookup(error, bpm)
+                if practice_mode is not None:
+                    return practice_mode
+
+            means, _ = self.predict_batch(error, bpm, all_practice_modes)
+            max_i = np.argmax(means)
             return all_practice_modes[max_i]
         else:
             return np.random.choice(all_practice_modes)
@@ -147,11 +468,133 @@ class GaussianProcess:
         """
 
         new_x = self._params2domain(error, bpm, practice_mode)
-        new_y = [utility_measurement]
+        self.observations.append(new_x[0], utility_measurement)
 
-        if self.data_X is None:
-            self.data_X = new_x
-            self.data_Y = np.array([new_y])
+    def add_data_frame(self, df):
+        """
+        Adds all data points of a DataFrame with the columns of the DataLogger
+        (e.g. data.h5 or the subject*.h5 files) at once. Rows without an error
+        before practice are skipped.
+        Does not update the Gaussian Process for the new training data (see: update_model)
+        @param df: DataFrame
+        @return: number of added data points
+        """
+        errors_pre = _data_frame_errors(df, "before")
+        errors_post = _data_frame_errors(df, "after")
+        utilities = error_diff_to_utility(errors_pre, errors_post)
+
+        valid = ~np.isnan(utilities)
+        practice_modes = [PracticeMode[name] for name in df["practice_mode"][valid]]
+        x = self._params2domain_batch({key: errors_pre[key][valid] for key in ERROR_KEYS},
+                                      df["bpm"].to_numpy(dtype=float)[valid], practice_modes)
+
+        self.observations.extend(x, utilities[valid])
+        return len(x)
+
+    def data_hash(self, n=None):
+        """
+        @param n: only hash the first n data points
+        @return: hex digest of the training data
+        """
+        n = len(self.observations) if n is None else n
+        data_hash = hashlib.sha256(np.ascontiguousarray(self.observations.X[:n]).tobytes())
+        data_hash.update(np.ascontiguousarray(self.observations.Y[:n]).tobytes())
+        return data_hash.hexdigest()
+
+    def save(self, path):
+        """
+        Saves the fitted model (training data, kernel hyperparameters and the
+        Cholesky factor of the kernel matrix) to a .npz file, see load.
+        Only supported by the exact GP.
+        @param path: file path
+        """
+        if self.sparse or self.prior is not None:
+            raise ValueError("only the exact GP without prior can be saved")
+        if self.hyperparameters is None:
+            raise ValueError("the model wasn't fitted yet")
+
+        if self.posterior is not None and len(self.posterior) == len(self.observations):
+            L = self.posterior.L
         else:
-            self.data_X = np.vstack((self.data_X, new_x[0]))
-            self.data_Y = np.vstack((self.data_Y, new_y[0]))
+            L = self._get_bayes_opt().model.model.posterior.woodbury_chol
+
+        np.savez(path, X=self.data_X, Y=self.data_Y, L=L,
+                 variance=self.hyperparameters["variance"],
+                 lengthscale=self.hyperparameters["lengthscale"],
+                 noise_variance=self.hyperparameters["noise_variance"],
+                 n_data_optimized=self.n_data_optimized,
+                 bpm_norm_fac=self.bpm_norm_fac,
+                 data_hash=self.data_hash())
+
+    def load(self, path):
+        """
+        Restores a model saved with save, without fitting it again, if its
+        training data are the first data points of this GP. Further data points
+        are added with the next update_model.
+        @param path: file path
+        @return: True if the model was restored, False if the data doesn't match
+        """
+        saved = np.load(path)
+        n = len(saved["Y"])
+        if self.sparse or self.prior is not None or n > len(self.observations) or saved["bpm_norm_fac"] != self.bpm_norm_fac \
+                or str(saved["data_hash"]) != self.data_hash(n):
+            return False
+
+        self._set_posterior(dict(variance=float(saved["variance"]),
+                                 lengthscale=float(saved["lengthscale"]),
+                                 noise_variance=float(saved["noise_variance"])),
+                            saved["X"], saved["Y"], L=saved["L"])
+        self.n_data_optimized = int(saved["n_data_optimized"])
+        self.data_X_old_shape = (n, len(self.domain))
+        self._on_new_model()
+        return True
+
+    def _set_posterior(self, hyperparameters, X, Y, L=None):
+        """
+        Replaces the model by the exact posterior with the given hyperparameters.
+        @param X: training inputs in the domain
+        """
+        self.hyperparameters = dict(hyperparameters)
+        kernel = GPy.kern.RBF(input_dim=self.space.model_dimensionality,
+                              variance=self.hyperparameters["variance"],
+                              lengthscale=self.hyperparameters["lengthscale"])
+        self.posterior = IncrementalPosterior(kernel, self.hyperparameters["noise_variance"],
+                                              self._domain2space(X), Y, L=L)
+
+    def condition(self, hyperparameters):
+        """
+        "Trains" the GP on its data with fixed hyperparameters (e.g. those of a
+        model fitted on similar data) instead of optimising them. Much faster
+        than update_model and deterministic.
+        @param hyperparameters: dict with variance, lengthscale and noise_variance
+        """
+        if self.data_X is None:
+            return
+
+        self._set_posterior(hyperparameters, self.data_X, self._targets())
+        self.n_data_optimized = len(self.data_X)
+        self.data_X_old_shape = self.data_X.shape
+        self._on_new_model()
+
+    def restore(self, df, path):
+        """
+        Adds the data of a DataLogger DataFrame (see add_data_frame) and restores
+        the model saved at path if it was fitted on (the first rows of) this data,
+        so the model is ready without fitting it again. The model is only fitted
+        (and saved again) if there is new data.
+        @param df: DataFrame
+        @param path: .npz file path
+        """
+        start = time.time()
+        self.add_data_frame(df)
+        if len(self.observations) == 0:
+            return
+
+        restored = os.path.isfile(path) and self.load(path)
+        n_restored = self.data_X_old_shape[0] if restored else 0
+
+        self.update_model()
+        if len(self.observations) > n_restored and not self.sparse and self.prior is None:
+            self.save(path)
+        print(f"GP restore: {len(self.observations)} data points, "
+              f"{n_restored} restored in {time.time() - start:.3f}s")
@@ -1,6 +1,8 @@
 import GPy
 import GPyOpt
+import io
 import random
+import contextlib
 import numpy as np
 from tqdm import tqdm
 
@@ -14,10 +16,14 @@ from collections import namedtuple
 from generator import generate_task
 from generator import TaskParameters
 from note_range_per_hand import NoteRangePerHand
+from observation_buffer import ObservationBuffer
 
 # list of possible performer types
 performers = ["bad_pitch", "balanced", "bad_timing"]
 
+# number of pieces the batched simulator draws from
+PIECE_BANK_SIZE = 50
+
 
 class PracticeMode(enum.Enum):
     """
@@ -33,14 +39,29 @@ BPM_BOUNDS = [50, 200]
 
 Error = namedtuple("Error", "pitch timing")
 
+# kernels the GaussianProcess can use
+KERNELS = {
+    "RBF": GPy.kern.RBF,
+    "Matern52": GPy.kern.Matern52,
+}
+
+# when gp_sim / train_gp update the model: iteration -> bool
+UPDATE_SCHEDULES = {
+    # every 3 iterations, after 200 iterations every 20
+    "default": lambda i: i % 3 == 0 if i < 200 else i % 20 == 0,
+    "every": lambda i: True,
+    "every_10": lambda i: i % 10 == 0,
+}
+
 
 class GaussianProcess:
-    def __init__(self, bpm_norm_fac=100):
-        self.data_X = None
+    def __init__(self, bpm_norm_fac=100, kernel="RBF"):
+        """
+        @param kernel: name of the kernel (see KERNELS)
+        """
+        self.kernel = kernel
         self.data_X_old_shape = None
 
-        self.data_Y = None
-
         self.bpm_norm_fac = bpm_norm_fac
 
         self.domain = [
@@ -53,6 +74,17 @@ class GaussianProcess:
 
         self.space = GPyOpt.core.task.space.Design_space(self.domain)
 
+        # training data, in the domain (not one-hot encoded)
+        self.observations = ObservationBuffer(n_columns=len(self.domain))
+
+    @property
+    def data_X(self):
+        return self.observations.X if len(self.observations) else None
+
+    @property
+    def data_Y(self):
+        return self.observations.Y if len(self.observations) else None
+
     def _norm_bpm(self, v):
         return v / self.bpm_norm_fac
 
@@ -66,6 +98,25 @@ class GaussianProcess:
 
         return np.array([domain_x])
 
+    def _params2domain_batch(self, errors, bpms, practice_modes):
+        """
+            Same as _params2domain for many rows at once, the arguments are broadcast against each other.
+        @param errors: Error with scalars or arrays as values, or a list of Errors
+        @param bpms: bpm or array of bpms
+        @param practice_modes: PracticeMode or list of PracticeModes
+        """
+        if not isinstance(errors, Error):
+            errors = Error(pitch=[e.pitch for e in errors], timing=[e.timing for e in errors])
+        if isinstance(practice_modes, PracticeMode):
+            practice_modes = [practice_modes]
+        mode_values = np.array([pm.value for pm in practice_modes])
+
+        columns = np.broadcast_arrays(mode_values,
+                                      self._norm_bpm(np.asarray(bpms, dtype=float)),
+                                      np.asarray(errors.pitch, dtype=float),
+                                      np.asarray(errors.timing, dtype=float))
+        return np.column_stack([column.reshape(-1) for column in columns])
+
     def _domain2space(self, domain_x):
         # Converts the domain variables into the GPs input space
         # does one-hot encoding
@@ -85,13 +136,9 @@ class GaussianProcess:
 
         self.data_X_old_shape = self.data_X.shape
 
-        kernel = GPy.kern.RBF(input_dim=self.space.model_dimensionality,
-                              variance=0.01,
-                              lengthscale=1)
-
-        # kernel = GPy.kern.Matern52(input_dim=self.space.model_dimensionality,
-        #                       variance=0.01,
-        #                       lengthscale=1)
+        kernel = KERNELS[self.kernel](input_dim=self.space.model_dimensionality,
+                                     variance=0.01,
+                                     lengthscale=1)
 
         self.bayes_opt = GPyOpt.methods.BayesianOptimization(
             f=None, domain=self.domain, X=self.data_X, Y=self.data_Y,
@@ -132,6 +179,23 @@ class GaussianProcess:
 
         return mean[0]
 
+    def predict_batch(self, errors, bpms, practice_modes):
+        """
+            Estimates the utility values for many inputs with one prediction of the model
+            (arguments are broadcast against each other)
+        @param errors: Error with scalars or arrays as values, or a list of Errors
+        @param bpms: bpm or array of bpms
+        @param practice_modes: PracticeMode or list of PracticeModes
+        @return: means, variances (1d arrays), random means and nan variances if there is no model yet
+        """
+        x = self._params2domain_batch(errors, bpms, practice_modes)
+
+        if not hasattr(self, "bayes_opt"):
+            return np.random.random(len(x)), np.full(len(x), np.nan)
+
+        mean, std = self._get_bayes_opt().model.predict(self._domain2space(x))
+        return mean[:, 0], std[:, 0] ** 2
+
     def get_best_practice_mode(self, error, task_parameters, epsilon=0.05):
         """
             computes the gaussian process' estimate of the best practice mode
@@ -144,8 +208,8 @@ class GaussianProcess:
         all_practice_modes = list(PracticeMode)
         # epsilon-greedy
         if random.random() > epsilon:
-            max_i = np.argmax([self.get_estimate(error, task_parameters, pm)
-                               for pm in all_practice_modes])
+            means, _ = self.predict_batch(error, task_parameters.bpm, all_practice_modes)
+            max_i = np.argmax(means)
             return all_practice_modes[max_i]
         else:
             return np.random.choice(all_practice_modes)
@@ -160,14 +224,7 @@ class GaussianProcess:
         @param utility_measurement: observed utility value for the given parameters
         """
         new_x = self._params2domain(error, task_parameters, practice_mode)
-        new_y = [utility_measurement]
-
-        if self.data_X is None:
-            self.data_X = new_x
-            self.data_Y = [new_y]
-        else:
-            self.data_X = np.vstack((self.data_X, new_x[0]))
-            self.data_Y = np.vstack((self.data_Y, new_y[0]))
+        self.observations.append(new_x[0], utility_measurement)
 
 
 def generate_random_piece(task_parameters):
@@ -307,12 +364,134 @@ def simulate_error_tuple(task_parameters, performer):
     return error
 
 
-def perf_after_practice(error_pre, practice_mode):
+class PieceBank:
+    """
+        Randomly generated pieces for the batched error simulation (simulate_errors_batch),
+        stored as arrays per hand, so they don't have to be generated for every sample.
+    """
+
+    def __init__(self, task_parameters, size=PIECE_BANK_SIZE, rng=None):
+        """
+        @param task_parameters: task_parameters of the pieces
+        @param size: number of pieces
+        @param rng: np.random.Generator, the generator uses the random module, which is
+                    seeded from it (and restored afterwards)
+        """
+        if task_parameters.timeSignature != (3, 4) and task_parameters.timeSignature != (4, 4):
+            raise NotImplementedError("Timing Error Simulation currently only implemented for time signatures 3/4 and 4/4.")
+
+        rng = np.random.default_rng() if rng is None else rng
+        self.task_parameters = task_parameters
+        # formula to calculate the total number of mseconds of a bar from given time signature and bpm
+        self.mseconds_per_bar = (task_parameters.timeSignature[0] / task_parameters.bpm) * 60 * 1000
+
+        random_state = random.getstate()
+        random.seed(int(rng.integers(2 ** 32)))
+        # the generator prints a lot
+        with contextlib.redirect_stdout(io.StringIO()):
+            pieces = [generate_random_piece(task_parameters) for _ in range(size)]
+        random.setstate(random_state)
+
+        # per piece: (right-hand, left-hand) arrays
+        self.durations = [tuple(np.array([note.duration for note in hand], dtype=float) for hand in piece)
+                          for piece in pieces]
+        self.bars = [tuple(self._timed_bars(hand) for hand in piece) for piece in pieces]
+
+    def __len__(self):
+        return len(self.durations)
+
+    def _timed_bars(self, hand):
+        """
+        @return: bar of every note that is taken into account by the timing error
+                 (as in simulate_timing_err: the notes of the first bar (metronome cue)
+                 count to the second one, notes after the last bar are ignored)
+        """
+        beats = self.task_parameters.timeSignature[0]
+        starts = np.array([note.start for note in hand], dtype=float)
+        starts = starts[starts < self.task_parameters.noOfBars * beats]
+        return np.maximum(np.floor(starts / beats), 1).astype(int)
+
+
+def _simulate_pitch_err_batch(durations, failure_rates, rng):
+    # randomly chooses for each note whether it was successfully played in pitch with given failure rate
+    failed_notes = rng.random((len(failure_rates), len(durations))) < failure_rates[:, np.newaxis]
+    # duration weighted percentage of failed notes
+    return failed_notes @ durations / np.sum(durations)
+
+
+def _simulate_timing_err_batch(bars, mseconds_per_bar, ms_means, ms_std_deviations, rng):
+    n = len(ms_means)
+    if len(bars) == 0:
+        return np.full(n, np.nan)
+
+    offsets = np.abs(rng.normal(ms_means[:, np.newaxis], ms_std_deviations[:, np.newaxis], (n, len(bars))))
+
+    # sum of the timing offsets within each bar up to each note
+    cumulative = np.cumsum(offsets, axis=1)
+    bar_starts = np.flatnonzero(np.diff(bars, prepend=-1))
+    before_bar = np.hstack((np.zeros((n, 1)), cumulative))[:, bar_starts]
+    in_bar = cumulative - np.repeat(before_bar, np.diff(np.append(bar_starts, len(bars))), axis=1)
+    in_bar_before = in_bar - offsets
+
+    # a bar ends as soon as the offsets exceed its length, the last offset is cut to the remaining mseconds
+    played = in_bar_before <= mseconds_per_bar
+    bar_ends = np.append(bar_starts[1:], len(bars)) - 1
+    total = np.sum(np.minimum(in_bar[:, bar_ends], mseconds_per_bar), axis=1)
+
+    # mean timing offset, normed by the length of a bar in mseconds
+    return total / np.sum(played, axis=1) / mseconds_per_bar
+
+
+def simulate_errors_batch(piece_bank, performer, n, rng):
+    """
+        Simulates the pitch and timing errors of n performances at once, each of a random
+        piece of the piece_bank (same distribution as simulate_pitch_err / simulate_timing_err).
+    @param piece_bank: PieceBank
+    @param performer: balanced, bad_timing or bad_pitch, or an array with one of them per performance
+    @param n: number of performances
+    @param rng: np.random.Generator
+    @return: pitch errors, timing errors - arrays of shape (n, 2) - (right, left)
+    """
+    performer = np.broadcast_to(np.asarray(performer), (n,))
+    failure_rates = np.where(performer == "bad_pitch", 0.4, 0.15)
+    ms_means = np.where(performer == "bad_timing", 300., 100.)
+    ms_std_deviations = np.where(performer == "bad_timing", 200., 50.)
+
+    pieces = rng.integers(len(piece_bank), size=n)
+    pitch_errors = np.empty((n, 2))
+    timing_errors = np.empty((n, 2))
+    for piece in np.unique(pieces):
+        samples = np.flatnonzero(pieces == piece)
+        for hand in range(2):
+            pitch_errors[samples, hand] = _simulate_pitch_err_batch(
+                piece_bank.durations[piece][hand], failure_rates[samples], rng)
+            timing_errors[samples, hand] = _simulate_timing_err_batch(
+                piece_bank.bars[piece][hand], piece_bank.mseconds_per_bar,
+                ms_means[samples], ms_std_deviations[samples], rng)
+
+    return pitch_errors, timing_errors
+
+
+def simulate_error_tuples(piece_bank, performer, n, rng):
+    """
+        Batched version of simulate_error_tuple.
+    @return: Error with arrays (n,) of the errors averaged over both hands
+    """
+    pitch_errors, timing_errors = simulate_errors_batch(piece_bank, performer, n, rng)
+    return Error(pitch=pitch_errors.mean(axis=1), timing=timing_errors.mean(axis=1))
+
+
+def perf_after_practice(error_pre, practice_mode, draw=None):
+    """
+    @param draw: value in [0, 1) for the random worsening of the not practiced error,
+                 drawn with random.random() if None (0.5: its expectation)
+    """
+    draw = random.random() if draw is None else draw
     if practice_mode == PracticeMode.IMP_PITCH:
         return Error(pitch=error_pre.pitch * 0.5,
-                     timing=error_pre.timing + error_pre.timing * (0.1 * random.random()))
+                     timing=error_pre.timing + error_pre.timing * (0.1 * draw))
     if practice_mode == PracticeMode.IMP_TIMING:
-        return Error(pitch=error_pre.pitch + error_pre.pitch * (0.1 * random.random()),
+        return Error(pitch=error_pre.pitch + error_pre.pitch * (0.1 * draw),
                      timing=error_pre.timing * 0.5)
     if practice_mode == PracticeMode.SLOWER:
         return Error(pitch=error_pre.pitch * 0.75,
@@ -327,17 +506,20 @@ def error_diff_to_utility(error_pre, error_post):
     return (diff_timing + diff_pitch) / 2
 
 
-def plot_simulation(iterations=10000):
+def plot_simulation(iterations=10000, rng=None):
     tp = TaskParameters(bpm=120)
+    rng = np.random.default_rng() if rng is None else rng
+    piece_bank = PieceBank(tp, rng=rng)
+    simulated = {performer: simulate_errors_batch(piece_bank, performer, iterations, rng)
+                 for performer in performers}
 
     fig, axs = plt.subplots(2, 3, sharey='row', figsize=(15, 9))
     fig.suptitle(f'Histogram of Simulated Pitch Errors for {iterations} iterations', fontsize=14)
     for i in range(len(performers)):
-        pitch_errors = [simulate_pitch_err(tp, performer=performers[i]) for iteration in
-                        tqdm(range(iterations), desc=f"Pitch-Error-Sim {performers[i]:>10} | Iterations: ")]
+        pitch_errors, _ = simulated[performers[i]]
 
         for j, hand in enumerate(["Right", "Left"]):
-            axs[j, i].hist([error[j] for error in pitch_errors], bins=30)
+            axs[j, i].hist(pitch_errors[:, j], bins=30)
             axs[j, i].set_title(f"Pitch Error ({hand}): {performers[i]}")
             axs[j, i].set_xticks(np.arange(0, 1.1, 0.1))
             axs[j, i].set_xlabel("pitch error")
@@ -347,10 +529,9 @@ def plot_simulation(iterations=10000):
     fig, axs = plt.subplots(2, 3, sharey='row', figsize=(15, 9))
     fig.suptitle(f'Histogram of Simulated Timing Errors for {iterations} iterations', fontsize=14)
     for i in range(len(performers)):
-        timing_errors = [simulate_timing_err(tp, performer=performers[i]) for iteration in
-                         tqdm(range(iterations), desc=f"Timing-Error-Sim {performers[i]:>9} | Iterations: ")]
+        _, timing_errors = simulated[performers[i]]
         for j, hand in enumerate(["Right", "Left"]):
-            axs[j, i].hist([error[j] for error in timing_errors], bins=30)
+            axs[j, i].hist(timing_errors[:, j], bins=30)
             axs[j, i].set_title(f"Timing-Errors ({hand}): {performers[i]}")
             axs[j, i].set_xticks(np.arange(0, 1.1, 0.1))
             axs[j, i].set_xlabel("mean timing error")
@@ -388,25 +569,48 @@ def utility_gp(gaussian_process, task_parameter, practice_mode):
     return lambda error_pre: _utility_gp(gaussian_process, task_parameter, practice_mode, error_pre)[0]
 
 
+# same as utility_gp, but for an Error with arrays of errors (see plot_utility's batched)
+def utility_gp_batch(gaussian_process, task_parameter, practice_mode):
+    return lambda errors_pre: gaussian_process.predict_batch(errors_pre, task_parameter.bpm, practice_mode)[0]
+
+
 # ----------------------------------------------------------------------------------------------------------------------
 
-def plot_utility(utility_function, density=50, title="Utility", data_points=None):
-    plot_data = []
-    for i, error_pitch in enumerate(np.linspace(0, 1, density)):
-        for j, error_timing in enumerate(np.linspace(0, 1, density)):
-            error_pre = Error(pitch=error_pitch, timing=error_timing)
-            utility = utility_function(error_pre)
+def error_grid(density):
+    """
+        All combinations of density pitch and timing errors in [0, 1] (pitch major)
+    @return: Error with arrays
+    """
+    error_pitch, error_timing = np.meshgrid(np.linspace(0, 1, density), np.linspace(0, 1, density),
+                                            indexing="ij")
+    return Error(pitch=error_pitch.reshape(-1), timing=error_timing.reshape(-1))
+
 
-            plot_data.append([error_pitch, error_timing, utility])
+def plot_utility(utility_function, density=50, title="Utility", data_points=None, batched=False):
+    """
+    @param batched: utility_function takes an Error with arrays and returns an array
+                    of utilities (e.g. utility_gp_batch), instead of a single Error.
+    """
+    if batched:
+        errors = error_grid(density)
+        plot_data = np.column_stack((errors.pitch, errors.timing, utility_function(errors)))
+    else:
+        plot_data = []
+        for i, error_pitch in enumerate(np.linspace(0, 1, density)):
+            for j, error_timing in enumerate(np.linspace(0, 1, density)):
+                error_pre = Error(pitch=error_pitch, timing=error_timing)
+                utility = utility_function(error_pre)
 
-    plot_data = np.array(plot_data)
+                plot_data.append([error_pitch, error_timing, utility])
+
+        plot_data = np.array(plot_data)
 
     fig = plt.figure(figsize=(10, 7))
     ax = plt.axes(projection="3d")
 
     ax.scatter3D(plot_data[:, 0], plot_data[:, 1], plot_data[:, 2], s=8)
 
-    if data_points is not None:
+    if data_points is not None and len(data_points) > 0:
         ax.scatter3D(data_points[:, 0], data_points[:, 1], data_points[:, 2], color="red", alpha=0.6)
 
     ax.set_title(title)
@@ -419,25 +623,11 @@ def plot_utility(utility_function, density=50, title="Utility", data_points=None
 
 
 def plot_utility_all(gaussian_process, task_parameter, density):
-    plot_data_pitch = []
-    plot_data_timing = []
-    plot_data_slower = []
-
-    for error_pitch in np.linspace(0, 1, density):
-        for error_timing in np.linspace(0, 1, density):
-            error_pre = Error(pitch=error_pitch, timing=error_timing)
-
-            utility_pitch = gaussian_process.get_estimate(error_pre, task_parameter, PracticeMode.IMP_PITCH)
-            utility_timing = gaussian_process.get_estimate(error_pre, task_parameter, PracticeMode.IMP_TIMING)
-            utility_slower = gaussian_process.get_estimate(error_pre, task_parameter, PracticeMode.SLOWER)
-
-            plot_data_pitch.append([error_pitch, error_timing, utility_pitch[0]])
-            plot_data_timing.append([error_pitch, error_timing, utility_timing[0]])
-            plot_data_slower.append([error_pitch, error_timing, utility_slower[0]])
-
-    plot_data_pitch = np.array(plot_data_pitch)
-    plot_data_timing = np.array(plot_data_timing)
-    plot_data_slower = np.array(plot_data_slower)
+    errors = error_grid(density)
+    plot_data_pitch, plot_data_timing, plot_data_slower = [
+        np.column_stack((errors.pitch, errors.timing,
+                         gaussian_process.predict_batch(errors, task_parameter.bpm, pm)[0]))
+        for pm in [PracticeMode.IMP_PITCH, PracticeMode.IMP_TIMING, PracticeMode.SLOWER]]
 
     fig = plt.figure(figsize=(10, 7))
     ax = plt.axes(projection="3d")
@@ -460,36 +650,79 @@ def plot_utility_all(gaussian_process, task_parameter, density):
     plt.show()
 
 
-def gp_sim(iterations=100, performer="balanced"):
+def best_practice_mode_map(gaussian_process, task_parameter, density):
+    """
+        The GP's best practice mode (without exploration) on a density x density grid of errors
+    @return: array of practice mode values, rows: error_pitch, columns: error_timing
+    """
+    errors = error_grid(density)
+    all_practice_modes = list(PracticeMode)
+    utilities = np.column_stack([gaussian_process.predict_batch(errors, task_parameter.bpm, pm)[0]
+                                 for pm in all_practice_modes])
+    mode_values = np.array([pm.value for pm in all_practice_modes])
+    return mode_values[np.argmax(utilities, axis=1)].reshape(density, density)
+
+
+def policy_regret(gaussian_process, task_parameters, errors):
+    """
+        Mean regret of the GP's policy (without exploration): difference between utility_max and
+        the utility of the practice mode the GP chooses. The utilities are the expected ones
+        (noise-free, see perf_after_practice), so the regret has no sampling noise and is never negative.
+    @param errors: Error with arrays of the errors to evaluate on
+    @return: mean regret
+    """
+    practice_modes = list(PracticeMode)
+    estimates = np.column_stack([
+        gaussian_process.predict_batch(errors, task_parameters.bpm, practice_mode)[0]
+        for practice_mode in practice_modes])
+    chosen = np.argmax(estimates, axis=1)
+
+    # the utility is linear in the random draw, so the draw's expectation gives the expected utility
+    utilities = np.column_stack([error_diff_to_utility(errors, perf_after_practice(errors, practice_mode, draw=0.5))
+                                 for practice_mode in practice_modes])
+    regrets = utilities.max(axis=1) - utilities[np.arange(len(chosen)), chosen]
+
+    return np.mean(regrets)
+
+
+def train_gp(iterations=100, performer="balanced", rng=None, update_schedule="default", kernel="RBF",
+             eval_errors=None, eval_every=10, progress=True):
     """
         Trains a gaussian process with simulated data
         @param iterations: amount of data-points created for the GP
         @param performer: balanced, bad_timing, bad_pitch or all (all = randomly chosen each iteration)
+        @param rng: np.random.Generator for the simulated errors
+        @param update_schedule: when the model is updated (see UPDATE_SCHEDULES)
+        @param kernel: kernel of the GP (see KERNELS)
+        @param eval_errors: if given (Error with arrays), the policy regret on these errors is
+                            calculated every eval_every iterations and at the end
+        @param progress: show a progress bar
+        @return: GaussianProcess, learning curve - list of (iteration, regret)
     """
     tp = TaskParameters(bpm=120)
-    GP = GaussianProcess()
+    GP = GaussianProcess(kernel=kernel)
+    rng = np.random.default_rng() if rng is None else rng
+    update = UPDATE_SCHEDULES[update_schedule]
 
-    if performer != "all":
-        p = performer
+    if performer == "all":
+        performer = rng.choice(performers, size=iterations)
 
+    # calculate all error_pre depending on the performer
+    errors_pre = simulate_error_tuples(PieceBank(tp, rng=rng), performer, iterations, rng)
+
+    learning_curve = []
     # create data-points for Gaussian Process
-    for i in tqdm(range(iterations), desc="Simulating Data Points: "):
-        if performer == "all":
-            p = random.choice(performers)
-
-        # update model every 3 iterations
-        if i < 200:
-            if i % 3 == 0:
-                GP.update_model()
-        else:
-            if i % 20 == 0:
-                GP.update_model()
+    for i in tqdm(range(iterations), desc="Simulating Data Points: ", disable=not progress):
+        if update(i):
+            GP.update_model()
+
+        if eval_errors is not None and i % eval_every == 0:
+            learning_curve.append((i, policy_regret(GP, tp, eval_errors)))
 
         # bpm = random.randint(BPM_BOUNDS[0], BPM_BOUNDS[1])
         # tp = TaskParameters(bpm=bpm)
 
-        # calculate error_pre depending on the performer
-        error_pre = simulate_error_tuple(tp, p)
+        error_pre = Error(pitch=errors_pre.pitch[i], timing=errors_pre.timing[i])
 
         # let the gp choose the best practice mode (epsilon-greedy)
         given_practice_mode = GP.get_best_practice_mode(error_pre, tp)
@@ -500,11 +733,27 @@ def gp_sim(iterations=100, performer="balanced"):
         # calculate utility from error_pre and error_post
         utility = error_diff_to_utility(error_pre, error_post)
 
-        utility *= np.random.normal(1, 0.05)
+        utility *= rng.normal(1, 0.05)
 
         # add data-point to GP
         GP.add_data_point(error_pre, tp, given_practice_mode, utility)
 
+    if eval_errors is not None:
+        learning_curve.append((iterations, policy_regret(GP, tp, eval_errors)))
+
+    return GP, learning_curve
+
+
+def gp_sim(iterations=100, performer="balanced", rng=None):
+    """
+        Trains a gaussian process with simulated data and plots its estimates
+        @param iterations: amount of data-points created for the GP
+        @param performer: balanced, bad_timing, bad_pitch or all (all = randomly chosen each iteration)
+        @param rng: np.random.Generator for the simulated errors
+    """
+    tp = TaskParameters(bpm=120)
+    GP, _ = train_gp(iterations, performer, rng=rng)
+
     training_points = {
         0: [],  # pitch
         1: [],  # timing
@@ -518,26 +767,20 @@ def gp_sim(iterations=100, performer="balanced"):
         training_points[i] = np.array(training_points[i])
 
     # plot utility for the different Practice Modes for altering pitch and timing error
-    plot_utility(utility_function=utility_gp(GP, tp, practice_mode=PracticeMode.IMP_PITCH),
-                 title="Utility: Gaussian Process for IMP_PITCH", density=30, data_points=training_points[0])
-    plot_utility(utility_function=utility_gp(GP, tp, practice_mode=PracticeMode.IMP_TIMING),
-                 title="Utility: Gaussian Process for IMP_TIMING", density=30, data_points=training_points[1])
-    plot_utility(utility_function=utility_gp(GP, tp, practice_mode=PracticeMode.SLOWER),
-                 title="Utility: Gaussian Process for SLOWER", density=30, data_points=training_points[2])
+    plot_utility(utility_function=utility_gp_batch(GP, tp, practice_mode=PracticeMode.IMP_PITCH),
+                 title="Utility: Gaussian Process for IMP_PITCH", density=30, data_points=training_points[0],
+                 batched=True)
+    plot_utility(utility_function=utility_gp_batch(GP, tp, practice_mode=PracticeMode.IMP_TIMING),
+                 title="Utility: Gaussian Process for IMP_TIMING", density=30, data_points=training_points[1],
+                 batched=True)
+    plot_utility(utility_function=utility_gp_batch(GP, tp, practice_mode=PracticeMode.SLOWER),
+                 title="Utility: Gaussian Process for SLOWER", density=30, data_points=training_points[2],
+                 batched=True)
 
     plot_utility_all(GP, tp, density=50)
 
     density = 100
-    best_mode = np.zeros((density, density))
-    for i, error_pitch in enumerate(np.linspace(0, 1, density)):
-        for j, error_timing in enumerate(np.linspace(0, 1, density)):
-            best_pm = GP.get_best_practice_mode(Error(pitch=error_pitch, timing=error_timing), tp, epsilon=0)
-            if best_pm == PracticeMode.IMP_PITCH:
-                best_mode[i][j] = 0
-            elif best_pm == PracticeMode.IMP_TIMING:
-                best_mode[i][j] = 1
-            else:
-                best_mode[i][j] = 2
+    best_mode = best_practice_mode_map(GP, tp, density)
 
     plt.pcolormesh(np.linspace(0, 1, density), np.linspace(0, 1, density), best_mode)
     plt.title("GP's Estimate for best Practice Mode")
@@ -0,0 +1,108 @@
+"""
+Runs gp_experiment.train_gp headless for all combinations of performers, seeds,
+iterations, update schedules and kernels in a process pool, and writes the
+learning curves (policy regret against utility_max) into one CSV file
+(one row per run and evaluation step).
+
+usage (from the task_generation directory, gp_experiment imports the GUI's modules with PYTHONPATH=..):
+    PYTHONPATH=.. python3 gp_experiment_runner.py --seeds 0 1 2 --schedules default every_10 \
+        --kernels RBF Matern52 --output results.csv
+"""
+
+import argparse
+import itertools
+import multiprocessing
+import random
+import time
+
+import matplotlib
+
+# no display needed
+matplotlib.use("Agg")
+
+import numpy as np
+import pandas as pd
+
+import gp_experiment
+from generator import TaskParameters
+
+# number of errors the policy regret is evaluated on
+EVAL_SIZE = 200
+
+
+def run(config):
+    """
+    Trains one GP.
+    @param config: dict with performer, seed, iterations, schedule, kernel, eval_every, eval_size
+    @return: list of result rows (dicts)
+    """
+    seed = config["seed"]
+    # the GP's exploration and the simulated practice use the global random generators
+    random.seed(seed)
+    np.random.seed(seed)
+    rng = np.random.default_rng(seed)
+
+    # errors to evaluate on: same for all runs with this seed
+    eval_rng = np.random.default_rng([seed, 1])
+    eval_performers = eval_rng.choice(gp_experiment.performers, size=config["eval_size"])
+    eval_errors = gp_experiment.simulate_error_tuples(
+        gp_experiment.PieceBank(TaskParameters(bpm=120), rng=eval_rng),
+        eval_performers, config["eval_size"], eval_rng)
+
+    start = time.time()
+    _, learning_curve = gp_experiment.train_gp(
+        iterations=config["iterations"], performer=config["performer"], rng=rng,
+        update_schedule=config["schedule"], kernel=config["kernel"],
+        eval_errors=eval_errors, eval_every=config["eval_every"], progress=False)
+    duration = time.time() - start
+
+    print(f"done: {config} in {duration:.1f}s, final regret {learning_curve[-1][1]:.4f}")
+    return [dict(config, step=step, regret=regret, duration=duration)
+            for step, regret in learning_curve]
+
+
+def run_all(configs, processes=None):
+    """
+    @param configs: list of configs (see run)
+    @param processes: size of the process pool (default: number of CPUs)
+    @return: DataFrame with the results of all runs
+    """
+    with multiprocessing.Pool(processes) as pool:
+        results = pool.map(run, configs, chunksize=1)
+    return pd.DataFrame([row for rows in results for row in rows])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Runs GP training simulations (gp_experiment) in parallel "
+                                                 "and saves their learning curves.")
+    parser.add_argument("--performers", nargs="+", default=gp_experiment.performers + ["all"],
+                        choices=gp_experiment.performers + ["all"])
+    parser.add_argument("--seeds", nargs="+", type=int, default=[0, 1, 2])
+    parser.add_argument("--iterations", nargs="+", type=int, default=[300])
+    parser.add_argument("--schedules", nargs="+", default=["default"],
+                        choices=list(gp_experiment.UPDATE_SCHEDULES))
+    parser.add_argument("--kernels", nargs="+", default=["RBF"], choices=list(gp_experiment.KERNELS))
+    parser.add_argument("--eval-every", type=int, default=10,
+                        help="number of iterations between two evaluations of the policy regret")
+    parser.add_argument("--eval-size", type=int, default=EVAL_SIZE,
+                        help="number of simulated errors the policy regret is evaluated on")
+    parser.add_argument("--processes", type=int, default=None)
+    parser.add_argument("--output", default="gp_experiment_results.csv")
+    args = parser.parse_args()
+
+    configs = [dict(performer=performer, seed=seed, iterations=iterations, schedule=schedule, kernel=kernel,
+                    eval_every=args.eval_every, eval_size=args.eval_size)
+               for performer, seed, iterations, schedule, kernel in itertools.product(
+                   args.performers, args.seeds, args.iterations, args.schedules, args.kernels)]
+    print(f"{len(configs)} runs")
+
+    results = run_all(configs, args.processes)
+    results.to_csv(args.output, index=False)
+    print(f"saved the results to {args.output}")
+
+    final = results.loc[results.groupby(["performer", "seed", "iterations", "schedule", "kernel"])["step"].idxmax()]
+    print(final.groupby(["performer", "iterations", "schedule", "kernel"])["regret"].mean())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+import copy
+import time
+from collections import OrderedDict, defaultdict
+
+from task_generation.gaussian_process import GaussianProcess
+
+# maximum number of user models kept in memory
+POOL_CAPACITY = 8
+
+
+class GPPool:
+    """
+    One GaussianProcess per user plus a population model fitted on the data of
+    all users. A user model is only created (from the user's rows) when it is
+    needed and uses a model of the other users as prior mean, so a new user
+    starts with the population's estimate and the models stay small.
+    The prior only contains the rows of the other users at the start (with the
+    hyperparameters of the population model at the start), so the user's own
+    data isn't counted twice and the prior doesn't change with new data.
+    The least recently used user models are dropped when there are more than
+    capacity of them, they are created again from the same data when needed.
+
+    Has the interface of GaussianProcess, with the username as first argument
+    (can be trained by a GPTrainer).
+    """
+
+    def __init__(self, df, capacity=POOL_CAPACITY, population_path=None, **gp_kwargs):
+        """
+        @param df: DataFrame with the columns of the DataLogger (recorded data of all users)
+        @param capacity: maximum number of user models in memory
+        @param population_path: .npz file the population model is restored from
+                                (see GaussianProcess.restore)
+        @param gp_kwargs: arguments of the GaussianProcesses
+        """
+        self.capacity = capacity
+        self.gp_kwargs = gp_kwargs
+
+        self.population = GaussianProcess(**gp_kwargs)
+        if population_path is None:
+            self.population.add_data_frame(df)
+            self.population.update_model()
+        else:
+            self.population.restore(df, population_path)
+
+        # the priors of the user models are conditioned with these hyperparameters
+        self._prior_hyperparameters = self.population.hyperparameters
+        self._user_rows = {username: rows for username, rows in df.groupby("username")}
+        # data points added after the start, per user
+        self._new_data_points = defaultdict(list)
+        # username -> GaussianProcess, least recently used first
+        self.models = OrderedDict()
+
+    def load_user(self, username):
+        """
+        @return: model of the user, created and fitted from the user's data if
+                 it isn't in memory
+        """
+        if username in self.models:
+            self.models.move_to_end(username)
+            return self.models[username]
+
+        start = time.time()
+        model = GaussianProcess(prior=self._population_prior(username), **self.gp_kwargs)
+        if username in self._user_rows:
+            model.add_data_frame(self._user_rows[username])
+        for data_point in self._new_data_points[username]:
+            model.add_data_point(*data_point)
+        model.update_model()
+
+        self.models[username] = model
+        while len(self.models) > self.capacity:
+            evicted, _ = self.models.popitem(last=False)
+            print(f"GP pool: dropped the model of {evicted!r}")
+        print(f"GP pool: loaded the model of {username!r} ({len(model.observations)} data points) "
+              f"in {time.time() - start:.2f}s")
+        return model
+
+    def _population_prior(self, username):
+        """
+        @return: model of the rows of all other users at the start (see
+                 GaussianProcess.condition), None if there are none
+        """
+        if self._prior_hyperparameters is None:
+            return None
+
+        prior = GaussianProcess(**dict(self.gp_kwargs, policy_grid=None))
+        for other, rows in self._user_rows.items():
+            if other != username:
+                prior.add_data_frame(rows)
+        if len(prior.observations) == 0:
+            return None
+        prior.condition(self._prior_hyperparameters)
+        return prior
+
+    def add_data_point(self, username, error, bpm, practice_mode, utility_measurement):
+        """
+        Adds a data point to the population model and the model of the user
+        (see GaussianProcess.add_data_point).
+        """
+        data_point = (error, bpm, practice_mode, utility_measurement)
+        self._new_data_points[username].append(data_point)
+        self.population.add_data_point(*data_point)
+        if username in self.models:
+            self.models[username].add_data_point(*data_point)
+        else:
+            self.load_user(username)
+
+    def update_model(self):
+        """
+        Updates all models with new data (see GaussianProcess.update_model).
+        The priors of the user models stay the same (see _population_prior).
+        """
+        self.population.update_model()
+        for model in self.models.values():
+            model.update_model()
+
+    def snapshot(self):
+        """
+        Copy for predictions (see GaussianProcess.snapshot).
+        """
+        snapshot = copy.copy(self)
+        snapshot.population = self.population.snapshot()
+        snapshot.models = OrderedDict((username, model.snapshot())
+                                      for username, model in self.models.items())
+        return snapshot
+
+    def save(self, path):
+        """
+        Saves the population model (see GaussianProcess.save), if it was fitted
+        (there is nothing to save without data).
+        """
+        if self.population.hyperparameters is None:
+            return
+        self.population.save(path)
+
+    def model_of(self, username):
+        """
+        @return: model of the user if it is in memory, else the population model
+        """
+        if username in self.models:
+            self.models.move_to_end(username)
+            return self.models[username]
+        return self.population
+
+    def get_estimate(self, username, error, bpm, practice_mode):
+        return self.model_of(username).get_estimate(error, bpm, practice_mode)
+
+    def get_best_practice_mode(self, username, error, bpm, epsilon=0):
+        return self.model_of(username).get_best_practice_mode(error, bpm, epsilon=epsilon)
@@ -0,0 +1,83 @@
+import numpy as np
+from scipy.linalg import solve_triangular
+from GPy.util.linalg import jitchol
+
+
+class IncrementalPosterior:
+    """
+    Exact GP posterior (zero mean, gaussian noise) for fixed hyperparameters.
+    New observations extend the Cholesky factor of K + noise * I by one row
+    (rank-one update, O(n^2)) instead of refactorizing it (O(n^3)).
+    """
+
+    def __init__(self, kernel, noise_variance, X, Y, L=None):
+        """
+        @param kernel: fitted GPy kernel, it is copied so later optimisations of
+                       the model don't change this posterior.
+        @param noise_variance: variance of the gaussian likelihood.
+        @param X: inputs (in the GP's input space, i.e. one-hot encoded), shape (n, d)
+        @param Y: outputs, shape (n, 1)
+        @param L: lower Cholesky factor of K + noise * I, if it is known already
+                  (e.g. restored from a snapshot), it isn't computed again then.
+        """
+        self.kernel = kernel.copy()
+        self.noise_variance = float(np.asarray(noise_variance).reshape(-1)[0])
+
+        self.X = np.array(X, dtype=float)
+        self.Y = np.array(Y, dtype=float).reshape(-1, 1)
+
+        if L is None:
+            K = self.kernel.K(self.X) + self.noise_variance * np.eye(len(self.X))
+            L = jitchol(K)
+        self.L = np.asarray(L, dtype=float)
+        # L^-1 Y, extended with every new observation
+        self._v = solve_triangular(self.L, self.Y, lower=True)
+        self._alpha = None
+
+    def __len__(self):
+        return len(self.X)
+
+    def add(self, x, y):
+        """
+        Adds one observation.
+
+        @param x: input, shape (d,) or (1, d)
+        @param y: output
+        """
+        x = np.asarray(x, dtype=float).reshape(1, -1)
+        k = self.kernel.K(self.X, x)[:, 0]
+        k_new = self.kernel.Kdiag(x)[0] + self.noise_variance
+
+        l = solve_triangular(self.L, k, lower=True)
+        d = np.sqrt(max(k_new - l @ l, 1e-12))
+
+        n = len(self.X)
+        L = np.zeros((n + 1, n + 1))
+        L[:n, :n] = self.L
+        L[n, :n] = l
+        L[n, n] = d
+        self.L = L
+
+        self._v = np.vstack((self._v, [[(float(y) - l @ self._v[:, 0]) / d]]))
+        self.X = np.vstack((self.X, x))
+        self.Y = np.vstack((self.Y, [[float(y)]]))
+        self._alpha = None
+
+    def predict(self, X_new, include_likelihood=True):
+        """
+        @param X_new: inputs, shape (m, d)
+        @return: mean, variance (both of shape (m, 1)), as GPy's model.predict
+        """
+        if self._alpha is None:
+            self._alpha = solve_triangular(self.L.T, self._v, lower=False)
+
+        X_new = np.asarray(X_new, dtype=float)
+        K_cross = self.kernel.K(self.X, X_new)
+        mean = K_cross.T @ self._alpha
+
+        W = solve_triangular(self.L, K_cross, lower=True)
+        variance = self.kernel.Kdiag(X_new) - np.sum(W ** 2, axis=0)
+        if include_likelihood:
+            variance = variance + self.noise_variance
+
+        return mean, np.clip(variance, 1e-10, np.inf).reshape(-1, 1)
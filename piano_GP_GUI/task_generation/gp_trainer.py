@@ -0,0 +1,140 @@
+import queue
+import threading
+import time
+import traceback
+from collections import namedtuple
+
+from task_generation.gaussian_process import GaussianProcess
+
+# data points that are not in the model yet, time since the model was fitted (s)
+Staleness = namedtuple("Staleness", ["n_pending", "age"])
+
+
+class GPTrainer:
+    """
+    Fits a GaussianProcess (or a GPPool) in a background thread, so the GUI
+    doesn't freeze during the hyperparameter optimisation.
+    New data points are queued, the worker adds all of them that are waiting and
+    fits the model once. When a fit is done, a snapshot of the model replaces
+    the current one. Predictions are always answered by the latest completed
+    model, without waiting for a running fit.
+    """
+
+    def __init__(self, gaussian_process: GaussianProcess, save_path=None):
+        """
+        @param gaussian_process: GP (or GPPool) to train, it must only be used by the
+                                 trainer from now on.
+        @param save_path: if given, every fitted model is saved there (.npz, see
+                          GaussianProcess.save), so it can be restored at the next start.
+        """
+        self._gaussian_process = gaussian_process
+        self.save_path = save_path
+        self.model = gaussian_process.snapshot()
+        self.model_time = time.time()
+
+        self._queue = queue.Queue()
+        # data points that were added, but are not in self.model yet
+        self._n_pending = 0
+        self._lock = threading.Lock()
+
+        self._thread = threading.Thread(target=self._run, name="GPTrainer", daemon=True)
+        self._thread.start()
+
+    def add_data_point(self, *data_point):
+        """
+        Queues a new data point (see GaussianProcess.add_data_point, GPPool.add_data_point),
+        the model is updated in the background. Returns immediately.
+        """
+        with self._lock:
+            self._n_pending += 1
+        self._queue.put(("add_data_point", data_point))
+
+    def load_user(self, username):
+        """
+        Loads the model of a user in the background (GPPool only, see GPPool.load_user).
+        """
+        self._queue.put(("load_user", (username,)))
+
+    def _run(self):
+        while True:
+            calls = [self._queue.get()]
+            # take all waiting data points, so they are fitted at once
+            while True:
+                try:
+                    calls.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            stop = None in calls
+            calls = [call for call in calls if call is not None]
+
+            if calls:
+                self._fit(calls)
+
+            for _ in range(len(calls) + int(stop)):
+                self._queue.task_done()
+            if stop:
+                return
+
+    def _fit(self, calls):
+        """
+        @param calls: (method name, arguments) of the queued calls
+        """
+        n_data_points = sum(name == "add_data_point" for name, _ in calls)
+        try:
+            for name, args in calls:
+                getattr(self._gaussian_process, name)(*args)
+            start = time.time()
+            self._gaussian_process.update_model()
+            model = self._gaussian_process.snapshot()
+            print(f"GP trainer: fitted {n_data_points} new data point(s) "
+                  f"in {time.time() - start:.2f}s")
+        except Exception:
+            print("GP trainer: fitting failed, keeping the last model")
+            traceback.print_exc()
+            model = None
+
+        with self._lock:
+            if model is not None:
+                self.model = model
+                self.model_time = time.time()
+            self._n_pending -= n_data_points
+
+        # a failed save doesn't affect the new model
+        if model is not None and self.save_path is not None:
+            try:
+                model.save(self.save_path)
+            except Exception:
+                print("GP trainer: saving the model failed")
+                traceback.print_exc()
+
+    def staleness(self) -> Staleness:
+        with self._lock:
+            return Staleness(n_pending=self._n_pending, age=time.time() - self.model_time)
+
+    def get_best_practice_mode(self, *args, **kwargs):
+        """
+        get_best_practice_mode of the latest completed model (see
+        GaussianProcess.get_best_practice_mode, GPPool.get_best_practice_mode).
+        Prints how stale the model is.
+        """
+        with self._lock:
+            model = self.model
+        staleness = self.staleness()
+        print(f"GP model: {staleness.n_pending} data point(s) pending, "
+              f"fitted {staleness.age:.1f}s ago")
+
+        return model.get_best_practice_mode(*args, **kwargs)
+
+    def wait(self):
+        """
+        Blocks until all queued data points are fitted.
+        """
+        self._queue.join()
+
+    def stop(self):
+        """
+        Fits the queued data points and stops the worker thread.
+        """
+        self._queue.put(None)
+        self._thread.join()
@@ -1,17 +1,74 @@
+import bisect
 import dataclasses as dc
+from collections import defaultdict
 from dataclasses import dataclass
 
+HANDS = ("left", "right")
+
 
 @dataclass
 class MidiNoteEventContainer:
     left: list = dc.field(init=False)
     right: list = dc.field(init=False)
     together: list = dc.field(init=False)
+    # hand ("left" / "right") of every note in together
+    hands: list = dc.field(init=False)
+    # per hand: sorted pitches, and the sorted onsets of the notes of every pitch
+    pitches: dict = dc.field(init=False)
+    onsets_by_pitch: dict = dc.field(init=False)
 
     def register_midi_events(self, midi_left, midi_right):
         self.left = midi_left
         self.right = midi_right
-        self.together = sorted(self.left + self.right, key=lambda n: n.note_on_time)
+
+        tagged = [(n, "left") for n in self.left] + [(n, "right") for n in self.right]
+        tagged = sorted(tagged, key=lambda n_hand: n_hand[0].note_on_time)
+        self.together = [n for n, _ in tagged]
+        self.hands = [hand for _, hand in tagged]
+
+        # a note that is in both lists counts as right (see hand_of)
+        self._hand_of_note = {n: hand for hand in HANDS for n in getattr(self, hand)}
+
+        self.pitches = dict()
+        self.onsets_by_pitch = dict()
+        for hand in HANDS:
+            onsets = defaultdict(list)
+            for n in getattr(self, hand):
+                onsets[n.pitch].append(n.note_on_time)
+            self.pitches[hand] = sorted(onsets)
+            self.onsets_by_pitch[hand] = {pitch: sorted(on) for pitch, on in onsets.items()}
+
+    def hand_of(self, note):
+        """
+        @return: "left" / "right", None if the note isn't registered
+        """
+        return self._hand_of_note.get(note)
+
+    def nearest_note_distance(self, hand, pitch, note_on_time):
+        """
+        Distance to the closest note of a hand, first by pitch, then by onset.
+
+        @return: (pitch distance, onset distance), None if the hand has no notes
+        """
+        pitches = self.pitches[hand]
+        if len(pitches) == 0:
+            return None
+
+        k = bisect.bisect_left(pitches, pitch)
+        neighbours = pitches[max(k - 1, 0):k + 1]
+        pitch_dist = min(abs(pitch - p) for p in neighbours)
+
+        time_dist = None
+        for p in neighbours:
+            if abs(pitch - p) != pitch_dist:
+                continue
+            onsets = self.onsets_by_pitch[hand][p]
+            j = bisect.bisect_left(onsets, note_on_time)
+            for on in onsets[max(j - 1, 0):j + 1]:
+                if time_dist is None or abs(note_on_time - on) < time_dist:
+                    time_dist = abs(note_on_time - on)
+
+        return pitch_dist, time_dist
 
     def __repr__(self):
         try:
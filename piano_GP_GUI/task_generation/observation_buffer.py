@@ -0,0 +1,69 @@
+import numpy as np
+
+
+class ObservationBuffer:
+    """
+    Array-backed store of the GP's training data (inputs X, outputs Y).
+    The capacity is doubled when it is full, so adding n observations one by
+    one copies O(n) rows in total (instead of O(n^2) with np.vstack).
+    X and Y are views of the filled rows, they don't copy anything. Rows are
+    never changed after they were added, so views that were handed out stay valid.
+    """
+
+    def __init__(self, n_columns, capacity=64):
+        self._X = np.empty((capacity, n_columns))
+        self._Y = np.empty((capacity, 1))
+        self._n = 0
+
+    def __len__(self):
+        return self._n
+
+    @property
+    def X(self):
+        return self._X[:self._n]
+
+    @property
+    def Y(self):
+        return self._Y[:self._n]
+
+    def _reserve(self, n):
+        """
+        Makes sure there is space for n observations in total.
+        """
+        if n <= len(self._X):
+            return
+
+        capacity = max(len(self._X), 1)
+        while capacity < n:
+            capacity *= 2
+
+        X = np.empty((capacity, self._X.shape[1]))
+        Y = np.empty((capacity, 1))
+        X[:self._n] = self.X
+        Y[:self._n] = self.Y
+        self._X, self._Y = X, Y
+
+    def append(self, x, y):
+        """
+        @param x: input, shape (n_columns,)
+        @param y: output
+        """
+        self._reserve(self._n + 1)
+        self._X[self._n] = x
+        self._Y[self._n] = y
+        self._n += 1
+
+    def extend(self, X, Y):
+        """
+        @param X: inputs, shape (n, n_columns)
+        @param Y: outputs, shape (n,) or (n, 1)
+        """
+        X = np.asarray(X, dtype=float).reshape(-1, self._X.shape[1])
+        Y = np.asarray(Y, dtype=float).reshape(-1, 1)
+        if len(X) != len(Y):
+            raise ValueError(f"got {len(X)} inputs but {len(Y)} outputs")
+
+        self._reserve(self._n + len(X))
+        self._X[self._n:self._n + len(X)] = X
+        self._Y[self._n:self._n + len(Y)] = Y
+        self._n += len(X)
@@ -0,0 +1,92 @@
+import time
+from collections import namedtuple
+
+import numpy as np
+
+# grid of a PolicyTable: bpm values, and the values of every error (dict: error key -> values)
+PolicyGrid = namedtuple("PolicyGrid", ["bpms", "errors"])
+
+
+class PolicyTable:
+    """
+    Estimated utilities of the practice modes, precomputed with one batched
+    prediction of a GP over a grid of bpms and errors. Lookups interpolate
+    between the grid points (or snap to the nearest one) instead of evaluating
+    the GP. The table belongs to one model, a new model needs a new table.
+    """
+
+    def __init__(self, gaussian_process, practice_modes, grid: PolicyGrid, method="linear"):
+        """
+        @param gaussian_process: fitted GaussianProcess
+        @param practice_modes: practice modes to compare
+        @param grid: PolicyGrid, the values of every axis must be increasing
+        @param method: "linear" (interpolate) or "nearest" (snap to the grid)
+        """
+        start = time.time()
+        self.practice_modes = list(practice_modes)
+        self.error_keys = list(grid.errors)
+
+        axes = [np.asarray(grid.bpms, dtype=float)] + \
+               [np.asarray(grid.errors[key], dtype=float) for key in self.error_keys]
+        mesh = [column.reshape(-1) for column in np.meshgrid(*axes, indexing="ij")]
+        n_modes, n_points = len(self.practice_modes), len(mesh[0])
+
+        # all practice modes at all grid points
+        means, _ = gaussian_process.predict_batch(
+            {key: np.tile(mesh[i + 1], n_modes) for i, key in enumerate(self.error_keys)},
+            np.tile(mesh[0], n_modes),
+            [practice_mode for practice_mode in self.practice_modes for _ in range(n_points)])
+
+        # values: grid shape + (number of practice modes, )
+        self.values = np.moveaxis(means.reshape((n_modes,) + tuple(len(axis) for axis in axes)), 0, -1)
+        self.axes = axes
+        self.method = method
+        self._lower = np.array([axis[0] for axis in axes])
+        self._upper = np.array([axis[-1] for axis in axes])
+
+        self.hits = 0
+        self.misses = 0
+        self.build_time = time.time() - start
+
+    def __len__(self):
+        return self.values.size
+
+    def _interpolate(self, point):
+        """
+        Multilinear interpolation (or the nearest grid point) of the values at
+        one point inside of the grid, only uses the 2^d surrounding grid points.
+        """
+        lower_indices, weights = list(), list()
+        for axis, p in zip(self.axes, point):
+            i = min(max(np.searchsorted(axis, p, side="right") - 1, 0), len(axis) - 2) \
+                if len(axis) > 1 else 0
+            t = (p - axis[i]) / (axis[i + 1] - axis[i]) if len(axis) > 1 else 0.0
+            if self.method == "nearest":
+                t = float(t >= 0.5)
+            lower_indices.append(i)
+            weights.append(t)
+
+        corners = self.values[tuple(slice(i, i + 2) for i in lower_indices)]
+        for t in weights:
+            corners = corners[0] * (1 - t) + corners[-1] * t
+        return corners
+
+    def lookup(self, error, bpm):
+        """
+        @param error: error values
+        @param bpm: bpm of the music piece
+        @return: practice mode with the highest estimated utility, None if the
+                 point is outside of the grid (the GP has to be asked then)
+        """
+        point = np.array([bpm] + [error[key] for key in self.error_keys], dtype=float)
+        if np.any(point < self._lower) or np.any(point > self._upper):
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        means = self._interpolate(point)
+        return self.practice_modes[int(np.argmax(means))]
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else float("nan")
@@ -33,11 +33,10 @@ class TaskData:
         return self.time_signature[0]
 
     def note2hand(self, note):
-        if note in self.midi.right:
-            return "right"
-        if note in self.midi.left:
-            return "left"
-        raise ValueError("note in neither lists?")
+        hand = self.midi.hand_of(note)
+        if hand is None:
+            raise ValueError("note in neither lists?")
+        return hand
 
     def all_notes(self):
         assert hasattr(self.midi, "together"), "MidiContainer didn't have any events yet?"
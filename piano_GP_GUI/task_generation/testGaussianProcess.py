@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import tempfile
+
+import GPy
+import numpy as np
+import pandas as pd
+
+from task_generation.benchmark_gp import random_inputs, true_utility
+from task_generation.gaussian_process import GaussianProcess, PracticeMode, ERROR_KEYS
+from task_generation.gp_posterior import IncrementalPosterior
+from task_generation.gp_pool import GPPool
+from task_generation.gp_trainer import GPTrainer
+
+
+def empty_data_frame():
+    """
+    DataFrame with the columns of the DataLogger, without rows (first start)
+    """
+    columns = {'midi_filename': str, 'username': str, 'practice_mode': str, 'bpm': float}
+    for when in ["before", "after"]:
+        for key in ERROR_KEYS:
+            kind, hand = key.split("_")
+            columns[f"error_{when}_{hand}_{kind}"] = float
+    return pd.DataFrame({column: np.ndarray((0,), dtype=dtype) for column, dtype in columns.items()})
+
+
+def users_data_frame(usernames, n_rows, seed=0):
+    """
+    DataFrame with the columns of the DataLogger and n_rows simulated trials per user
+    """
+    rng = np.random.default_rng(seed)
+    n = n_rows * len(usernames)
+    errors, bpms, practice_modes = random_inputs(n, rng)
+    df = pd.DataFrame({'midi_filename': "task.mid", 'username': np.repeat(usernames, n_rows),
+                       'practice_mode': [practice_mode.name for practice_mode in practice_modes],
+                       'bpm': bpms})
+    for key in ERROR_KEYS:
+        kind, hand = key.split("_")
+        df[f"error_before_{hand}_{kind}"] = errors[key]
+        df[f"error_after_{hand}_{kind}"] = errors[key] * rng.uniform(0.3, 1.1, n)
+    return df
+
+
+def gp_with_data(n_data, seed=0, **gp_kwargs):
+    """
+    @return: GaussianProcess with n_data simulated data points (see benchmark_gp), not fitted
+    """
+    rng = np.random.default_rng(seed)
+    gp = GaussianProcess(**gp_kwargs)
+    add_data(gp, n_data, rng)
+    return gp
+
+
+def add_data(gp, n_data, rng):
+    errors, bpms, practice_modes = random_inputs(n_data, rng)
+    utilities = true_utility(errors, bpms, practice_modes) + rng.normal(0, 0.02, n_data)
+    gp.observations.extend(gp._params2domain_batch(errors, bpms, practice_modes), utilities)
+
+
+def evaluation_points(gp, n=50, seed=1):
+    errors, bpms, practice_modes = random_inputs(n, np.random.default_rng(seed))
+    return gp._domain2space(gp._params2domain_batch(errors, bpms, practice_modes))
+
+
+def full_refit(gp):
+    """
+    GPy model on all data of the GP with its fitted hyperparameters (not optimized again)
+    """
+    kernel = GPy.kern.RBF(input_dim=gp.space.model_dimensionality,
+                          variance=gp.hyperparameters["variance"],
+                          lengthscale=gp.hyperparameters["lengthscale"])
+    return GPy.models.GPRegression(gp._domain2space(gp.data_X), gp.data_Y, kernel,
+                                   noise_var=gp.hyperparameters["noise_variance"])
+
+
+def test_incremental_posterior_same_as_refit():
+    gp = gp_with_data(40)
+    gp.update_model()
+    x, y = gp._domain2space(gp.data_X), gp.data_Y
+    model = full_refit(gp)
+
+    posterior = IncrementalPosterior(model.kern, model.likelihood.variance, x[:10], y[:10])
+    for x_i, y_i in zip(x[10:], y[10:, 0]):
+        posterior.add(x_i, y_i)
+
+    x_test = evaluation_points(gp)
+    mean, variance = posterior.predict(x_test)
+    expected_mean, expected_variance = model.predict(x_test)
+    assert np.allclose(mean, expected_mean, atol=1e-6)
+    assert np.allclose(variance, expected_variance, atol=1e-6)
+
+
+def test_incremental_update_model_same_as_refit():
+    rng = np.random.default_rng(2)
+    gp = gp_with_data(30, incremental=True, reoptimize_every=100)
+    gp.update_model()
+    hyperparameters = dict(gp.hyperparameters)
+    for _ in range(3):
+        add_data(gp, 5, rng)
+        gp.update_model()
+
+    # only the posterior was extended
+    assert gp.hyperparameters == hyperparameters and len(gp.posterior) == 45
+    x_test = evaluation_points(gp)
+    mean, variance = gp._predict(x_test)
+    expected_mean, expected_variance = full_refit(gp).predict(x_test)
+    assert np.allclose(mean, expected_mean, atol=1e-6)
+    assert np.allclose(variance, expected_variance, atol=1e-6)
+
+
+def test_save_load_round_trip():
+    gp = gp_with_data(40)
+    gp.update_model()
+    x_test = evaluation_points(gp)
+    expected_mean, expected_variance = gp._predict(x_test)
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "gp_state.npz")
+        gp.save(path)
+
+        loaded = gp_with_data(40)
+        assert loaded.load(path)
+        assert loaded.hyperparameters == gp.hyperparameters
+        mean, variance = loaded._predict(x_test)
+        assert np.allclose(mean, expected_mean, atol=1e-6)
+        assert np.allclose(variance, expected_variance, atol=1e-6)
+
+        # the saved data are the first rows, the new ones are added by update_model
+        extended = gp_with_data(40)
+        add_data(extended, 5, np.random.default_rng(3))
+        assert extended.load(path)
+        extended.update_model()
+        assert len(extended.observations) == 45
+
+
+def test_load_data_mismatch():
+    gp = gp_with_data(40)
+    gp.update_model()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "gp_state.npz")
+        gp.save(path)
+
+        # other data, fewer data points, other bpm normalisation
+        assert not gp_with_data(40, seed=5).load(path)
+        assert not gp_with_data(30).load(path)
+        assert not gp_with_data(40, bpm_norm_fac=50).load(path)
+
+        changed = gp_with_data(40)
+        changed.observations.Y[7, 0] += 0.1
+        assert not changed.load(path)
+        assert changed.posterior is None and changed.hyperparameters is None
+
+
+def test_trainer_without_data_load_user():
+    with tempfile.TemporaryDirectory() as directory:
+        save_path = os.path.join(directory, "gp_state.npz")
+        trainer = GPTrainer(GPPool(empty_data_frame()), save_path=save_path)
+        trainer.load_user("alice")
+        trainer.wait()
+
+        # the user model reaches the model the GUI asks, nothing to save yet
+        assert "alice" in trainer.model.models
+        assert not os.path.exists(save_path)
+        error = {key: 0.1 for key in ERROR_KEYS}
+        assert trainer.get_best_practice_mode("alice", error, 100) in PracticeMode
+        trainer.stop()
+
+
+def test_pool_reload_same_predictions():
+    df = users_data_frame(["alice", "bob", "carol"], 15)
+    pool = GPPool(df, capacity=1)
+    error = {key: 0.2 for key in ERROR_KEYS}
+    x_test = evaluation_points(pool.population)
+
+    # the fits of the user models have random restarts
+    np.random.seed(0)
+    pool.add_data_point("alice", error, 80, PracticeMode.IMP_PITCH, 0.3)
+    expected_mean, expected_variance = pool.models["alice"]._predict(x_test)
+    # the prior only has the rows of the other users
+    assert len(pool.models["alice"].prior.observations) == 30
+
+    # new data of another user, alice's model is dropped
+    pool.add_data_point("bob", error, 90, PracticeMode.IMP_TIMING, 0.1)
+    pool.add_data_point("bob", error, 70, PracticeMode.LEFT, 0.2)
+    pool.update_model()
+    assert "alice" not in pool.models
+
+    np.random.seed(0)
+    mean, variance = pool.load_user("alice")._predict(x_test)
+    assert np.allclose(mean, expected_mean, atol=1e-6)
+    assert np.allclose(variance, expected_variance, atol=1e-6)
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import random
+import re
+import tempfile
+
+import mido
+import numpy as np
+from midiutil.MidiFile import MIDIFile
+from music21 import converter
+
+import midiProcessing
+import pianoplayer_interface
+import settings
+from fingering_cache import FingeringCache
+from task_generation.generator import generate_task
+from task_generation.task_parameters import TaskParameters
+from task_generation.note_range_per_hand import NoteRangePerHand
+
+
+def reparse_note_events(notes, bpm):
+    """
+    Writes the notes of one hand to a MIDI file and parses their times back
+    (what generateMidi used to do).
+    """
+    mf = MIDIFile(numTracks=settings.TRACKS)
+    midiProcessing.set_tracks(mf, bpm)
+    for start, pitch, duration in notes:
+        mf.addNote(track=settings.R_TRACK, channel=settings.CHANNEL_PIANO, pitch=pitch,
+                   time=start, duration=duration, volume=settings.VOLUME)
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "notes.mid")
+        midiProcessing.write_midi(path, mf)
+        mido_file = mido.MidiFile(path)
+        return midiProcessing._midi_messages_to_note_events(mido_file.tracks[1], mido_file)
+
+
+def assert_same_note_events(notes, bpm):
+    expected = reparse_note_events(notes, bpm)
+    actual = midiProcessing._note_events(notes, bpm, MIDIFile(1).ticks_per_quarternote)
+    assert_same_note_infos(actual, expected)
+
+
+def assert_same_note_infos(actual, expected):
+    assert len(actual) == len(expected)
+    for a, e in zip(actual, expected):
+        assert (a.pitch, a.velocity) == (e.pitch, e.velocity)
+        assert np.isclose(a.note_on_time, e.note_on_time, rtol=0, atol=1e-9)
+        assert np.isclose(a.note_off_time, e.note_off_time, rtol=0, atol=1e-9)
+
+
+def test_note_events_same_as_reparse():
+    # odd tempos and durations that aren't a whole number of ticks
+    notes = [(4, 60, 1), (5, 62, 1 / 3), (5 + 1 / 3, 64, 1 / 3), (5 + 2 / 3, 60, 1 / 3),
+             (6, 65, 0.5), (6, 67, 2), (6.5, 65, 0.25), (8, 60, 1.7)]
+    for bpm in [50, 70, 97, 120, 173]:
+        assert_same_note_events(notes, bpm)
+
+
+def test_note_events_same_as_reparse_generated_tasks():
+    random.seed(0)
+    for bpm in [60, 90, 110]:
+        for _ in range(5):
+            task = generate_task(TaskParameters(bpm=bpm))
+            assert_same_note_events(task.notes_right, task.bpm)
+            assert_same_note_events(task.notes_left, task.bpm)
+
+
+def test_generate_midi_note_events_same_as_reparse():
+    random.seed(0)
+    parse_note_events = midiProcessing._midi_messages_to_note_events
+    default_cache = midiProcessing.fingering_cache
+
+    def no_reparse(*args):
+        raise AssertionError("generateMidi parsed the note events from the MIDI file")
+
+    with tempfile.TemporaryDirectory() as directory:
+        out_files = [os.path.join(directory, name) for name in ["output.mid", "output-m.mid",
+                                                                 "output-md.mid", "output.xml"]]
+        try:
+            midiProcessing.fingering_cache = None
+            midiProcessing._midi_messages_to_note_events = no_reparse
+            # few notes (trailing fingering notes stay in the file) and many notes, one and two hands
+            for n_bars, left in [(2, False), (2, True), (8, False), (8, True)]:
+                for bpm in [60, 97]:
+                    task = generate_task(TaskParameters(bpm=bpm, noOfBars=n_bars, left=left, right=True,
+                                                        alternating=not left))
+                    assert (max(len(task.notes_left), len(task.notes_right)) <= 7) == (n_bars == 2)
+                    artifacts = midiProcessing.generateMidi(task, out_files)
+
+                    mido_file = artifacts.notes.mido_file()
+                    assert_same_note_infos(task.midi.left, parse_note_events(mido_file.tracks[2], mido_file))
+                    assert_same_note_infos(task.midi.right, parse_note_events(mido_file.tracks[1], mido_file))
+        finally:
+            midiProcessing._midi_messages_to_note_events = parse_note_events
+            midiProcessing.fingering_cache = default_cache
+
+
+def test_note_events_overlapping_pitch():
+    # MIDIUtil removes/shortens these notes, so generateMidi has to parse the file
+    assert midiProcessing._note_events([(0, 60, 2), (1, 60, 2)], 120, 960) is None
+    assert midiProcessing._note_events([(0, 60, 1), (0, 60, 1)], 120, 960) is None
+    assert midiProcessing._note_events([(0, 60, 1), (1, 60, 1)], 120, 960) is not None
+
+
+def generate_outputs(task, directory):
+    """
+    @return: MIDI files (notes, metronome, dexmo) and MusicXML file of the task, the MusicXML file without
+             the random ids
+    """
+    out_files = [os.path.join(directory, name) for name in ["output.mid", "output-m.mid", "output-md.mid",
+                                                             "output.xml"]]
+    artifacts = midiProcessing.generateMidi(task, out_files)
+    with open(out_files[3]) as f:
+        xml = re.sub(r'id="[^"]*"', "", "\n".join(line for line in f if "encoding-date" not in line))
+    return [artifacts.notes.data, artifacts.metronome.data, artifacts.dexmo.data, xml]
+
+
+def generate_xml(task, directory):
+    """
+    @return: MusicXML file of the task, without the random ids
+    """
+    return generate_outputs(task, directory)[3]
+
+
+class ScorePerStep(pianoplayer_interface.ScoreSession):
+    """
+    ScoreSession which parses the MIDI file again for every use of the score, like generateMidi did before
+    the score was shared.
+    """
+
+    def __init__(self, midi_file):
+        self.midi_file = midi_file
+        super().__init__(midi_file)
+
+    @property
+    def score(self):
+        if isinstance(self.midi_file, bytes):
+            return converter.parseData(self.midi_file, format='midi')
+        return converter.parse(self.midi_file)
+
+    @score.setter
+    def score(self, value):
+        pass
+
+
+def test_shared_score_same_outputs():
+    random.seed(0)
+    default_cache = midiProcessing.fingering_cache
+    score_session = pianoplayer_interface.ScoreSession
+    with tempfile.TemporaryDirectory() as directory:
+        try:
+            midiProcessing.fingering_cache = None
+            # few notes (score shared by fingering output and MusicXML) and many notes, one and two hands
+            for n_bars, left in [(2, False), (2, True), (8, False), (8, True)]:
+                task = generate_task(TaskParameters(bpm=80, noOfBars=n_bars, left=left, right=True,
+                                                    alternating=not left))
+                shared = generate_outputs(task, directory)
+                try:
+                    pianoplayer_interface.ScoreSession = ScorePerStep
+                    per_step = generate_outputs(task, directory)
+                finally:
+                    pianoplayer_interface.ScoreSession = score_session
+                assert shared == per_step
+        finally:
+            midiProcessing.fingering_cache = default_cache
+
+
+def test_fingering_cache_same_fingering():
+    random.seed(0)
+    task = generate_task(TaskParameters(bpm=90, noOfBars=16, left=True, right=True,
+                                        note_range_right=NoteRangePerHand.C_DUR))
+    default_cache = midiProcessing.fingering_cache
+    with tempfile.TemporaryDirectory() as directory:
+        try:
+            midiProcessing.fingering_cache = None
+            expected = generate_xml(task, directory)
+
+            cache = FingeringCache(os.path.join(directory, "cache"), max_entries=2)
+            midiProcessing.fingering_cache = cache
+            assert generate_xml(task, directory) == expected
+            assert (cache.hits, cache.misses) == (0, 2)
+
+            # same notes at another tempo
+            task.bpm = 120
+            assert generate_xml(task, directory) == generate_xml(task, directory)
+            assert generate_xml(task, directory).count("</fingering>") == expected.count("</fingering>") > 0
+            assert cache.misses == 2 and len(cache) == 2
+        finally:
+            midiProcessing.fingering_cache = default_cache
+
+
+def test_fingering_cache_lru():
+    with tempfile.TemporaryDirectory() as directory:
+        cache = FingeringCache(directory, max_entries=2)
+        cache.put("a", [1, 2])
+        cache.put("b", [3])
+        os.utime(os.path.join(directory, "a.json"), (0, 0))
+        os.utime(os.path.join(directory, "b.json"), (1, 1))
+        assert cache.get("a") == [1, 2]
+        cache.put("c", [4])
+        assert len(cache) == 2
+        assert cache.get("b") is None
+        assert cache.get("a") == [1, 2] and cache.get("c") == [4]
@@ -10,6 +10,7 @@ import dexmoOutput
 import fileIO
 from error_calc import functions
 from error_calc.explanation import Error
+from error_calc.onlineScorer import OnlineScorer
 from midiInput import MidiInputThread, empty_noteinfo
 from midiOutput import MidiOutputThread
 import noteHandler as nh
@@ -17,6 +18,9 @@ import noteHandler as nh
 MAX_NOTE = 128
 global portname
 
+# OnlineScorer of the running trial (None if not used), e.g. for live per-bar errors
+online_scorer = None
+
 
 def resetArrays():
     """
@@ -86,22 +90,29 @@ def set_outport(portName):
         print("ERROR: outputThread was not defined yet")
 
 
-def start_midi_playback(midiFileLocation, guidance, task_data, use_visual_attention=True):
+def start_midi_playback(midiFileLocation, guidance, task_data, use_visual_attention=True,
+                        online_scoring=False):
     """
     Starts the MIDI playback thread and activates the MIDI input handler.
     After the player thread terminates, the input handler is deactivated again.
     The user's played notes and the error are received and displayed afterwards.
 
-    @param midiFileLocation: Path to the MIDI file.
+    @param midiFileLocation: Path to the MIDI file (or the parsed mido.MidiFile).
     @param guidance: Current Dexmo guidance mode.
+    @param online_scoring: align the notes while they are played (OnlineScorer)
+                           instead of running computeErrorEvo afterwards (opt-in,
+                           see gp_training_gui.ONLINE_SCORING).
     @return: Target notes, actual notes and the error.
     """
-    global targetTemp, targetTimes, inputThread, outputThread
+    global targetTemp, targetTimes, inputThread, outputThread, online_scorer
 
     ###TODO: change?
     resetArrays()
     inputThread.resetArrays()
 
+    online_scorer = OnlineScorer(task_data) if online_scoring else None
+    inputThread.online_scorer = online_scorer
+
     # MIDI PLAYER THREAD
     # initialize MIDI file player thread
     playerThread = Thread(target=dexmoOutput.practice_task,  # target=outputThread.playMidi (PL)
@@ -119,6 +130,7 @@ def start_midi_playback(midiFileLocation, guidance, task_data, use_visual_attent
 
     # deactivate input handling
     inputThread.inputOff()
+    inputThread.online_scorer = None
 
     # get array with actual notes
     actualTimes = inputThread.noteInfoList
@@ -126,10 +138,16 @@ def start_midi_playback(midiFileLocation, guidance, task_data, use_visual_attent
     if len(actualTimes) == 0:  # i.e. they did not play
         print("No notes were played!!!")
 
-    output_note_list, errorVec, errorVecLeft, errorVecRight = \
-        functions.computeErrorEvo(task_data, actualTimes,
-                                  inject_explanation=True,
-                                  plot=True)
+    if online_scorer is not None:
+        output_note_list, errorVec, errorVecLeft, errorVecRight = \
+            functions.computeErrorOnline(online_scorer,
+                                         inject_explanation=True,
+                                         plot=True)
+    else:
+        output_note_list, errorVec, errorVecLeft, errorVecRight = \
+            functions.computeErrorEvo(task_data, actualTimes,
+                                      inject_explanation=True,
+                                      plot=True)
     print("task data", task_data.__dict__)
     print("\n\n--- ERRORS ---")
     print("\nNOTE_ERRORS:")